@@ -0,0 +1,182 @@
+"""
+Admission queue of the proxy: requests wait here for the rate limiters, and
+whenever there is capacity the next request is chosen by
+
+1. priority class: meta (meta-agent, on the critical path of a generation) >
+   agent (forward() during search) > batch (test-set evaluation);
+2. within a class, self-clocked weighted fair queueing over the proxy keys, so
+   one key sending 48 threads of requests cannot starve another key: each key
+   gets a share of the admitted tokens proportional to its weight.
+
+Requests with a deadline are shed (`Shed`) instead of being admitted late: at
+arrival if the expected queueing time already exceeds it, otherwise when it
+passes while they are queued. Shed requests never reach Azure.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+PRIORITIES = {"meta": 0, "agent": 1, "batch": 2}
+DEFAULT_PRIORITY = "agent"
+
+
+class Shed(Exception):
+    """The request was rejected before admission because of its deadline."""
+
+    def __init__(self, reason, retry_after=1.0) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Entry:
+    def __init__(self, key, priority, cost, finish, future) -> None:
+        self.key = key
+        self.priority = priority
+        self.cost = cost
+        self.finish = finish
+        self.future = future
+
+
+class FairQueue:
+    """
+    Attributes:
+    - acquire (coroutine function): Waits until one request may be sent, e.g.
+      for the RPM limiter.
+    - acquire_cost (coroutine function or None): Waits until the chosen
+      request's cost (estimated tokens) may be spent, e.g. for the TPM
+      limiter.
+    - release_cost (coroutine function or None): Gives back a cost taken by
+      `acquire_cost` for a request that was shed or cancelled meanwhile.
+    - weights (dict): Share of each proxy key name, 1 if missing.
+    - rate (float or None): Expected admissions per second, to shed requests
+      whose deadline cannot be met at arrival.
+    """
+
+    def __init__(
+        self, acquire, weights=None, rate=None, acquire_cost=None, release_cost=None
+    ) -> None:
+        self.acquire = acquire
+        self.acquire_cost = acquire_cost
+        self.release_cost = release_cost
+        self.weights = weights if weights is not None else {}
+        self.rate = rate
+
+        self._heaps = {priority: [] for priority in PRIORITIES}
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        # virtual time of each class and the last finish tag of each key in it
+        self._vtime = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish = {}
+        self._seq = itertools.count()
+        self._nonempty = None
+        self._dispatcher = None
+
+    def depth(self, priority=None):
+        """Number of queued requests, of one class or of all."""
+        if priority is not None:
+            return self._waiting[priority]
+        return sum(self._waiting.values())
+
+    def expected_wait(self, priority):
+        """Seconds until the requests queued before a new `priority` request are admitted."""
+        if not self.rate:
+            return 0.0
+        ahead = sum(
+            self._waiting[other]
+            for other, rank in PRIORITIES.items()
+            if rank <= PRIORITIES[priority]
+        )
+        return ahead / self.rate
+
+    async def admit(self, key, priority=DEFAULT_PRIORITY, cost=1, deadline=None):
+        """
+        Wait for the turn of the request.
+
+        Args:
+        - key (str): Name of the proxy key.
+        - priority (str): One of PRIORITIES.
+        - cost (int): Estimated tokens of the request.
+        - deadline (float or None): `time.time()` after which the request is
+          useless to the client.
+
+        Raises:
+        - Shed: If the deadline passed or cannot be met.
+        """
+        self._start()
+        if deadline is not None:
+            remaining = deadline - time.time()
+            expected = self.expected_wait(priority)
+            if remaining <= 0:
+                raise Shed("deadline passed before queueing", retry_after=expected)
+            if expected > remaining:
+                raise Shed(
+                    f"expected queueing {expected:.1f}s exceeds the deadline ({remaining:.1f}s left)",
+                    retry_after=expected,
+                )
+
+        start = max(self._vtime[priority], self._last_finish.get((priority, key), 0.0))
+        finish = start + max(cost, 1) / self.weights.get(key, 1)
+        self._last_finish[(priority, key)] = finish
+        entry = _Entry(
+            key, priority, cost, finish, asyncio.get_running_loop().create_future()
+        )
+        heapq.heappush(self._heaps[priority], (finish, next(self._seq), entry))
+        self._waiting[priority] += 1
+        self._nonempty.set()
+        try:
+            timeout = None if deadline is None else deadline - time.time()
+            # cancels the entry on timeout or client disconnect, the
+            # dispatcher then skips it
+            await asyncio.wait_for(entry.future, timeout)
+        except asyncio.TimeoutError:
+            raise Shed(
+                "deadline passed while queued", retry_after=self.expected_wait(priority)
+            )
+        finally:
+            self._waiting[priority] -= 1
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if (
+            self._dispatcher is None
+            or self._dispatcher.done()
+            or self._dispatcher.get_loop() is not loop
+        ):
+            self._nonempty = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _pop(self):
+        for priority in sorted(PRIORITIES, key=PRIORITIES.get):
+            heap = self._heaps[priority]
+            while heap:
+                finish, _, entry = heapq.heappop(heap)
+                if not entry.future.done():
+                    self._vtime[priority] = finish
+                    return entry
+        return None
+
+    async def _dispatch(self):
+        have_slot = False
+        while True:
+            await self._nonempty.wait()
+            # choose the request only once there is capacity, so that requests
+            # arriving meanwhile compete for it too
+            if not have_slot:
+                await self.acquire()
+                have_slot = True
+            entry = self._pop()
+            if entry is None:
+                self._nonempty.clear()
+                continue
+            if self.acquire_cost is not None:
+                await self.acquire_cost(entry.cost)
+            if entry.future.done():
+                # shed or cancelled while its tokens were awaited: give them
+                # back and keep the request slot for the next request
+                if self.release_cost is not None:
+                    await self.release_cost(entry.cost)
+                continue
+            have_slot = False
+            entry.future.set_result(None)
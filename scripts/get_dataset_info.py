@@ -1,18 +1,37 @@
-from datasets import get_dataset_config_names, load_dataset
+import os
+import sys
 
-# Replace 'dataset_name' with the name of the dataset you want to inspect
-dataset_name = "xk-huang/medagents-benchmark"
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "adas")
+)
 
-# List all subsets (configurations) of the dataset
-subsets = get_dataset_config_names(dataset_name)
+from load_data import DEFAULT_DATA_DIR, get_local_dir, load_manifest
 
-print(f"Split information for each subset of the dataset '{dataset_name}':")
-for subset in subsets:
-    # Load the subset
-    dataset = load_dataset(dataset_name, subset)
 
-    # List the available splits
-    splits = dataset.keys()
-    # the number of examples in each split
-    num_examples = {split: len(dataset[split]) for split in splits}
-    print(f"Subset: {subset}, Number of examples: {num_examples}")
+def main(dataset_name="xk-huang/medagents-benchmark", data_dir=DEFAULT_DATA_DIR):
+    # read the split sizes from the local snapshot (`adas prepare-data`) if any
+    manifest = load_manifest(get_local_dir(data_dir, dataset_name))
+    if manifest is not None:
+        print(f"Split information for each subset of the dataset '{dataset_name}':")
+        for subset, splits in manifest["subsets"].items():
+            num_examples = {split: info["num_rows"] for split, info in splits.items()}
+            print(f"Subset: {subset}, Number of examples: {num_examples}")
+        return
+
+    from datasets import get_dataset_config_names, load_dataset_builder
+
+    # List all subsets (configurations) of the dataset
+    subsets = get_dataset_config_names(dataset_name)
+
+    print(f"Split information for each subset of the dataset '{dataset_name}':")
+    for subset in subsets:
+        # only the metadata of the subset, without downloading the data
+        splits = load_dataset_builder(dataset_name, subset).info.splits
+        # the number of examples in each split
+        num_examples = {split: info.num_examples for split, info in splits.items()}
+        print(f"Subset: {subset}, Number of examples: {num_examples}")
+
+
+if __name__ == "__main__":
+    # Replace 'dataset_name' with the name of the dataset you want to inspect
+    main("xk-huang/medagents-benchmark")
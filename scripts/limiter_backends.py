@@ -0,0 +1,176 @@
+"""
+Token buckets of the proxy rate limiters, behind a backend that decides where
+their state lives:
+
+- LocalBackend: in the process; one uvicorn worker only.
+- SharedMemoryBackend: in /dev/shm files locked with flock; all workers of
+  one host.
+- RedisBackend: in Redis, updated by a Lua script; all proxy instances. Works
+  with any redis-py asyncio client, e.g. `fakeredis.aioredis.FakeRedis()` for
+  tests.
+
+Each backend refills and takes tokens in one atomic step, so N workers or
+hosts share one quota instead of getting N of them.
+
+PROXY_LIMITER=local | shm[:<path prefix>] | redis://host:6379/0
+"""
+
+import asyncio
+import fcntl
+import os
+import re
+import struct
+import threading
+import time
+
+# (tokens, last refill time) of a bucket file
+STATE_FORMAT = "dd"
+
+
+class LocalBackend:
+    def __init__(self) -> None:
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    async def take(self, name, amount, capacity, rate):
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(name, (capacity, now))
+            tokens, wait = _take(tokens, last, now, amount, capacity, rate)
+            self._buckets[name] = (tokens, now)
+        return wait
+
+
+class SharedMemoryBackend:
+    """
+    Attributes:
+    - prefix (str): Path prefix of the bucket files, on a tmpfs such as
+      /dev/shm so that updates never touch the disk.
+    """
+
+    def __init__(self, prefix="/dev/shm/adas_proxy_limiter") -> None:
+        self.prefix = prefix
+        self._fds = {}
+        # flock does not exclude the threads of one process sharing the fd
+        self._lock = threading.RLock()
+
+    def _fd(self, name):
+        with self._lock:
+            if name not in self._fds:
+                path = f"{self.prefix}.{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}"
+                self._fds[name] = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            return self._fds[name]
+
+    async def take(self, name, amount, capacity, rate):
+        # flock blocks while other workers hold the bucket: not on the event loop
+        return await asyncio.to_thread(self._take_locked, name, amount, capacity, rate)
+
+    def _take_locked(self, name, amount, capacity, rate):
+        with self._lock:
+            fd = self._fd(name)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, struct.calcsize(STATE_FORMAT), 0)
+                # wall time, shared by the processes
+                now = time.time()
+                if len(data) == struct.calcsize(STATE_FORMAT):
+                    tokens, last = struct.unpack(STATE_FORMAT, data)
+                else:
+                    tokens, last = capacity, now
+                tokens, wait = _take(tokens, last, now, amount, capacity, rate)
+                os.pwrite(fd, struct.pack(STATE_FORMAT, tokens, now), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        return wait
+
+
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - last, 0) * rate)
+local wait = 0
+if tokens >= amount then
+    tokens = tokens - amount
+else
+    wait = (amount - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """
+    Buckets in Redis hashes `<prefix><name>`; the script uses the server clock,
+    so the hosts' clocks do not need to agree.
+    """
+
+    def __init__(self, client, prefix="adas:proxy:limiter:") -> None:
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+
+    async def take(self, name, amount, capacity, rate):
+        wait = await self._script(
+            keys=[self.prefix + name], args=[capacity, rate, amount]
+        )
+        return float(wait)
+
+
+def _take(tokens, last, now, amount, capacity, rate):
+    """Refill the bucket up to `now` and take `amount` tokens if it has them."""
+    tokens = min(capacity, tokens + max(now - last, 0.0) * rate)
+    if tokens >= amount:
+        return tokens - amount, 0.0
+    return tokens, (amount - tokens) / rate
+
+
+def make_backend(spec="local"):
+    """Backend from a PROXY_LIMITER value."""
+    if spec == "local":
+        return LocalBackend()
+    if spec == "shm" or spec.startswith("shm:"):
+        prefix = spec[len("shm:") :]
+        return SharedMemoryBackend(prefix) if prefix else SharedMemoryBackend()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        import redis.asyncio
+
+        return RedisBackend(redis.asyncio.from_url(spec))
+    raise ValueError(f"Unknown limiter backend: {spec}")
+
+
+class RateLimiter:
+    """
+    `max_rate` units per `time_period` seconds, with bursts up to `max_rate`,
+    like aiolimiter.AsyncLimiter, in the bucket `name` of `backend`.
+    """
+
+    def __init__(self, backend, name, max_rate, time_period=60) -> None:
+        self.backend = backend
+        self.name = name
+        self.max_rate = max_rate
+        self.time_period = time_period
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.max_rate)
+        rate = self.max_rate / self.time_period
+        while True:
+            wait = await self.backend.take(self.name, amount, self.max_rate, rate)
+            if wait <= 0:
+                return
+            # other workers may take the refilled tokens first, then try again
+            await asyncio.sleep(wait)
+
+    async def release(self, amount=1):
+        """Give back `amount` units taken by `acquire` but not spent."""
+        amount = min(amount, self.max_rate)
+        rate = self.max_rate / self.time_period
+        # a negative take always succeeds; the next refill caps the bucket
+        await self.backend.take(self.name, -amount, self.max_rate, rate)
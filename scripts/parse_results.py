@@ -1,48 +1,237 @@
 """
-Parse the json result file.
+Aggregate all run archives under `outputs/` into one Parquet table, then render
+summary tables and plots from it.
 
-python scripts/parse_results.py -i outputs/MedQA_gpt-4o-1120-nofilter-global_results_run_archive_evaluate.json
+python scripts/parse_results.py -o outputs/
+
+Each `*_run_archive.json` (validation) and `*_run_archive_evaluate.json` (test)
+is parsed once into `<output_dir>/_aggregate/parts/`; later runs only re-parse the
+archives that changed. Outputs:
+- `_aggregate/results.parquet`: one row per archive entry.
+- `_aggregate/summary.csv`, `_aggregate/summary.md`: best initial vs. evolved accuracy.
+- `_aggregate/plots/<model>/<dataset>_<split>.png`: accuracy over generations.
 """
 
+import hashlib
 import json
+import re
 from pathlib import Path
 
 import click
-import matplotlib.pyplot as plt
+
+AGGREGATE_DIR = "_aggregate"
+ARCHIVE_PATTERN = re.compile(
+    r"^(?P<dataset>[^_]+)_(?P<model>.+)_results_run_archive(?P<evaluate>_evaluate)?\.json$"
+)
+FITNESS_PATTERN = re.compile(
+    r"\((?P<lower>[-\d.]+)%, (?P<upper>[-\d.]+)%\), Median: (?P<median>[-\d.]+)%"
+)
+# bump to re-parse every archive when the row schema changes
+SCHEMA_VERSION = 1
+
+
+def parse_fitness(fitness):
+    """Return (lower, upper, median) in [0, 1] from a bootstrap fitness string."""
+    match = FITNESS_PATTERN.search(fitness or "")
+    if match is None:
+        return None, None, None
+    return tuple(float(match.group(key)) / 100 for key in ["lower", "upper", "median"])
+
+
+def archive_rows(path, root):
+    """Yield one flat row per entry of the archive at `path`."""
+    match = ARCHIVE_PATTERN.match(path.name)
+    if match is not None:
+        dataset, model = match.group("dataset"), match.group("model")
+        split = "test" if match.group("evaluate") else "valid"
+    else:
+        dataset, model = "unknown", "unknown"
+        split = "test" if path.name.endswith("_evaluate.json") else "valid"
+
+    with open(path, "r") as f:
+        archive = json.load(f)
+
+    for idx, entry in enumerate(archive):
+        generation = entry.get("generation")
+        fitness = entry.get("test_fitness" if split == "test" else "fitness")
+        if "screening" in entry:
+            # measured on the screening subset only, not comparable
+            fitness = None
+        lower, upper, median = parse_fitness(fitness)
+        usage = entry.get("eval_usage") or {}
+        cost = entry.get("cost_estimate") or {}
+        yield {
+            "run": str(path.relative_to(root)),
+            "split": split,
+            "dataset": dataset,
+            "model": model,
+            "idx": idx,
+            "name": entry.get("name"),
+            "initial": generation == "initial",
+            "generation": generation if isinstance(generation, int) else 0,
+            "accuracy": entry.get("accuracy"),
+            "fitness_lower": lower,
+            "fitness_upper": upper,
+            "fitness_median": median,
+            "llm_calls": usage.get("llm_calls"),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "wall_time": usage.get("wall_time"),
+            "est_llm_calls": cost.get("llm_calls"),
+            "est_tokens": cost.get("est_tokens"),
+            "budget_overruns": entry.get("budget_overruns"),
+        }
+
+
+def update_parts(root, force=False):
+    """
+    Parse new or changed archives into per-archive Parquet parts.
+
+    Returns:
+    - list of Path: The parts of all archives currently under `root`.
+    """
+    import pandas as pd
+
+    aggregate_dir = root / AGGREGATE_DIR
+    parts_dir = aggregate_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = aggregate_dir / "manifest.json"
+    manifest = {}
+    if manifest_path.exists() and not force:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    new_manifest = {}
+    n_parsed = 0
+    for path in sorted(root.rglob("*_run_archive*.json")):
+        if AGGREGATE_DIR in path.parts:
+            continue
+        key = str(path.relative_to(root))
+        stat = path.stat()
+        signature = [stat.st_mtime_ns, stat.st_size, SCHEMA_VERSION]
+        part = parts_dir / (hashlib.sha1(key.encode("utf-8")).hexdigest() + ".parquet")
+        entry = manifest.get(key)
+        if entry is None or entry["signature"] != signature or not part.exists():
+            try:
+                rows = list(archive_rows(path, root))
+            except (json.JSONDecodeError, OSError) as e:
+                # e.g. an archive being written by a running search
+                print(f"Skip {key}: {e}")
+                continue
+            pd.DataFrame(rows).to_parquet(part, index=False)
+            n_parsed += 1
+        new_manifest[key] = {"signature": signature, "part": part.name}
+
+    for key, entry in manifest.items():
+        if key not in new_manifest:
+            (parts_dir / entry["part"]).unlink(missing_ok=True)
+
+    with open(manifest_path, "w") as f:
+        json.dump(new_manifest, f, indent=4)
+    print(f"Parsed {n_parsed} new or changed archives, {len(new_manifest)} in total.")
+    return [parts_dir / entry["part"] for entry in new_manifest.values()]
+
+
+def summarize(df):
+    """Best initial vs. best evolved accuracy per (split, dataset, model)."""
+    best = (
+        df.groupby(["split", "dataset", "model", "initial"])["accuracy"]
+        .max()
+        .unstack("initial")
+        .rename(columns={True: "best_initial", False: "best_evolved"})
+    )
+    for column in ["best_initial", "best_evolved"]:
+        if column not in best:
+            best[column] = float("nan")
+    best = best[["best_initial", "best_evolved"]]
+    best["gain"] = best["best_evolved"] - best["best_initial"]
+    best["n_generations"] = (
+        df[~df["initial"]].groupby(["split", "dataset", "model"])["generation"].max()
+    )
+    return best.reset_index()
+
+
+def to_markdown(df):
+    def fmt(value):
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    lines = [
+        "| " + " | ".join(df.columns) + " |",
+        "|" + "---|" * len(df.columns),
+    ]
+    for row in df.itertuples(index=False):
+        lines.append("| " + " | ".join(fmt(value) for value in row) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def plot_runs(df, plots_dir):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    for (split, dataset, model), run_df in df.groupby(["split", "dataset", "model"]):
+        init_df = run_df[run_df["initial"]]
+        evo_df = run_df[~run_df["initial"]].sort_values("generation")
+
+        fig, ax = plt.subplots()
+        ax.plot(evo_df["generation"], evo_df["accuracy"], label="Evo Acc", marker="o")
+        if evo_df["fitness_lower"].notna().any():
+            ax.fill_between(
+                evo_df["generation"],
+                evo_df["fitness_lower"],
+                evo_df["fitness_upper"],
+                alpha=0.2,
+            )
+        ax.scatter(
+            range(len(init_df)), init_df["accuracy"], label="Init Acc", color="red"
+        )
+        ax.set_xlabel("Generation")
+        ax.set_ylabel("Accuracy")
+        ax.set_title(f"Evo Acc vs Init Acc\n{dataset} / {model} / {split}")
+        ax.legend()
+
+        output_fig_path = plots_dir / model / f"{dataset}_{split}.png"
+        output_fig_path.parent.mkdir(parents=True, exist_ok=True)
+        fig.savefig(output_fig_path)
+        plt.close(fig)
 
 
 @click.command()
 @click.option(
-    "--input_json", "-i", type=Path, required=True, help="Path to the input JSON file."
+    "--output_dir",
+    "-o",
+    type=Path,
+    default=Path("outputs"),
+    help="Directory with the run archives.",
 )
-def main(input_json):
+@click.option("--force", is_flag=True, help="Re-parse every archive.")
+@click.option("--no_plots", is_flag=True, help="Only update the tables.")
+def main(output_dir, force, no_plots):
     """
-    Parse the input JSON file and print the performance metrics.
+    Aggregate the run archives and render the summary tables and plots.
     """
-    # Load the JSON data
-    with open(input_json, "r") as f:
-        data = json.load(f)
-
-    init_acc = []
-    evo_acc = []
-    for row in data:
-        if row["generation"] == "initial":
-            init_acc.append(row["accuracy"])
-        else:
-            evo_acc.append(row["accuracy"])
-
-    # Plot the evo acc in a line plot, each init acc as scatter points
-    fig, ax = plt.subplots()
-    ax.plot(evo_acc, label="Evo Acc", marker="o")
-    ax.scatter(range(len(init_acc)), init_acc, label="Init Acc", color="red")
-    ax.set_xlabel("Generation")
-    ax.set_ylabel("Accuracy")
-    ax.set_title(f"Evo Acc vs Init Acc\n{input_json.stem}")
-    ax.legend()
-
-    output_fig_path = input_json.with_suffix(".png")
-    fig.savefig(output_fig_path)
-    print(f"Figure saved to {output_fig_path}")
+    import pandas as pd
+
+    parts = update_parts(output_dir, force=force)
+    if not parts:
+        print(f"No run archive found under {output_dir}")
+        return
+    df = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+
+    aggregate_dir = output_dir / AGGREGATE_DIR
+    df.to_parquet(aggregate_dir / "results.parquet", index=False)
+    print(f"Table with {len(df)} rows saved to {aggregate_dir / 'results.parquet'}")
+
+    summary = summarize(df)
+    summary.to_csv(aggregate_dir / "summary.csv", index=False)
+    with open(aggregate_dir / "summary.md", "w") as f:
+        f.write(to_markdown(summary))
+    print(summary.to_string(index=False))
+
+    if not no_plots:
+        plot_runs(df, aggregate_dir / "plots")
+        print(f"Figures saved to {aggregate_dir / 'plots'}")
 
 
 if __name__ == "__main__":
@@ -1,12 +1,27 @@
 # proxy.py
+import asyncio
 import logging
+import math
 import os
 import time
+from contextlib import asynccontextmanager
 
 import dotenv
 import httpx
-from aiolimiter import AsyncLimiter
-from fastapi import FastAPI, Header, HTTPException, Request
+from fair_queue import DEFAULT_PRIORITY, PRIORITIES, FairQueue, Shed
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from limiter_backends import RateLimiter, make_backend
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from usage_store import QuotaExceeded, UsageStore
 
 dotenv.load_dotenv(override=True)
 
@@ -18,15 +33,113 @@ AZURE_DEPLOY = os.environ["AZURE_DEPLOYMENT"]  # your GPT‑4o deployment name
 AZURE_API_VER = os.getenv("AZURE_API_VERSION")
 
 # Example: 20 000 tokens/minute, 200 requests/minute
-tpm_limiter = AsyncLimiter(max_rate=200_000, time_period=60)
-rpm_limiter = AsyncLimiter(max_rate=400, time_period=60)
+# The buckets are shared by all workers / instances using the same backend:
+# PROXY_LIMITER=local (one worker), shm (workers of one host) or redis://...
+limiter_backend = make_backend(os.getenv("PROXY_LIMITER", "local"))
+tpm_limiter = RateLimiter(
+    limiter_backend, f"{AZURE_DEPLOY}:tpm", max_rate=200_000, time_period=60
+)
+rpm_limiter = RateLimiter(
+    limiter_backend, f"{AZURE_DEPLOY}:rpm", max_rate=400, time_period=60
+)
+
+# per-key usage, flushed to SQLite in batches; the admin key reads reports
+USAGE_DB = os.getenv("PROXY_USAGE_DB", "proxy_usage.db")
+ADMIN_KEY = os.getenv("PROXY_ADMIN_KEY")
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await usage_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 log = logging.getLogger("proxy")
 logging.basicConfig(level=logging.INFO)
 
 # very simple auth layer
 ALLOWED_KEYS = {"student_alice": "k1...", "student_bob": "k2..."}
+# metrics and logs are labeled by key name, never by the key itself
+KEY_NAMES = {key: name for name, key in ALLOWED_KEYS.items()}
+# share of the admitted tokens of each key name under contention, 1 if missing
+KEY_WEIGHTS = {}
+# longest queueing time of each priority class (X-Proxy-Priority) when the
+# client sends no deadline (X-Proxy-Deadline, in seconds), None to never shed
+MAX_QUEUE_SECONDS = {"meta": None, "agent": 300, "batch": None}
+# e.g. {"student_alice": {"daily_tokens": 2_000_000, "monthly_requests": 100_000}},
+# see usage_store.QUOTA_KINDS; keys without quotas are unlimited
+QUOTAS = {}
+usage_store = UsageStore(USAGE_DB, QUOTAS)
+
+
+# a request slot first, then the estimated tokens of the request chosen for it;
+# the tokens of a request shed meanwhile go back to the bucket
+admission_queue = FairQueue(
+    rpm_limiter.acquire,
+    weights=KEY_WEIGHTS,
+    rate=rpm_limiter.max_rate / rpm_limiter.time_period,
+    acquire_cost=tpm_limiter.acquire,
+    release_cost=tpm_limiter.release,
+)
+
+# Prometheus metrics, served at /metrics. With `--workers` > 1, set
+# PROMETHEUS_MULTIPROC_DIR to an empty directory so that the workers' metrics
+# are aggregated.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+REQUESTS = Counter(
+    "proxy_requests_total",
+    "Chat completion requests, by status (upstream status code, or the proxy's)",
+    ["key", "model", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "proxy_request_seconds",
+    "Total time spent in the proxy: limiter wait + upstream",
+    ["key", "model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+LIMITER_WAIT_SECONDS = Histogram(
+    "proxy_limiter_wait_seconds",
+    "Time spent in the admission queue, waiting for the proxy's own rate limiters",
+    ["key", "model", "priority"],
+    buckets=(0,) + LATENCY_BUCKETS,
+)
+UPSTREAM_SECONDS = Histogram(
+    "proxy_upstream_seconds",
+    "Latency of the Azure OpenAI request",
+    ["key", "model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS = Counter(
+    "proxy_tokens_total",
+    "Tokens reported by Azure OpenAI, by type (prompt / completion)",
+    ["key", "model", "type"],
+)
+LIMITER_QUEUE = Gauge(
+    "proxy_limiter_queue_depth",
+    "Requests waiting for the rate limiters",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+SHED = Counter(
+    "proxy_shed_total",
+    "Requests rejected before admission because of their deadline",
+    ["key", "priority"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "proxy_upstream_in_flight",
+    "Requests sent to Azure OpenAI and not answered yet",
+    multiprocess_mode="livesum",
+)
+
+
+@app.get("/metrics")
+def metrics():
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
 
 
 def check_auth(proxy_key: str | None):
@@ -35,31 +148,96 @@ def check_auth(proxy_key: str | None):
         raise HTTPException(401, "Invalid proxy API key")
 
 
+@app.get("/admin/usage")
+async def usage_report(
+    key: str | None = None,
+    period: str | None = None,
+    admin_key: str | None = Header(None, alias="X-Admin-Key"),
+):
+    """Usage of the key names per UTC day and month, e.g. `?period=2026-10`."""
+    if ADMIN_KEY is None or admin_key != ADMIN_KEY:
+        raise HTTPException(403, "Invalid admin key")
+    rows = await asyncio.to_thread(usage_store.report, key, period)
+    return {"quotas": QUOTAS, "usage": rows}
+
+
 @app.post("/v1/chat/completions")
 async def chat_completions(
-    req: Request, proxy_api_key: str | None = Header(None, alias="X-Proxy-Key")
+    req: Request,
+    proxy_api_key: str | None = Header(None, alias="X-Proxy-Key"),
+    priority: str = Header(DEFAULT_PRIORITY, alias="X-Proxy-Priority"),
+    max_seconds: float | None = Header(None, alias="X-Proxy-Deadline"),
 ):
-    check_auth(proxy_api_key)
-    payload = await req.json()
-
-    # Optional guardrails
-    if payload.get("max_tokens", 0) > 16000:
-        raise HTTPException(400, "max_tokens capped at 1000")
-    if payload.get("stream"):
-        raise HTTPException(400, "Streaming disabled via proxy")
-
-    prompt_tokens_est = len(payload["messages"]) * 200  # crude, adjust if you like
-
-    async with tpm_limiter, rpm_limiter:
-        async with httpx.AsyncClient(timeout=60) as client:
-            url = (
-                f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOY}"
-                f"/chat/completions?api-version={AZURE_API_VER}"
+    key = KEY_NAMES.get(proxy_api_key, "unknown")
+    # the deployment the request is sent to; the client's "model" is ignored
+    # and must not create label series
+    model = AZURE_DEPLOY
+    status = "error"  # e.g. upstream timeout
+    start = time.time()
+    try:
+        check_auth(proxy_api_key)
+        try:
+            usage_store.check(key)
+        except QuotaExceeded as e:
+            raise HTTPException(
+                429, e.reason, headers={"Retry-After": str(math.ceil(e.retry_after))}
+            )
+        payload = await req.json()
+
+        # Optional guardrails
+        if payload.get("max_tokens", 0) > 16000:
+            raise HTTPException(400, "max_tokens capped at 1000")
+        if payload.get("stream"):
+            raise HTTPException(400, "Streaming disabled via proxy")
+        if priority not in PRIORITIES:
+            raise HTTPException(
+                400, f"X-Proxy-Priority must be one of {list(PRIORITIES)}"
             )
-            headers = {"api-key": AZURE_KEY}
-            t0 = time.time()
-            r = await client.post(url, headers=headers, json=payload)
-            t1 = time.time()
+
+        prompt_tokens_est = len(payload["messages"]) * 200  # crude, adjust if you like
+
+        # wait for the rate limiters in the admission queue, timed separately
+        # from the upstream request: self-throttling vs. Azure latency
+        if max_seconds is None:
+            max_seconds = MAX_QUEUE_SECONDS[priority]
+        wait_start = time.time()
+        try:
+            with LIMITER_QUEUE.labels(priority).track_inprogress():
+                await admission_queue.admit(
+                    key,
+                    priority,
+                    cost=prompt_tokens_est + payload.get("max_tokens", 0),
+                    deadline=None if max_seconds is None else start + max_seconds,
+                )
+        except Shed as e:
+            SHED.labels(key, priority).inc()
+            raise HTTPException(
+                503,
+                e.reason,
+                headers={"Retry-After": str(max(math.ceil(e.retry_after), 1))},
+            )
+        LIMITER_WAIT_SECONDS.labels(key, model, priority).observe(
+            time.time() - wait_start
+        )
+
+        with UPSTREAM_IN_FLIGHT.track_inprogress():
+            async with httpx.AsyncClient(timeout=60) as client:
+                url = (
+                    f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOY}"
+                    f"/chat/completions?api-version={AZURE_API_VER}"
+                )
+                headers = {"api-key": AZURE_KEY}
+                t0 = time.time()
+                r = await client.post(url, headers=headers, json=payload)
+                t1 = time.time()
+        status = str(r.status_code)
+        UPSTREAM_SECONDS.labels(key, model, status).observe(t1 - t0)
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    finally:
+        REQUESTS.labels(key, model, status).inc()
+        REQUEST_SECONDS.labels(key, model, status).observe(time.time() - start)
 
     # Log usage – prompt & completion tokens come back in Azure’s headers
     r_json = r.json()
@@ -68,9 +246,12 @@ async def chat_completions(
     if "usage" in r_json:
         prompt_tokens = r_json["usage"].get("prompt_tokens", 0)
         completion_tokens = r_json["usage"].get("completion_tokens", 0)
+        TOKENS.labels(key, model, "prompt").inc(prompt_tokens)
+        TOKENS.labels(key, model, "completion").inc(completion_tokens)
+    usage_store.record(key, 1, max(prompt_tokens, 0), max(completion_tokens, 0))
     log.info(
-        "%s | %.1f ms | prompt=%s compl=%s",
-        proxy_api_key,
+        "%s | %.1f ms | prompt=%s compl=%s",
+        key,
         (t1 - t0) * 1e3,
         prompt_tokens,
         completion_tokens,
@@ -87,6 +268,20 @@ curl -H "X-Proxy-Key: k1..." \
            "model":"gpt-4o"
          }'
         
+curl -H "X-Proxy-Key: k1..." \
+     -H "X-Proxy-Priority: batch" \
+     -H "X-Proxy-Deadline: 600" \
+     -H "Content-Type: application/json" \
+     http://localhost:8000/v1/chat/completions \
+     -d '{
+           "messages":[{"role":"user","content":"Hello"}],
+           "model":"gpt-4o"
+         }'
+
+curl -H "X-Admin-Key: $PROXY_ADMIN_KEY" "http://localhost:8000/admin/usage?period=2026-10"
+
+curl -s http://localhost:8000/metrics | grep ^proxy_
+
 curl -H "X-Proxy-Key: k1..." \
      -H "Content-Type: application/json" \
      http://169.233.7.1:8000/v1/chat/completions \
@@ -0,0 +1,254 @@
+"""
+Token / request usage of the proxy keys, per UTC day and month.
+
+Requests are counted in memory, so that the quota check and the accounting on
+the hot path are a few dict operations. A background task flushes the counts
+to SQLite in batches (every `flush_interval` seconds, or sooner once
+`flush_size` updates are pending) and reloads the totals of the current
+periods, so that they survive restarts and converge across uvicorn workers
+sharing the database.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+FIELDS = ("requests", "prompt_tokens", "completion_tokens")
+# quota name -> (period, counted field); tokens = prompt + completion
+QUOTA_KINDS = {
+    "daily_requests": ("day", "requests"),
+    "daily_tokens": ("day", "tokens"),
+    "monthly_requests": ("month", "requests"),
+    "monthly_tokens": ("month", "tokens"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    key TEXT NOT NULL,
+    period TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (key, period)
+);
+"""
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, reason, retry_after) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def current_periods(now=None):
+    """Return the UTC day ("2026-10-19") and month ("2026-10") of `now`."""
+    now = datetime.fromtimestamp(now if now is not None else time.time(), timezone.utc)
+    return {"day": now.strftime("%Y-%m-%d"), "month": now.strftime("%Y-%m")}
+
+
+def seconds_until_reset(period, now=None):
+    now = datetime.fromtimestamp(now if now is not None else time.time(), timezone.utc)
+    if period == "day":
+        reset = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0)
+    else:
+        reset = (now.replace(day=28) + timedelta(days=4)).replace(
+            day=1, hour=0, minute=0, second=0
+        )
+    return (reset.replace(microsecond=0) - now).total_seconds()
+
+
+class UsageStore:
+    """
+    Attributes:
+    - path (str): SQLite database.
+    - quotas (dict): Key name -> {quota name in QUOTA_KINDS: limit}; keys or
+      quotas that are missing are unlimited.
+    """
+
+    def __init__(self, path, quotas=None, flush_interval=5.0, flush_size=256):
+        self.path = path
+        self.quotas = quotas if quotas is not None else {}
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        # (key, period) -> [requests, prompt_tokens, completion_tokens]
+        self._totals = {}
+        self._pending = {}
+        self._n_pending = 0
+        self._periods = current_periods()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = None
+        self._flusher = None
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._reload()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _roll_periods(self):
+        periods = current_periods()
+        if periods != self._periods:
+            # totals of the past periods stay in the database only
+            self._periods = periods
+            self._totals = {
+                key_period: counts
+                for key_period, counts in self._totals.items()
+                if key_period[1] in periods.values()
+            }
+
+    def check(self, key):
+        """
+        Raise QuotaExceeded if `key` used up one of its quotas.
+        """
+        quotas = self.quotas.get(key)
+        if not quotas:
+            return
+        with self._lock:
+            self._roll_periods()
+            for name, limit in quotas.items():
+                period, field = QUOTA_KINDS[name]
+                counts = self._totals.get((key, self._periods[period]), (0, 0, 0))
+                used = counts[0] if field == "requests" else counts[1] + counts[2]
+                if used >= limit:
+                    raise QuotaExceeded(
+                        f"{name} quota of {key} exhausted ({used} / {limit})",
+                        retry_after=seconds_until_reset(period),
+                    )
+
+    def record(self, key, requests=1, prompt_tokens=0, completion_tokens=0):
+        """Count one request of `key`; it is written to the database later."""
+        delta = (requests, prompt_tokens, completion_tokens)
+        with self._lock:
+            self._roll_periods()
+            for period in self._periods.values():
+                for counts in (
+                    self._totals.setdefault((key, period), [0, 0, 0]),
+                    self._pending.setdefault((key, period), [0, 0, 0]),
+                ):
+                    for i, n in enumerate(delta):
+                        counts[i] += n
+            self._n_pending += 1
+            n_pending = self._n_pending
+        self._start()
+        if n_pending >= self.flush_size and self._flush_event is not None:
+            self._flush_event.set()
+
+    def _reload(self):
+        """Replace the totals of the current periods by the database ones."""
+        with self._lock:
+            self._roll_periods()
+            periods = list(self._periods.values())
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key, period, {', '.join(FIELDS)} FROM usage"
+                " WHERE period IN (?, ?)",
+                periods,
+            ).fetchall()
+        with self._lock:
+            totals = {(key, period): list(counts) for key, period, *counts in rows}
+            # the updates counted since the flush are not in the database yet
+            for key_period, counts in self._pending.items():
+                total = totals.setdefault(key_period, [0, 0, 0])
+                for i, n in enumerate(counts):
+                    total[i] += n
+            self._totals = totals
+
+    def flush(self):
+        """Write the pending counts to the database (blocking)."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._n_pending = self._pending, {}, 0
+            if pending:
+                try:
+                    self._write(pending)
+                except sqlite3.Error:
+                    # keep the counts for the next flush
+                    with self._lock:
+                        for key_period, counts in pending.items():
+                            total = self._pending.setdefault(key_period, [0, 0, 0])
+                            for i, n in enumerate(counts):
+                                total[i] += n
+                            self._n_pending += 1
+                    raise
+            self._reload()
+
+    def _write(self, pending):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO usage (key, period, {', '.join(FIELDS)}, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key, period) DO UPDATE SET"
+                " requests = requests + excluded.requests,"
+                " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                " updated_at = excluded.updated_at",
+                [
+                    (key, period, *counts, now)
+                    for (key, period), counts in pending.items()
+                ],
+            )
+
+    def report(self, key=None, period=None):
+        """
+        Usage rows from the database, after a flush.
+
+        Args:
+        - key (str or None): Only this key name.
+        - period (str or None): Only the periods starting with it, e.g. "2026-10"
+          for the month and its days.
+        """
+        self.flush()
+        query = (
+            f"SELECT key, period, {', '.join(FIELDS)}, updated_at FROM usage WHERE 1"
+        )
+        params = []
+        if key is not None:
+            query += " AND key = ?"
+            params.append(key)
+        if period is not None:
+            query += " AND period LIKE ?"
+            params.append(f"{period}%")
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY period, key", params).fetchall()
+        return [
+            dict(zip(("key", "period", *FIELDS, "updated_at"), row)) for row in rows
+        ]
+
+    def _start(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if (
+            self._flusher is None
+            or self._flusher.done()
+            or self._flusher.get_loop() is not loop
+        ):
+            self._flush_event = asyncio.Event()
+            self._flusher = loop.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except sqlite3.Error as e:
+                # keep counting in memory, retry at the next flush
+                print(f"Usage flush to {self.path} failed: {e}")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await asyncio.to_thread(self.flush)
@@ -0,0 +1,134 @@
+"""
+Command line arguments of search / evaluation.
+
+Kept free of heavy imports so that the `adas` CLI can build its parser instantly.
+"""
+
+import argparse
+
+
+def positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be > 0, got {value}")
+    return value
+
+
+def add_search_args(parser):
+    # parser.add_argument('--dataset', type=str, default="MedQA")
+    parser.add_argument(
+        "--dataset_path", type=str, default="xk-huang/medagents-benchmark"
+    )
+    parser.add_argument("--dataset_name", type=str, default="MedQA")
+    parser.add_argument(
+        "--data_dir",
+        type=str,
+        default="data/",
+        help="Root of the local snapshots written by `adas prepare-data`.",
+    )
+    parser.add_argument("--valid_size", type=int, default=128)
+    parser.add_argument("--test_size", type=int, default=800)
+    parser.add_argument("--shuffle_seed", type=int, default=0)
+    parser.add_argument("--n_repeat", type=int, default=1)
+    parser.add_argument("--multiprocessing", action="store_true", default=True)
+    parser.add_argument("--max_workers", type=int, default=48)
+    parser.add_argument("--debug", action="store_true", default=True)
+    parser.add_argument("--save_dir", type=str, default="outputs/")
+    parser.add_argument("--expr_name", type=str, default=None)
+    parser.add_argument("--n_generation", type=int, default=30)
+    parser.add_argument("--debug_max", type=int, default=3)
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        default=False,
+        help="Generate the next proposal while the current candidate is evaluated.",
+    )
+    parser.add_argument("--pipeline_top_k", type=int, default=3)
+    parser.add_argument("--near_duplicate_threshold", type=float, default=0.95)
+    parser.add_argument(
+        "--screen_size",
+        type=int,
+        default=None,
+        help="Rank new candidates on this many of the most discriminative validation questions first; only those reaching the archive median get a full evaluation.",
+    )
+    parser.add_argument("--max_llm_calls", type=int, default=25)
+    parser.add_argument("--max_est_tokens", type=int, default=None)
+    parser.add_argument("--max_calls_per_question", type=int, default=50)
+    parser.add_argument("--max_tokens_per_question", type=int, default=200000)
+    parser.add_argument("--max_seconds_per_question", type=float, default=300)
+    parser.add_argument("--max_overrun_ratio", type=float, default=0.25)
+    parser.add_argument("--adaptive_concurrency", action="store_true", default=False)
+    parser.add_argument("--min_concurrency", type=int, default=1)
+    parser.add_argument("--max_concurrency", type=int, default=128)
+    parser.add_argument("--latency_target", type=float, default=None)
+    parser.add_argument(
+        "--rate_limits",
+        type=str,
+        default=None,
+        help="Per-model RPM/TPM limits as JSON or a JSON file (default: $ADAS_RATE_LIMITS).",
+    )
+    parser.add_argument(
+        "--json_schema",
+        action="store_true",
+        default=False,
+        help="Constrain agent replies with strict JSON schemas, if the deployment supports them.",
+    )
+    parser.add_argument(
+        "--scoring_temperature",
+        type=positive_float,
+        default=1.0,
+        help="Temperature applied to the option probabilities of answer-scoring agents, to calibrate them (> 1 softens overconfident models).",
+    )
+    parser.add_argument(
+        "--context_policy",
+        type=str,
+        nargs="+",
+        choices=["truncate_oldest", "compress_thinking", "fail_fast"],
+        default=["fail_fast"],
+        help="What to do, in order, with agent prompts that do not fit the model's context window.",
+    )
+    parser.add_argument(
+        "--context_window",
+        type=int,
+        default=None,
+        help="Context window of the agent model in tokens (default: by model name). With only fail_fast, prompts are checked only if it is set.",
+    )
+    parser.add_argument(
+        "--lazy_agents",
+        action="store_true",
+        default=False,
+        help="Run agent calls in the background so that independent calls overlap.",
+    )
+    parser.add_argument(
+        "--trace_dir",
+        type=str,
+        default=None,
+        help="Export per-question spans of every evaluation (Chrome trace + OTLP JSON).",
+    )
+    parser.add_argument(
+        "--batch_eval",
+        type=str,
+        choices=["openai", "local"],
+        default=None,
+        help="Run the test evaluation through the Batch API ('local': synchronous stand-in).",
+    )
+    parser.add_argument("--batch_dir", type=str, default=None)
+    parser.add_argument(
+        "--batch_model",
+        type=str,
+        default=None,
+        help="Batch deployment of the agent model (default: $AZURE_BATCH_AGENT_MODEL, else the agent model).",
+    )
+    parser.add_argument("--batch_endpoint", type=str, default="/chat/completions")
+    parser.add_argument("--batch_poll_interval", type=float, default=30.0)
+    parser.add_argument("--batch_idle_seconds", type=float, default=2.0)
+    parser.add_argument(
+        "--queue_db",
+        type=str,
+        default=None,
+        help="Work queue, a SQLite path (workers on this host) or a redis:// URL (workers on any host); if set, questions are evaluated by `adas worker` processes.",
+    )
+    parser.add_argument("--lease_seconds", type=float, default=600)
+    parser.add_argument("--poll_interval", type=float, default=2.0)
+    return parser
@@ -0,0 +1,272 @@
+"""
+Batch-API evaluation: forward() calls are suspended at their LLM requests, the
+pending requests of all questions are sent as one JSONL batch, and the forwards
+resume with the results, wave after wave until all questions are done.
+
+python src/adas/cli.py evaluate --dataset_name MedQA --batch_eval openai
+
+Backends:
+- OpenAIBatchBackend: the (Azure) OpenAI Batch API, at batch price and throughput.
+- LocalBatchBackend: stand-in that runs the batch file through the synchronous
+  API; same files and result format, for testing.
+"""
+
+import json
+import os
+import threading
+import time
+import types
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class BatchRequestError(Exception):
+    """A request of the batch failed or got no result."""
+
+
+def to_namespace(obj):
+    """Turn a response body into an object with attribute access, like the SDK's."""
+    if isinstance(obj, dict):
+        return types.SimpleNamespace(
+            **{key: to_namespace(value) for key, value in obj.items()}
+        )
+    if isinstance(obj, list):
+        return [to_namespace(item) for item in obj]
+    return obj
+
+
+def response_to_dict(response):
+    """Body of a chat completion response returned by the SDK."""
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    usage = response.usage
+    return {
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": choice.message.content},
+            }
+            for choice in response.choices
+        ],
+        "usage": usage
+        and {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.prompt_tokens + usage.completion_tokens,
+        },
+    }
+
+
+def read_jsonl(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class LocalBatchBackend:
+    """
+    Runs every request of the batch file with `create` (e.g. the synchronous
+    client) and writes the results in the Batch API output format.
+    """
+
+    def __init__(self, create, max_workers=16) -> None:
+        self.create = create
+        self.max_workers = max_workers
+
+    def _run_line(self, line):
+        try:
+            body = response_to_dict(self.create(**line["body"]))
+            return {
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "body": body},
+                "error": None,
+            }
+        except Exception as e:
+            return {
+                "custom_id": line["custom_id"],
+                "response": None,
+                "error": {"code": type(e).__name__, "message": str(e)},
+            }
+
+    def run(self, input_path, output_path):
+        lines = read_jsonl(input_path)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            records = list(executor.map(self._run_line, lines))
+        with open(output_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return records
+
+
+class OpenAIBatchBackend:
+    """
+    Uploads the batch file, creates a batch job and polls it until it ends.
+
+    Attributes:
+    - endpoint (str): "/v1/chat/completions" for OpenAI, "/chat/completions" for
+      Azure global batch deployments.
+    """
+
+    FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(
+        self,
+        client,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        poll_interval=30.0,
+    ) -> None:
+        self.client = client
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+
+    def run(self, input_path, output_path):
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        print(f"Submitted batch {batch.id} from {input_path}")
+        while batch.status not in self.FINAL_STATES:
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts is not None:
+                print(
+                    f"Batch {batch.id}: {batch.status}, {counts.completed}/{counts.total} done, {counts.failed} failed"
+                )
+        if batch.status != "completed":
+            print(f"Batch {batch.id} ended as {batch.status}, keep the partial results")
+
+        lines = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id:
+                lines.extend(self.client.files.content(file_id).text.splitlines())
+        with open(output_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+class BatchCollector:
+    """
+    Collects the requests of `n_units` concurrently running forwards and sends
+    them as one batch (wave) once every forward is either waiting for a request
+    or done, or when no new request arrived for `idle_seconds` (e.g. forwards
+    waiting on lazy outputs).
+
+    Attributes:
+    - batch_dir (str): Directory of the `<name>_wave<k>.jsonl` files.
+    - waves (int): Number of batches sent.
+    """
+
+    def __init__(
+        self,
+        backend,
+        n_units,
+        batch_dir,
+        name,
+        url="/v1/chat/completions",
+        idle_seconds=2.0,
+        max_wave=50000,
+    ) -> None:
+        self.backend = backend
+        self.url = url
+        self.n_units = n_units
+        self.batch_dir = batch_dir
+        self.name = name
+        self.idle_seconds = idle_seconds
+        self.max_wave = max_wave
+        self.waves = 0
+        self.n_requests = 0
+
+        self._pending = []
+        self._n_done = 0
+        self._last_request = time.time()
+        self._closed = False
+        self._cond = threading.Condition()
+        os.makedirs(batch_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, body):
+        """Queue one request for the next wave and wait for its response."""
+        future = Future()
+        with self._cond:
+            custom_id = f"{self.name}-{self.n_requests}"
+            self.n_requests += 1
+            self._pending.append((custom_id, body, future))
+            self._last_request = time.time()
+            self._cond.notify_all()
+        return to_namespace(future.result())
+
+    def unit_done(self):
+        with self._cond:
+            self._n_done += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _wave_ready(self):
+        if not self._pending:
+            return False
+        return (
+            len(self._pending) + self._n_done >= self.n_units
+            or len(self._pending) >= self.max_wave
+            or time.time() - self._last_request >= self.idle_seconds
+            or self._closed
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._wave_ready():
+                    if self._closed and not self._pending:
+                        return
+                    self._cond.wait(timeout=self.idle_seconds / 4)
+                wave = self._pending[: self.max_wave]
+                self._pending = self._pending[self.max_wave :]
+            self._send(wave)
+
+    def _send(self, wave):
+        input_path = os.path.join(self.batch_dir, f"{self.name}_wave{self.waves}.jsonl")
+        output_path = input_path.replace(".jsonl", "_output.jsonl")
+        self.waves += 1
+        with open(input_path, "w") as f:
+            for custom_id, body, _ in wave:
+                f.write(
+                    json.dumps(
+                        {
+                            "custom_id": custom_id,
+                            "method": "POST",
+                            "url": self.url,
+                            "body": body,
+                        }
+                    )
+                    + "\n"
+                )
+        print(f"Batch wave {self.waves}: {len(wave)} requests")
+        try:
+            records = {
+                record["custom_id"]: record
+                for record in self.backend.run(input_path, output_path)
+            }
+        except Exception as e:
+            for _, _, future in wave:
+                future.set_exception(BatchRequestError(f"batch failed: {e}"))
+            return
+
+        for custom_id, _, future in wave:
+            record = records.get(custom_id)
+            response = record and record.get("response")
+            if response is not None and response.get("status_code") == 200:
+                future.set_result(response["body"])
+            else:
+                error = (record or {}).get("error") or (response or {}).get("body")
+                future.set_exception(
+                    BatchRequestError(f"{custom_id}: {error or 'no result in batch'}")
+                )
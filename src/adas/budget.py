@@ -0,0 +1,149 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class BudgetExceeded(Exception):
+    """Raised by an LLM call when the budget of the current question is exhausted."""
+
+
+class QuestionBudget:
+    """
+    Call / token / time budget shared by all LLM agents of one forward() call.
+
+    Attributes:
+    - max_calls (int or None): Maximum number of LLM calls.
+    - max_tokens (int or None): Maximum number of prompt + completion tokens.
+    - max_seconds (float or None): Maximum wall time in seconds.
+    """
+
+    def __init__(self, max_calls=None, max_tokens=None, max_seconds=None) -> None:
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.start_time = time.time()
+        # set when the question is done, so that `elapsed` stops there
+        self.end_time = None
+        self.exceeded = None
+        # e.g. repaired / re-asked / wasted LLM responses
+        self.events = Counter()
+        # cascade tier -> calls, tokens and seconds of its LLM calls
+        self.tiers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def elapsed(self):
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    def remaining_seconds(self):
+        if self.max_seconds is None:
+            return None
+        return max(self.max_seconds - self.elapsed, 0.0)
+
+    def _exhausted(self):
+        if self.max_calls is not None and self.calls >= self.max_calls:
+            return f"call budget exhausted ({self.calls} calls, max {self.max_calls})"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return (
+                f"token budget exhausted ({self.tokens} tokens, max {self.max_tokens})"
+            )
+        if self.max_seconds is not None and self.elapsed >= self.max_seconds:
+            return (
+                f"time budget exhausted ({self.elapsed:.1f}s, max {self.max_seconds}s)"
+            )
+        return None
+
+    def start_call(self):
+        """Reserve one LLM call, or raise BudgetExceeded."""
+        with self._lock:
+            reason = self.exceeded or self._exhausted()
+            if reason is not None:
+                self.exceeded = reason
+                raise BudgetExceeded(reason)
+            self.calls += 1
+
+    def check_time(self):
+        """Raise BudgetExceeded if the time budget ran out, e.g. during a call."""
+        with self._lock:
+            if self.max_seconds is not None and self.elapsed >= self.max_seconds:
+                self.exceeded = (
+                    self.exceeded
+                    or f"time budget exhausted ({self.elapsed:.1f}s, max {self.max_seconds}s)"
+                )
+                raise BudgetExceeded(self.exceeded)
+
+    def charge(self, prompt_tokens=0, completion_tokens=0, seconds=0.0):
+        """Charge one LLM response, also to the current cascade tier if any."""
+        tier = _current_tier.get()
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if tier is not None:
+                self.tiers.setdefault(tier, Counter()).update(
+                    calls=1,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    seconds=seconds,
+                )
+
+    def record(self, event, n=1):
+        with self._lock:
+            self.events[event] += n
+
+    def summary(self) -> dict:
+        return {
+            "llm_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "wall_time": self.elapsed,
+            "events": dict(self.events),
+            "tiers": {tier: dict(usage) for tier, usage in self.tiers.items()},
+        }
+
+
+_current_budget = contextvars.ContextVar("question_budget", default=None)
+_current_tier = contextvars.ContextVar("usage_tier", default=None)
+
+
+def current_budget():
+    """Return the QuestionBudget of the running question, or None outside evaluation."""
+    return _current_budget.get()
+
+
+def record_event(event, n=1):
+    """Count `event` on the budget of the running question, if any."""
+    budget = _current_budget.get()
+    if budget is not None:
+        budget.record(event, n)
+
+
+@contextmanager
+def usage_tier(name):
+    """Account the LLM calls made in the block to the cascade tier `name`."""
+    token = _current_tier.set(name)
+    try:
+        yield
+    finally:
+        _current_tier.reset(token)
+
+
+@contextmanager
+def question_budget(max_calls=None, max_tokens=None, max_seconds=None):
+    budget = QuestionBudget(max_calls, max_tokens, max_seconds)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        budget.end_time = time.time()
+        _current_budget.reset(token)
@@ -0,0 +1,176 @@
+"""
+The `adas` command line.
+
+python src/adas/cli.py search --dataset_name MedQA
+python src/adas/cli.py evaluate --dataset_name MedQA
+python src/adas/cli.py worker --queue_db outputs/queue.db
+python src/adas/cli.py prepare-data
+python src/adas/cli.py dataset-info
+python src/adas/cli.py parse-results -o outputs/
+python src/adas/cli.py proxy --port 8000
+
+Heavy modules (openai, datasets, matplotlib, fastapi) are only imported by the
+subcommand that runs, so `--help` and the lightweight subcommands start within
+STARTUP_TARGET seconds. Check it with `--timing` or `python -X importtime`.
+"""
+
+import time
+
+_START_TIME = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import sys
+
+from arguments import add_search_args
+
+STARTUP_TARGET = 0.3  # seconds, from loading the CLI to running the subcommand
+SCRIPTS_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts")
+)
+
+
+def import_script(name):
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    return importlib.import_module(name)
+
+
+def run_search(args):
+    import search
+
+    search.main(args, run_search=True, run_evaluate=not args.skip_evaluate)
+
+
+def run_evaluate(args):
+    import search
+
+    search.main(args, run_search=False, run_evaluate=True)
+
+
+def run_worker(args):
+    import search
+
+    search.run_worker(args)
+
+
+def run_prepare_data(args):
+    from load_data import prepare_data
+
+    prepare_data(args.dataset_path, args.data_dir, seeds=args.seeds)
+
+
+def run_dataset_info(args):
+    import_script("get_dataset_info").main(args.dataset_path, args.data_dir)
+
+
+def run_parse_results(args):
+    import_script("parse_results").main.callback(
+        output_dir=args.output_dir, force=args.force, no_plots=args.no_plots
+    )
+
+
+def run_proxy(args):
+    import uvicorn
+
+    uvicorn.run(
+        "proxy:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=SCRIPTS_DIR,
+    )
+
+
+def get_parser():
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(prog="adas", description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--timing", action="store_true", help="Print the startup time of the CLI."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search_parser = subparsers.add_parser(
+        "search", help="Search agents, then evaluate the archive on the test set."
+    )
+    add_search_args(search_parser)
+    search_parser.add_argument("--skip_evaluate", action="store_true")
+    search_parser.set_defaults(func=run_search)
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate", help="Evaluate an existing archive on the test set."
+    )
+    add_search_args(evaluate_parser)
+    evaluate_parser.set_defaults(func=run_evaluate)
+
+    worker_parser = subparsers.add_parser(
+        "worker", help="Evaluate questions pulled from the work queue of a search."
+    )
+    add_search_args(worker_parser)
+    worker_parser.add_argument(
+        "--worker_idle_timeout",
+        type=float,
+        default=None,
+        help="Exit after the queue has been empty for this many seconds.",
+    )
+    worker_parser.set_defaults(func=run_worker)
+
+    prepare_parser = subparsers.add_parser(
+        "prepare-data",
+        help="Download every dataset subset into a local snapshot for offline runs.",
+    )
+    prepare_parser.add_argument(
+        "--dataset_path", type=str, default="xk-huang/medagents-benchmark"
+    )
+    prepare_parser.add_argument("--data_dir", type=str, default="data/")
+    prepare_parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="Shuffle seeds to precompute permutations for.",
+    )
+    prepare_parser.set_defaults(func=run_prepare_data)
+
+    info_parser = subparsers.add_parser(
+        "dataset-info", help="Print the split sizes of every dataset subset."
+    )
+    info_parser.add_argument(
+        "--dataset_path", type=str, default="xk-huang/medagents-benchmark"
+    )
+    info_parser.add_argument("--data_dir", type=str, default="data/")
+    info_parser.set_defaults(func=run_dataset_info)
+
+    results_parser = subparsers.add_parser(
+        "parse-results",
+        help="Aggregate all run archives into a Parquet table, summary and plots.",
+    )
+    results_parser.add_argument(
+        "--output_dir", "-o", type=Path, default=Path("outputs")
+    )
+    results_parser.add_argument("--force", action="store_true")
+    results_parser.add_argument("--no_plots", action="store_true")
+    results_parser.set_defaults(func=run_parse_results)
+
+    proxy_parser = subparsers.add_parser(
+        "proxy", help="Serve the rate-limited Azure OpenAI proxy."
+    )
+    proxy_parser.add_argument("--host", type=str, default="0.0.0.0")
+    proxy_parser.add_argument("--port", type=int, default=8000)
+    proxy_parser.add_argument("--workers", type=int, default=1)
+    proxy_parser.set_defaults(func=run_proxy)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.timing:
+        startup_time = time.perf_counter() - _START_TIME
+        print(f"Startup time: {startup_time:.3f}s (target: {STARTUP_TARGET}s)")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Errors that mean the deployment is saturated, compared by name so that
+# `openai` does not need to be imported here.
+CONGESTION_ERRORS = {"RateLimitError", "APITimeoutError", "TimeoutException"}
+
+
+def is_congestion_error(e):
+    return type(e).__name__ in CONGESTION_ERRORS
+
+
+class AIMDLimiter:
+    """
+    Adaptive limit on the number of in-flight LLM requests (AIMD, as in TCP).
+
+    The limit grows by `increase` per window of `limit` healthy responses (while
+    at least half of it is in use) and is multiplied by `decrease` on a 429 or a
+    timeout, at most once per `cooldown` seconds so that one burst of errors only
+    cuts it once.
+
+    Attributes:
+    - limit (float): The current concurrency limit.
+    - in_flight (int): The number of requests currently holding a slot.
+    - history (list): (time, limit, in_flight) recorded whenever the limit changes.
+    """
+
+    def __init__(
+        self,
+        initial=8,
+        min_limit=1,
+        max_limit=128,
+        increase=1.0,
+        decrease=0.5,
+        latency_target=None,
+        cooldown=5.0,
+        log_path=None,
+    ) -> None:
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.log_path = log_path
+
+        self.in_flight = 0
+        self.n_success = 0
+        self.n_congestion = 0
+        self.history = []
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._record()
+
+    def _record(self):
+        entry = (time.time(), self.limit, self.in_flight)
+        self.history.append(entry)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(
+                    json.dumps(
+                        {"time": entry[0], "limit": entry[1], "in_flight": entry[2]}
+                    )
+                    + "\n"
+                )
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency):
+        with self._cond:
+            self.n_success += 1
+            if self.latency_target is not None and latency > self.latency_target:
+                return
+            # only probe for more capacity while the current limit is actually used
+            if self.in_flight < self.limit / 2:
+                return
+            if self.limit < self.max_limit:
+                self.limit = min(
+                    self.limit + self.increase / self.limit, self.max_limit
+                )
+                if int(self.limit) != int(self.history[-1][1]):
+                    self._record()
+                self._cond.notify_all()
+
+    def on_congestion(self):
+        with self._cond:
+            self.n_congestion += 1
+            now = time.time()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.limit * self.decrease, self.min_limit)
+            self._record()
+
+    @contextmanager
+    def slot(self):
+        """Hold one request slot; the outcome of the block adjusts the limit."""
+        self.acquire()
+        start_time = time.time()
+        try:
+            yield
+        except Exception as e:
+            if is_congestion_error(e):
+                self.on_congestion()
+            raise
+        else:
+            self.on_success(time.time() - start_time)
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "n_success": self.n_success,
+            "n_congestion": self.n_congestion,
+        }
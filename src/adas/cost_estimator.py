@@ -0,0 +1,400 @@
+import ast
+
+# Rough per-call token figures used by the static estimate.
+SYSTEM_PROMPT_TOKENS = 100
+TASK_TOKENS = 350
+INFO_TOKENS = 250
+OUTPUT_FIELD_TOKENS = 150
+# Inputs of a call that cannot be counted statically (e.g. a growing list).
+UNKNOWN_INPUT_INFOS = 4
+# Iterations assumed for loops whose bound cannot be resolved.
+UNKNOWN_LOOP_BOUND = 10
+# Defaults of CascadeAgent: AZURE_AGENT_MODEL then AZURE_STRONG_AGENT_MODEL.
+CASCADE_TIERS = 2
+CASCADE_SAMPLES = 3
+# Default max_samples of sample_until_consensus.
+CONSENSUS_MAX_SAMPLES = 10
+
+AGENT_CLASSES = {"LLMAgentBase", "CascadeAgent"}
+
+
+class _Agents:
+    """
+    Agents bound to one name: how many instances, how many output fields and
+    how many LLM calls one call of an instance makes at most.
+    """
+
+    def __init__(self, count, n_fields, calls=1):
+        self.count = count
+        self.n_fields = n_fields
+        self.calls = calls
+
+
+class _CostVisitor:
+    """
+    Walk the body of `forward()` and bound the number of LLM calls per question.
+
+    Loop bounds are resolved from integer constants, `range(...)`, `len(...)` and
+    list literals; branches contribute their most expensive side.
+    """
+
+    def __init__(self):
+        self.constants = {}
+        self.agents = {}
+        self.sequences = {}
+        self.functions = {}
+        self.n_agents = 0
+        self.unbounded = False
+
+    # ---- static values ----
+    def _int(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id in self.constants:
+                return self.constants[node.id]
+            if node.id in self.sequences:
+                return self.sequences[node.id]
+        if isinstance(node, ast.BinOp):
+            left, right = self._int(node.left), self._int(node.right)
+            if left is None or right is None:
+                return None
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            if isinstance(node.op, ast.FloorDiv) and right:
+                return left // right
+            return None
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "len"
+            and len(node.args) == 1
+        ):
+            return self._length(node.args[0])
+        return None
+
+    def _length(self, node):
+        """Number of iterations over `node`, or None if unknown."""
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return len(node.elts)
+        if isinstance(node, ast.Name):
+            if node.id in self.agents:
+                return self.agents[node.id].count
+            return self.sequences.get(node.id)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            name, args = node.func.id, node.args
+            if name == "range":
+                bounds = [self._int(a) for a in args]
+                if not bounds or None in bounds:
+                    return None
+                if len(bounds) == 1:
+                    return max(bounds[0], 0)
+                step = bounds[2] if len(bounds) == 3 else 1
+                if step <= 0:
+                    return None
+                return max((bounds[1] - bounds[0] + step - 1) // step, 0)
+            if name in ("enumerate", "reversed", "list", "sorted") and args:
+                return self._length(args[0])
+            if name == "zip" and args:
+                lengths = [self._length(a) for a in args]
+                known = [length for length in lengths if length is not None]
+                return min(known) if known else None
+        if isinstance(node, (ast.ListComp, ast.GeneratorExp)):
+            return self._comprehension_length(node.generators)
+        return None
+
+    def _comprehension_length(self, generators):
+        total = 1
+        for generator in generators:
+            length = self._length(generator.iter)
+            if length is None:
+                self.unbounded = True
+                length = UNKNOWN_LOOP_BOUND
+            total *= length
+        return total
+
+    @staticmethod
+    def _argument(node, position, name):
+        """The argument `name` of a call, passed by keyword or at `position`."""
+        for keyword in node.keywords:
+            if keyword.arg == name:
+                return keyword.value
+        if len(node.args) > position:
+            return node.args[position]
+        return None
+
+    def _cascade_calls(self, node):
+        """
+        Calls of a CascadeAgent that escalates to its last tier: every tier
+        below it samples `n_samples` times with the "agreement" signal (or a
+        signal that cannot be resolved), once otherwise; the last tier
+        answers once.
+        """
+        models = self._argument(node, 3, "models")
+        tiers = self._length(models) if models is not None else CASCADE_TIERS
+        if tiers is None:
+            self.unbounded = True
+            tiers = CASCADE_TIERS
+        signal = self._argument(node, 5, "signal")
+        samples = 1
+        if signal is not None and getattr(signal, "value", None) not in (
+            "confidence",
+            "logprobs",
+        ):
+            n_samples = self._argument(node, 7, "n_samples")
+            samples = CASCADE_SAMPLES if n_samples is None else self._int(n_samples)
+            if samples is None:
+                self.unbounded = True
+                samples = UNKNOWN_LOOP_BOUND
+        return (max(tiers, 1) - 1) * samples + 1
+
+    def _agent_ctor(self, node):
+        """Return _Agents (a single instance) if `node` instantiates an agent."""
+        if not isinstance(node, ast.Call):
+            return None
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+        if name not in AGENT_CLASSES:
+            return None
+        fields = self._argument(node, 0, "output_fields")
+        n_fields = len(fields.elts) if isinstance(fields, (ast.List, ast.Tuple)) else 2
+        calls = self._cascade_calls(node) if name == "CascadeAgent" else 1
+        return _Agents(1, n_fields, calls)
+
+    def _agents_of(self, node):
+        """Return _Agents if `node` evaluates to one or more agent instances."""
+        agent = self._agent_ctor(node)
+        if agent is not None:
+            return agent
+        if isinstance(node, ast.ListComp):
+            agent = self._agent_ctor(node.elt)
+            if agent is not None:
+                return _Agents(
+                    self._comprehension_length(node.generators),
+                    agent.n_fields,
+                    agent.calls,
+                )
+        if isinstance(node, (ast.List, ast.Tuple)) and node.elts:
+            agents = [self._agent_ctor(elt) for elt in node.elts]
+            if None not in agents:
+                return _Agents(
+                    len(agents),
+                    max(agent.n_fields for agent in agents),
+                    max(agent.calls for agent in agents),
+                )
+        if isinstance(node, ast.Name) and node.id in self.agents:
+            return self.agents[node.id]
+        if isinstance(node, ast.Subscript):
+            return self._agents_of(node.value)
+        return None
+
+    # ---- bindings ----
+    def _bind(self, target, value):
+        if not isinstance(target, ast.Name):
+            return
+        agents = self._agents_of(value)
+        if agents is not None:
+            self.agents[target.id] = agents
+            if not isinstance(value, (ast.Name, ast.Subscript)):
+                self.n_agents += agents.count
+            return
+        number = self._int(value)
+        if number is not None:
+            self.constants[target.id] = number
+            return
+        length = self._length(value)
+        if length is not None:
+            self.sequences[target.id] = length
+
+    def _bind_loop_target(self, target, iterable):
+        """Loop variables iterating over agents are agents too."""
+        if isinstance(iterable, ast.Call) and isinstance(iterable.func, ast.Name):
+            if iterable.func.id == "enumerate" and iterable.args:
+                if isinstance(target, ast.Tuple) and len(target.elts) == 2:
+                    self._bind_loop_target(target.elts[1], iterable.args[0])
+                return
+            if iterable.func.id == "zip" and isinstance(target, ast.Tuple):
+                for elt, arg in zip(target.elts, iterable.args):
+                    self._bind_loop_target(elt, arg)
+                return
+        agents = self._agents_of(iterable)
+        if agents is not None and isinstance(target, ast.Name):
+            self.agents[target.id] = _Agents(1, agents.n_fields, agents.calls)
+
+    # ---- cost ----
+    def _call_inputs(self, inputs):
+        if inputs is None:
+            return UNKNOWN_INPUT_INFOS
+        if isinstance(inputs, (ast.List, ast.Tuple)):
+            return len(inputs.elts)
+        if isinstance(inputs, ast.BinOp) and isinstance(inputs.op, ast.Add):
+            left = self._length(inputs.left)
+            right = self._length(inputs.right)
+            return (left or UNKNOWN_INPUT_INFOS) + (right or UNKNOWN_INPUT_INFOS)
+        return self._length(inputs) or UNKNOWN_INPUT_INFOS
+
+    def _expr_cost(self, node):
+        """Return (calls, tokens) of evaluating an expression once."""
+        calls, tokens = 0, 0
+        if isinstance(node, (ast.ListComp, ast.GeneratorExp, ast.SetComp)):
+            for generator in node.generators:
+                self._bind_loop_target(generator.target, generator.iter)
+            times = self._comprehension_length(node.generators)
+            inner_calls, inner_tokens = self._expr_cost(node.elt)
+            return inner_calls * times, inner_tokens * times
+        if isinstance(node, ast.Lambda):
+            return 0, 0
+        for child in ast.iter_child_nodes(node):
+            child_calls, child_tokens = self._expr_cost(child)
+            calls += child_calls
+            tokens += child_tokens
+        if isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Attribute) and func.attr in ("query", "__call__"):
+                func = func.value
+            agents = None
+            if isinstance(func, ast.Call):
+                agents = self._agent_ctor(func)
+            elif isinstance(func, (ast.Name, ast.Subscript)):
+                agents = self._agents_of(func)
+            times, inputs = 1, self._argument(node, 0, "input_infos")
+            if isinstance(func, ast.Name) and func.id == "sample_until_consensus":
+                # every sample is a call of the wrapped agent
+                agent = self._argument(node, 0, "agent")
+                agents = self._agents_of(agent) if agent is not None else None
+                if agents is None:
+                    agents = _Agents(1, 2)
+                inputs = self._argument(node, 1, "input_infos")
+                max_samples = self._argument(node, 4, "max_samples")
+                times = (
+                    CONSENSUS_MAX_SAMPLES
+                    if max_samples is None
+                    else self._int(max_samples)
+                )
+                if times is None:
+                    self.unbounded = True
+                    times = UNKNOWN_LOOP_BOUND
+            if agents is not None:
+                calls += times * agents.calls
+                tokens += (
+                    times
+                    * agents.calls
+                    * (
+                        SYSTEM_PROMPT_TOKENS
+                        + TASK_TOKENS
+                        + INFO_TOKENS * max(self._call_inputs(inputs) - 1, 0)
+                        + OUTPUT_FIELD_TOKENS * agents.n_fields
+                    )
+                )
+            elif isinstance(func, ast.Name) and func.id in self.functions:
+                fn_calls, fn_tokens = self.functions[func.id]
+                calls += fn_calls
+                tokens += fn_tokens
+        return calls, tokens
+
+    def block_cost(self, statements):
+        calls, tokens = 0, 0
+        for statement in statements:
+            statement_calls, statement_tokens = self.stmt_cost(statement)
+            calls += statement_calls
+            tokens += statement_tokens
+        return calls, tokens
+
+    def stmt_cost(self, node):
+        if isinstance(node, (ast.For, ast.AsyncFor)):
+            iter_calls, iter_tokens = self._expr_cost(node.iter)
+            times = self._length(node.iter)
+            if times is None:
+                self.unbounded = True
+                times = UNKNOWN_LOOP_BOUND
+            self._bind_loop_target(node.target, node.iter)
+            body_calls, body_tokens = self.block_cost(node.body)
+            else_calls, else_tokens = self.block_cost(node.orelse)
+            return (
+                iter_calls + body_calls * times + else_calls,
+                iter_tokens + body_tokens * times + else_tokens,
+            )
+        if isinstance(node, ast.While):
+            self.unbounded = True
+            test_calls, test_tokens = self._expr_cost(node.test)
+            body_calls, body_tokens = self.block_cost(node.body)
+            return (
+                (test_calls + body_calls) * UNKNOWN_LOOP_BOUND,
+                (test_tokens + body_tokens) * UNKNOWN_LOOP_BOUND,
+            )
+        if isinstance(node, ast.If):
+            test_calls, test_tokens = self._expr_cost(node.test)
+            branches = [self.block_cost(node.body), self.block_cost(node.orelse)]
+            calls, tokens = max(branches)
+            return test_calls + calls, test_tokens + tokens
+        if isinstance(node, ast.Try):
+            body = self.block_cost(node.body + node.orelse + node.finalbody)
+            handlers = [self.block_cost(handler.body) for handler in node.handlers]
+            handler = max(handlers) if handlers else (0, 0)
+            return body[0] + handler[0], body[1] + handler[1]
+        if isinstance(node, (ast.With, ast.AsyncWith)):
+            return self.block_cost(node.body)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            # cost is charged where the local helper is called
+            self.functions[node.name] = self.block_cost(node.body)
+            return 0, 0
+        if isinstance(node, ast.Assign):
+            cost = self._expr_cost(node.value)
+            for target in node.targets:
+                self._bind(target, node.value)
+            return cost
+        if isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+            return self._expr_cost(node.value) if node.value is not None else (0, 0)
+        if isinstance(node, (ast.Expr, ast.Return)):
+            return self._expr_cost(node.value) if node.value is not None else (0, 0)
+        return 0, 0
+
+
+def estimate_llm_cost(code):
+    """
+    Statically bound the LLM calls and tokens per question of a `forward()` design.
+
+    Args:
+    - code (str): The candidate `forward()` code.
+
+    Returns:
+    - dict: {"llm_calls", "est_tokens", "n_agents", "unbounded"}. `unbounded` is True
+      if some loop bound could not be resolved and was assumed to be UNKNOWN_LOOP_BOUND.
+      None if the code cannot be parsed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    functions = [
+        node
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    ]
+    if not functions:
+        return None
+    forward = next((fn for fn in functions if fn.name == "forward"), functions[0])
+
+    visitor = _CostVisitor()
+    calls, tokens = visitor.block_cost(forward.body)
+    return {
+        "llm_calls": calls,
+        "est_tokens": tokens,
+        "n_agents": visitor.n_agents,
+        "unbounded": visitor.unbounded,
+    }
+
+
+def over_budget(cost, max_llm_calls=None, max_tokens=None):
+    """Return a reason string if `cost` exceeds the per-question budget, else None."""
+    if cost is None:
+        return None
+    if max_llm_calls is not None and cost["llm_calls"] > max_llm_calls:
+        return f"up to {cost['llm_calls']} LLM calls per question (budget: {max_llm_calls})"
+    if max_tokens is not None and cost["est_tokens"] > max_tokens:
+        return f"about {cost['est_tokens']} tokens per question (budget: {max_tokens})"
+    return None
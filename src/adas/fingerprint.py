@@ -0,0 +1,160 @@
+import ast
+import builtins
+import difflib
+import hashlib
+from functools import lru_cache
+
+# Placeholder that replaces every string literal, so that instruction wording,
+# roles and agent names do not change the fingerprint.
+STR_PLACEHOLDER = "<str>"
+
+
+def _bound_names(tree):
+    """
+    Collect the names bound inside the code (in first-seen order).
+    Free names such as `LLMAgentBase`, `Info` or builtins are left untouched.
+    """
+    bound = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.setdefault(node.id, None)
+        elif isinstance(node, ast.arg):
+            bound.setdefault(node.arg, None)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.setdefault(node.name, None)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.setdefault(node.name, None)
+        elif isinstance(node, ast.alias):
+            bound.setdefault((node.asname or node.name).split(".")[0], None)
+    for name in ("self",) + tuple(dir(builtins)):
+        bound.pop(name, None)
+    return {name: f"v{i}" for i, name in enumerate(bound)}
+
+
+class _Normalizer(ast.NodeTransformer):
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def visit_FunctionDef(self, node):
+        node.name = self.mapping.get(node.name, node.name)
+        node.returns = None
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        node.name = self.mapping.get(node.name, node.name)
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        node.id = self.mapping.get(node.id, node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self.mapping.get(node.arg, node.arg)
+        node.annotation = None
+        return node
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            node.name = self.mapping.get(node.name, node.name)
+        return self.generic_visit(node)
+
+    def visit_alias(self, node):
+        name = node.asname or node.name
+        if name in self.mapping:
+            node.asname = self.mapping[name]
+        return node
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str):
+            node.value = STR_PLACEHOLDER
+        return node
+
+    def visit_Expr(self, node):
+        # bare string expressions are comments in disguise
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            return None
+        return self.generic_visit(node)
+
+    def visit_JoinedStr(self, node):
+        # f-strings only carry instruction wording; collapse them to a literal
+        return ast.copy_location(ast.Constant(STR_PLACEHOLDER), node)
+
+
+@lru_cache(maxsize=1024)
+def _normalize(code):
+    """
+    Parse `code` and return (fingerprint, token sequence) of its normalized AST.
+    Comments, whitespace, docstrings, string literals and local variable names
+    are normalized away.
+    """
+    tree = ast.parse(code)
+    tree = _Normalizer(_bound_names(tree)).visit(tree)
+    ast.fix_missing_locations(tree)
+    dump = ast.dump(tree, annotate_fields=False)
+    fingerprint = hashlib.sha256(dump.encode("utf-8")).hexdigest()
+
+    tokens = []
+    for node in ast.walk(tree):
+        token = type(node).__name__
+        if isinstance(node, ast.Name):
+            token += f":{node.id}"
+        elif isinstance(node, ast.Attribute):
+            token += f":{node.attr}"
+        elif isinstance(node, ast.Constant):
+            token += f":{node.value!r}"
+        tokens.append(token)
+    return fingerprint, tuple(tokens)
+
+
+def code_fingerprint(code):
+    """
+    Return the hex digest of the normalized AST of `code`.
+    Raises SyntaxError if `code` cannot be parsed.
+    """
+    return _normalize(code)[0]
+
+
+def code_similarity(code_a, code_b):
+    """
+    Similarity in [0, 1] between two pieces of code, computed on their
+    normalized AST node sequences. Identical fingerprints give 1.0.
+    """
+    fingerprint_a, tokens_a = _normalize(code_a)
+    fingerprint_b, tokens_b = _normalize(code_b)
+    if fingerprint_a == fingerprint_b:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, tokens_a, tokens_b, autojunk=False)
+    # ratio() is 1.0 for equal sequences, cap it below an exact duplicate
+    return min(matcher.ratio(), 1.0 - 1e-6)
+
+
+def find_duplicate(code, archive):
+    """
+    Find the evaluated archive entry most similar to `code`.
+
+    Args:
+    - code (str): The candidate `forward()` code.
+    - archive (list of dict): The archive; only entries with a "fitness" are considered.
+
+    Returns:
+    - tuple: (entry, similarity). `entry` is None if nothing can be compared,
+      similarity is 1.0 for an exact (normalized) duplicate.
+    """
+    try:
+        _normalize(code)
+    except SyntaxError:
+        return None, 0.0
+
+    best, best_similarity = None, 0.0
+    for solution in archive:
+        if "fitness" not in solution or "code" not in solution:
+            continue
+        try:
+            similarity = code_similarity(code, solution["code"])
+        except SyntaxError:
+            continue
+        if similarity > best_similarity:
+            best, best_similarity = solution, similarity
+    return best, best_similarity
@@ -0,0 +1,127 @@
+"""
+Tolerant parsing of the JSON objects returned by the LLM.
+
+`response_format={"type": "json_object"}` does not prevent truncated replies
+(`max_tokens`), Markdown fences or Python-style dicts. `parse_json` recovers
+what it can, so that only the fields that are really missing need a re-ask.
+"""
+
+import ast
+import json
+import re
+
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+# number of trailing ", ..." members dropped when closing a truncated object
+MAX_CUTS = 8
+
+
+class MalformedJSONError(ValueError):
+    """No JSON object could be recovered from `content`."""
+
+    def __init__(self, content) -> None:
+        super().__init__(f"could not parse a JSON object from {content[:200]!r}")
+        self.content = content
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def _literal_eval(text):
+    # e.g. {'answer': 'A'} or True / None values
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+
+
+def _close(text):
+    """Close the open string, arrays and objects at the end of `text`."""
+    stack = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            stack.append("}")
+        elif ch == "[":
+            stack.append("]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text = (text[:-1] if escape else text) + '"'
+    text = text.rstrip().rstrip(",")
+    return text + "".join(reversed(stack))
+
+
+def _repair_truncated(text):
+    """Close a truncated object, dropping its incomplete last members if needed."""
+    for _ in range(MAX_CUTS):
+        obj = _loads(_close(text))
+        if obj is not None:
+            return obj
+        cut = text.rfind(",")
+        if cut <= 0:
+            return None
+        text = text[:cut]
+    return None
+
+
+def _candidates(text):
+    for match in FENCE_PATTERN.finditer(text):
+        yield match.group(1)
+    start = text.find("{")
+    if start != -1:
+        end = text.rfind("}")
+        if end > start:
+            yield text[start : end + 1]
+        yield text[start:]
+
+
+def parse_json(text):
+    """
+    Parse the JSON object in `text`, repairing it if needed.
+
+    Returns:
+    - tuple: (dict, bool) The object and whether it had to be repaired.
+
+    Raises:
+    - MalformedJSONError: If no object can be recovered.
+    """
+    obj = _loads(text)
+    if isinstance(obj, dict):
+        return obj, False
+    for candidate in _candidates(text or ""):
+        for parse in (_loads, _literal_eval, _repair_truncated):
+            obj = parse(candidate)
+            if isinstance(obj, dict):
+                return {str(key): value for key, value in obj.items()}, True
+    raise MalformedJSONError(text or "")
+
+
+def json_schema_format(output_fields, name="agent_output"):
+    """Strict `response_format` asking for exactly `output_fields`, as strings."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: {"type": "string"} for field in output_fields},
+                "required": list(output_fields),
+                "additionalProperties": False,
+            },
+        },
+    }
@@ -0,0 +1,194 @@
+"""
+Lazily resolved agent outputs, so that sequentially written forward() code runs
+its independent LLM calls concurrently.
+
+Inside a `lazy_scope`, `submit` runs an agent call in the background and the call
+returns at once with Infos whose content is a pending `LazyContent`. The agent
+layer passes such Infos on unresolved and waits only when a dependent prompt is
+rendered; reading an Info from forward() (`.content`, unpacking) waits for the
+reply and gives the plain value. So the calls of e.g. a self-consistency loop
+that collects the answer Infos for a final decision agent all overlap, while
+forward() code that works on the strings behaves exactly as without lazy calls.
+Background calls run in a copy of the caller's context, so they are charged to
+the same question budget and nested under the same trace span, but outside the
+lazy scope: the agent calls they make run synchronously.
+"""
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+_scope = contextvars.ContextVar("lazy_scope", default=None)
+_executor = None
+_max_workers = 64
+_lock = threading.Lock()
+
+
+def configure(max_workers):
+    """Set the number of background threads shared by all questions."""
+    global _executor, _max_workers
+    with _lock:
+        _max_workers = max_workers
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # tasks never submit tasks (see `submit`), so a pool thread
+                # never waits for a task that needs a pool thread
+                _executor = ThreadPoolExecutor(
+                    max_workers=_max_workers, thread_name_prefix="lazy-agent"
+                )
+    return _executor
+
+
+def in_lazy_scope():
+    return _scope.get() is not None
+
+
+@contextmanager
+def lazy_scope():
+    """
+    Enable lazy calls for the block; on exit, wait for the calls that were never
+    read and re-raise the first error among them.
+    """
+    pending = []
+    token = _scope.set(pending)
+    try:
+        yield
+        for future in pending:
+            future.result()
+    finally:
+        _scope.reset(token)
+        wait(pending)
+
+
+@contextmanager
+def eager():
+    """Disable lazy calls for the block, e.g. in threads that already run concurrently."""
+    token = _scope.set(None)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _run_eager(fn, *args):
+    with eager():
+        return fn(*args)
+
+
+def submit(fn, *args):
+    """
+    Run `fn(*args)` in the background, in a copy of the current context. The
+    agent calls of `fn` run synchronously in its thread: a task waiting in the
+    shared pool for its own nested tasks could starve it.
+    """
+    future = _get_executor().submit(
+        contextvars.copy_context().run, _run_eager, fn, *args
+    )
+    _scope.get().append(future)
+    return future
+
+
+def _delegate(name):
+    def method(self, *args):
+        return getattr(self.data, name)(*args)
+
+    method.__name__ = name
+    return method
+
+
+class LazyContent:
+    """
+    The value of field `key` of the dict computed by `future`, the content of a
+    pending Info. Behaves like the value (usually a str); any use waits for the
+    future and re-raises its error.
+    """
+
+    def __init__(self, future, key) -> None:
+        self._future = future
+        self._key = key
+        self._infos = {}
+
+    @property
+    def data(self):
+        return self._future.result().get(self._key, "")
+
+    def __getattr__(self, name):
+        # str methods (lower, strip, split...), return plain values
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.data, name)
+
+    def __repr__(self):
+        if not self._future.done():
+            return f"<LazyContent {self._key!r} pending>"
+        return repr(self.data)
+
+    def __str__(self):
+        return str(self.data)
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def __radd__(self, other):
+        return other + self.data
+
+    def __rmul__(self, other):
+        return other * self.data
+
+    for _name in [
+        "__format__",
+        "__eq__",
+        "__ne__",
+        "__lt__",
+        "__le__",
+        "__gt__",
+        "__ge__",
+        "__len__",
+        "__iter__",
+        "__contains__",
+        "__getitem__",
+        "__add__",
+        "__mul__",
+        "__mod__",
+        "__int__",
+        "__float__",
+    ]:
+        locals()[_name] = _delegate(_name)
+    del _name
+
+
+def resolve(obj):
+    """
+    Wait for the lazy values in `obj` (an Info, a LazyContent or a list / tuple
+    of them) and return it with plain values.
+    """
+    if isinstance(obj, LazyContent):
+        return obj.data
+    # Info and other namedtuples with a `content` field
+    if hasattr(obj, "_replace") and hasattr(obj, "content"):
+        # the stored values, reading a lazy Info would wait for them
+        fields = dict(zip(obj._fields, tuple.__iter__(obj)))
+        content = fields["content"]
+        if not isinstance(content, LazyContent):
+            return obj
+        # the same resolved Info every time, for identity-keyed render caches
+        key = tuple(value for field, value in fields.items() if field != "content")
+        if key not in content._infos:
+            fields["content"] = content.data
+            content._infos[key] = obj._make(fields.values())
+        return content._infos[key]
+    if type(obj) in (list, tuple):
+        return type(obj)(resolve(item) for item in obj)
+    return obj
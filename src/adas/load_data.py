@@ -3,9 +3,14 @@ import dotenv
 dotenv.load_dotenv(override=True)
 
 
+import json
+import os
+import time
 from argparse import Namespace
 
-from datasets import concatenate_datasets, load_dataset
+DEFAULT_DATA_DIR = "data/"
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
 
 
 def load_samples(args, mode: str):
@@ -35,6 +40,14 @@ def load_samples(args, mode: str):
         )
     split = MODE_MAPPING[mode]
 
+    local_dir = get_local_dir(getattr(args, "data_dir", DEFAULT_DATA_DIR), dataset_path)
+    manifest = load_manifest(local_dir)
+    if manifest is not None and dataset_name in manifest["subsets"]:
+        return load_local_samples(local_dir, manifest, dataset_name, split, mode, args)
+
+    # NOTE: `datasets` is slow to import, only pay for it when loading data
+    from datasets import concatenate_datasets, load_dataset
+
     print(f"Loading {mode} samples from {dataset_path}/{dataset_name} dataset...")
     print(
         f"Split: {split}, Valid Size: {valid_size}, Test Size: {test_size}, Repeat: {n_repeat}, Shuffle Seed: {shuffle_seed}"
@@ -62,30 +75,156 @@ def load_samples(args, mode: str):
     answers = []
 
     for sample in dataset:
-        question = sample["question"]
-        options = sample["options"]
-        answer = sample["answer"]
-        answer_idx = sample["answer_idx"]
-
-        if options[answer_idx] != answer:
-            raise ValueError(
-                f"Answer {answer_idx}: {answer} does not match the option {options[answer_idx]}."
-            )
-        str_format_input_dict = {
-            "Question": question,
-            "Options": "\n".join(
-                [f"({key}) {value}" for key, value in options.items()]
-            ),
-        }
-
-        question_str = format_multichoice_question(str_format_input_dict)
+        question_str, answer_idx = format_sample(sample)
         questions.append(question_str)
-
         answers.append(answer_idx)
 
     return questions, answers
 
 
+def format_sample(sample):
+    """
+    Format one dataset row into the multichoice prompt.
+
+    Returns:
+    - tuple: (question_str, answer_idx)
+    """
+    question = sample["question"]
+    options = sample["options"]
+    answer = sample["answer"]
+    answer_idx = sample["answer_idx"]
+
+    if options[answer_idx] != answer:
+        raise ValueError(
+            f"Answer {answer_idx}: {answer} does not match the option {options[answer_idx]}."
+        )
+    str_format_input_dict = {
+        "Question": question,
+        "Options": "\n".join([f"({key}) {value}" for key, value in options.items()]),
+    }
+    return format_multichoice_question(str_format_input_dict), answer_idx
+
+
+def get_local_dir(data_dir, dataset_path):
+    return os.path.join(data_dir, dataset_path)
+
+
+def load_manifest(local_dir):
+    """Return the manifest of the local snapshot, or None if there is none."""
+    manifest_path = os.path.join(local_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        print(f"Ignore {manifest_path}: outdated format, run `adas prepare-data`.")
+        return None
+    return manifest
+
+
+def shuffle_permutation(num_rows, seed):
+    # the permutation of `datasets.Dataset.shuffle(seed=seed)`
+    import numpy as np
+
+    return np.random.default_rng(seed).permutation(num_rows)
+
+
+def load_local_samples(local_dir, manifest, dataset_name, split, mode, args):
+    """
+    Load samples from the snapshot written by `prepare_data`. Picks the same
+    rows in the same order as the hub path, without network access.
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    split_info = manifest["subsets"][dataset_name][split]
+    num_rows = split_info["num_rows"]
+    size = args.valid_size if mode == "search" else args.test_size
+    size = min(size, num_rows)
+    print(
+        f"Loading {mode} samples from local snapshot {local_dir}/{dataset_name}, "
+        f"Split: {split}, Size: {size}/{num_rows}, Repeat: {args.n_repeat}, Shuffle Seed: {args.shuffle_seed}"
+    )
+
+    subset_dir = os.path.join(local_dir, dataset_name)
+    permutation_path = os.path.join(subset_dir, f"{split}.seed{args.shuffle_seed}.npy")
+    if os.path.exists(permutation_path):
+        permutation = np.load(permutation_path, mmap_mode="r")
+    else:
+        permutation = shuffle_permutation(num_rows, args.shuffle_seed)
+    indices = pa.array(np.asarray(permutation[:size]))
+
+    with pa.memory_map(os.path.join(subset_dir, split_info["file"]), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+        table = table.select(["question_str", "answer_idx"]).take(indices)
+        questions = table.column("question_str").to_pylist()
+        answers = table.column("answer_idx").to_pylist()
+
+    return questions * args.n_repeat, answers * args.n_repeat
+
+
+def prepare_data(dataset_path, data_dir=DEFAULT_DATA_DIR, seeds=(0,), subsets=None):
+    """
+    Download every subset of `dataset_path` into a local memory-mapped snapshot.
+
+    Each split is one Arrow IPC file with the raw columns plus the formatted
+    `question_str`, next to the shuffle permutation of every seed in `seeds`.
+    The split sizes go to `manifest.json`, so that dataset info needs no loading.
+
+    Args:
+    - dataset_path (str): Dataset on the hub.
+    - data_dir (str): Root of the local snapshots.
+    - seeds (list of int): Shuffle seeds to precompute permutations for.
+    - subsets (list of str or None): Subsets to download, all of them if None.
+
+    Returns:
+    - dict: The manifest.
+    """
+    import numpy as np
+    import pyarrow as pa
+    from datasets import get_dataset_config_names, load_dataset
+
+    local_dir = get_local_dir(data_dir, dataset_path)
+    if subsets is None:
+        subsets = get_dataset_config_names(dataset_path)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "dataset_path": dataset_path,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seeds": list(seeds),
+        "subsets": {},
+    }
+    for subset in subsets:
+        subset_dir = os.path.join(local_dir, subset)
+        os.makedirs(subset_dir, exist_ok=True)
+        dataset_dict = load_dataset(dataset_path, subset)
+        manifest["subsets"][subset] = {}
+        for split, dataset in dataset_dict.items():
+            question_strs = [format_sample(sample)[0] for sample in dataset]
+            table = dataset.flatten_indices().data.table
+            table = table.append_column("question_str", pa.array(question_strs))
+            file_name = f"{split}.arrow"
+            with pa.OSFile(os.path.join(subset_dir, file_name), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            for seed in seeds:
+                np.save(
+                    os.path.join(subset_dir, f"{split}.seed{seed}.npy"),
+                    shuffle_permutation(len(dataset), seed),
+                )
+            manifest["subsets"][subset][split] = {
+                "num_rows": len(dataset),
+                "file": file_name,
+            }
+        print(f"Subset: {subset}, Number of examples: {dataset_dict.num_rows}")
+
+    with open(os.path.join(local_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Saved the snapshot to {local_dir}")
+    return manifest
+
+
 QUERY_TEMPLATE_MULTICHOICE = """
 Answer the following multiple choice question.
 
@@ -107,6 +246,7 @@ def main():
         test_size=800,
         shuffle_seed=0,
         n_repeat=1,
+        data_dir=DEFAULT_DATA_DIR,
     )
     questions, answers = load_samples(args, "search")
     breakpoint()
@@ -308,15 +308,20 @@ class LLMAgentBase:
     - role (str): Role description for the agent.
     - model (str): Model to be used. (option. Keep it default.)
     - temperature (float): Sampling temperature.
+    - answer_scoring (bool): Answer with a single option letter chosen by its token probability instead of a JSON
+      reply; much faster and cheaper, but only the 'answer' field is filled and the other fields are empty. Use it
+      for final decision agents whose reasoning is not needed. `agent.score(input_infos, instruction)` returns the
+      probability of each option, e.g. {'A': 0.7, 'B': 0.2, 'C': 0.06, 'D': 0.04}, as a confidence signal.
     - id (str): Unique identifier for the agent instance.
     \"""
 
-    def __init__(self, output_fields: list, agent_name: str, role='helpful assistant', model='gpt-3.5-turbo-0125', temperature=0.5) -> None:
+    def __init__(self, output_fields: list, agent_name: str, role='helpful assistant', model='gpt-3.5-turbo-0125', temperature=0.5, answer_scoring=False) -> None:
         self.output_fields = output_fields
         self.agent_name = agent_name
         self.role = role
         self.model = model
         self.temperature = temperature
+        self.answer_scoring = answer_scoring
         self.id = random_id()
     
     def generate_prompt(self, input_infos, instruction) -> str:
@@ -405,6 +410,52 @@ class LLMAgentBase:
         # It is a good practice to always include 'thinking' in the output.
         return self.query(input_infos, instruction, iteration_idx=iteration_idx)
 
+def sample_until_consensus(agent, input_infos, instruction, answer_field='answer', max_samples=10, wave_size=3, threshold=0.9):
+    \"""
+    Self-consistency with early stopping. Queries the same agent in concurrent waves of `wave_size` samples
+    and stops as soon as the majority answer is statistically settled (e.g. after 3 unanimous samples),
+    so an ensemble only pays for the samples it needs. Use a higher temperature for the agent to get varied samples.
+    
+    Args:
+    - agent (LLMAgentBase): The agent to sample, whose output fields include `answer_field`.
+    - input_infos (list): List of input information.
+    - instruction (str): Instruction for the task.
+    - answer_field (str): The output field voted on.
+    - max_samples (int): Maximum number of samples.
+    - wave_size (int): Number of samples drawn concurrently.
+    - threshold (float): Posterior probability that the majority answer beats the runner-up, to stop at.
+    
+    Returns:
+    - answer (Info): The majority answer.
+    - samples (list[list[Info]]): The outputs of every sample drawn, e.g. to pass their thinking to another agent.
+    
+    Example:
+    cot_agent = LLMAgentBase(['thinking', 'answer'], 'Chain-of-Thought Agent', temperature=0.8)
+    answer, samples = sample_until_consensus(cot_agent, [taskInfo], cot_instruction, max_samples=10)
+    \"""
+
+class CascadeAgent:
+    \"""
+    Drop-in replacement for LLMAgentBase that answers with a cheap model first and escalates to a stronger
+    model only when its confidence is low, so most questions are answered at the cheap model's cost.
+    
+    Attributes:
+    - output_fields (list): Fields expected in the output.
+    - agent_name (str): Name of the agent.
+    - role (str): Role description for the agent.
+    - models (list): Models from the cheapest to the strongest. (option. Keep it default.)
+    - temperature (float): Sampling temperature.
+    - signal (str): When to escalate: 'confidence' (the cheap model's self-reported confidence), 'agreement'
+      (whether `n_samples` cheap samples agree) or 'logprobs' (the probability of the answer option).
+    - threshold (float): Confidence between 0 and 1 needed to keep the cheap answer.
+    
+    Example:
+    final_decision_agent = CascadeAgent(['thinking', 'answer'], 'Final Decision Agent', signal='agreement')
+    thinking, answer = final_decision_agent([taskInfo] + all_thinking, final_decision_instruction)
+    \"""
+    def __init__(self, output_fields: list, agent_name: str, role='helpful assistant', models=None, temperature=0.5, signal='confidence', threshold=0.8, n_samples=3, answer_field='answer') -> None:
+        ...
+
 class AgentArchitecture:
     \"""
     Fill in your code here.
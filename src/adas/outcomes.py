@@ -0,0 +1,255 @@
+import hashlib
+import os
+from collections import Counter
+
+import numpy as np
+
+MISSING = -1
+
+
+def question_ids(questions):
+    """
+    Stable ids of the questions: a hash of the question text, suffixed with the
+    occurrence number so that repeated questions (n_repeat > 1) stay distinct.
+    """
+    seen = Counter()
+    ids = []
+    for question in questions:
+        digest = hashlib.sha1(question.encode("utf-8")).hexdigest()[:12]
+        ids.append(f"{digest}-{seen[digest]}")
+        seen[digest] += 1
+    return ids
+
+
+class OutcomeMatrix:
+    """
+    Per-question 0/1 outcomes of the evaluated candidates.
+
+    Attributes:
+    - names (list of str): Row keys, one per candidate.
+    - question_ids (list of str): Column keys, one per question.
+    - outcomes (np.ndarray): int8 matrix (candidates x questions), MISSING if the
+      candidate was not evaluated on the question.
+    """
+
+    def __init__(self, names=None, question_ids=None, outcomes=None) -> None:
+        self.names = list(names) if names is not None else []
+        self.question_ids = list(question_ids) if question_ids is not None else []
+        if outcomes is None:
+            outcomes = np.full(
+                (len(self.names), len(self.question_ids)), MISSING, dtype=np.int8
+            )
+        self.outcomes = np.asarray(outcomes, dtype=np.int8)
+        self._columns = {qid: i for i, qid in enumerate(self.question_ids)}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        data = np.load(path, allow_pickle=False)
+        return cls(
+            data["names"].tolist(), data["question_ids"].tolist(), data["outcomes"]
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # write then rename, so that a crash never leaves a truncated file
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            names=np.array(self.names, dtype=str),
+            question_ids=np.array(self.question_ids, dtype=str),
+            outcomes=self.outcomes,
+        )
+        os.replace(tmp_path, path)
+
+    def add(self, name, question_ids, acc_list):
+        """Set the outcomes of candidate `name` (replacing a previous row)."""
+        new_ids = [qid for qid in question_ids if qid not in self._columns]
+        if new_ids:
+            for qid in new_ids:
+                self._columns[qid] = len(self.question_ids)
+                self.question_ids.append(qid)
+            padding = np.full((len(self.names), len(new_ids)), MISSING, dtype=np.int8)
+            self.outcomes = np.concatenate([self.outcomes, padding], axis=1)
+
+        row = np.full(len(self.question_ids), MISSING, dtype=np.int8)
+        row[[self._columns[qid] for qid in question_ids]] = acc_list
+        if name in self.names:
+            self.outcomes[self.names.index(name)] = row
+        else:
+            self.names.append(name)
+            self.outcomes = np.concatenate([self.outcomes, row[None]], axis=0)
+
+    def accuracy(self):
+        """Mean accuracy of every candidate over its evaluated questions."""
+        mask = self.outcomes != MISSING
+        return np.where(mask, self.outcomes, 0).sum(axis=1) / np.maximum(
+            mask.sum(axis=1), 1
+        )
+
+    def item_statistics(self):
+        """
+        IRT-style item analysis of the questions, from the candidates evaluated
+        on them: how hard each question is and how well it separates strong
+        from weak candidates.
+
+        Returns:
+        - dict of np.ndarray (one value per question): "n" (candidates
+          evaluated), "p_correct", "difficulty" (logit of the error rate, like
+          the IRT b parameter) and "discrimination" (point-biserial correlation
+          of the outcome with the candidate's accuracy on the other questions,
+          0 if it is undefined, e.g. all candidates agree).
+        """
+        mask = (self.outcomes != MISSING).astype(np.float64)
+        correct = np.where(self.outcomes == 1, 1.0, 0.0)
+        n = mask.sum(axis=0)
+        p_correct = correct.sum(axis=0) / np.maximum(n, 1)
+        clipped = np.clip(p_correct, 0.5 / np.maximum(n, 1), 1 - 0.5 / np.maximum(n, 1))
+        difficulty = np.log((1 - clipped) / clipped)
+
+        # accuracy of each candidate without the question itself
+        rest_n = mask.sum(axis=1, keepdims=True) - mask
+        rest = (correct.sum(axis=1, keepdims=True) - correct) / np.maximum(rest_n, 1)
+        mask = mask * (rest_n > 0)
+        n_pairs = np.maximum(mask.sum(axis=0), 1)
+        mean_x = (mask * correct).sum(axis=0) / n_pairs
+        mean_r = (mask * rest).sum(axis=0) / n_pairs
+        cov = (mask * (correct - mean_x) * (rest - mean_r)).sum(axis=0)
+        var_x = (mask * (correct - mean_x) ** 2).sum(axis=0)
+        var_r = (mask * (rest - mean_r) ** 2).sum(axis=0)
+        denominator = np.sqrt(var_x * var_r)
+        discrimination = np.where(
+            (denominator > 1e-12) & (mask.sum(axis=0) >= 3),
+            cov / np.maximum(denominator, 1e-12),
+            0.0,
+        )
+        return {
+            "n": n.astype(int),
+            "p_correct": p_correct,
+            "difficulty": difficulty,
+            "discrimination": discrimination,
+        }
+
+    def screening_subset(self, size, question_ids=None, min_candidates=3):
+        """
+        The `size` most discriminative questions, to rank new candidates on
+        before a full evaluation. Questions answered alike by all candidates,
+        or by fewer than `min_candidates`, carry no ranking signal and are left
+        out, so the subset may be smaller.
+
+        Args:
+        - question_ids (list of str or None): Only choose among these.
+
+        Returns:
+        - list of str: Question ids, most discriminative first.
+        """
+        stats = self.item_statistics()
+        allowed = set(question_ids) if question_ids is not None else None
+        candidates = [
+            i
+            for i, qid in enumerate(self.question_ids)
+            if (allowed is None or qid in allowed)
+            and stats["n"][i] >= min_candidates
+            and stats["discrimination"][i] > 0
+        ]
+        # ties: the question closest to 50% correct tells most
+        candidates.sort(
+            key=lambda i: (
+                -stats["discrimination"][i],
+                abs(stats["p_correct"][i] - 0.5),
+            )
+        )
+        return [self.question_ids[i] for i in candidates[:size]]
+
+    def subset_accuracy(self, question_ids):
+        """
+        Accuracy of every candidate on `question_ids`, NaN for candidates
+        evaluated on none of them.
+        """
+        columns = [self._columns[qid] for qid in question_ids if qid in self._columns]
+        outcomes = self.outcomes[:, columns]
+        mask = outcomes != MISSING
+        n = mask.sum(axis=1)
+        return np.where(
+            n > 0, np.where(mask, outcomes, 0).sum(axis=1) / np.maximum(n, 1), np.nan
+        )
+
+    def paired_bootstrap(
+        self, ref, num_bootstrap_samples=10000, confidence_level=0.95, seed=0
+    ):
+        """
+        Paired bootstrap of the accuracy difference of every candidate minus `ref`,
+        on the questions both were evaluated on. Vectorized over all candidates.
+
+        Args:
+        - ref (str or int): Name or row index of the reference candidate.
+
+        Returns:
+        - dict of np.ndarray (one value per candidate): "diff" (mean difference),
+          "ci_lower", "ci_upper" and "p_value" (two-sided bootstrap p-value).
+        """
+        ref = self.names.index(ref) if isinstance(ref, str) else ref
+        mask = (self.outcomes != MISSING) & (self.outcomes[ref] != MISSING)
+        diff = np.where(mask, self.outcomes - self.outcomes[ref], 0).astype(np.float32)
+        mask = mask.astype(np.float32)
+        n_questions = len(self.question_ids)
+
+        # resample questions once, shared by all candidates (B x Q counts)
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(
+            n_questions,
+            np.full(n_questions, 1.0 / max(n_questions, 1)),
+            size=num_bootstrap_samples,
+        ).astype(np.float32)
+        boot_n = counts @ mask.T
+        boot_diff = (counts @ diff.T) / np.maximum(boot_n, 1)
+
+        lower = (1.0 - confidence_level) / 2.0
+        mean_diff = diff.sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        p_value = 2 * np.minimum(
+            (boot_diff <= 0).mean(axis=0), (boot_diff >= 0).mean(axis=0)
+        )
+        return {
+            "diff": mean_diff,
+            "ci_lower": np.percentile(boot_diff, lower * 100, axis=0),
+            "ci_upper": np.percentile(boot_diff, (1.0 - lower) * 100, axis=0),
+            "p_value": np.minimum(p_value, 1.0),
+        }
+
+    def mcnemar(self, ref):
+        """
+        Exact McNemar test of every candidate against `ref`, vectorized.
+
+        Returns:
+        - dict of np.ndarray: "b" (questions only the candidate solves), "c"
+          (questions only `ref` solves) and the two-sided "p_value".
+        """
+        from scipy.stats import binom
+
+        ref = self.names.index(ref) if isinstance(ref, str) else ref
+        mask = (self.outcomes != MISSING) & (self.outcomes[ref] != MISSING)
+        b = ((self.outcomes == 1) & (self.outcomes[ref] == 0) & mask).sum(axis=1)
+        c = ((self.outcomes == 0) & (self.outcomes[ref] == 1) & mask).sum(axis=1)
+        p_value = np.minimum(2 * binom.cdf(np.minimum(b, c), b + c, 0.5), 1.0)
+        return {"b": b, "c": c, "p_value": p_value}
+
+    def compare(self, name, ref):
+        """One-line paired comparison of candidate `name` against `ref`."""
+        i = self.names.index(name)
+        boot = self.paired_bootstrap(ref)
+        test = self.mcnemar(ref)
+        return (
+            f"{boot['diff'][i] * 100:+.1f}% vs {ref} "
+            f"(paired 95% CI: {boot['ci_lower'][i] * 100:+.1f}%, {boot['ci_upper'][i] * 100:+.1f}%; "
+            f"McNemar p={test['p_value'][i]:.3f})"
+        )
+
+    def compare_to_best(self, name):
+        """Paired comparison of `name` against the most accurate other candidate."""
+        accuracy = self.accuracy()
+        others = [i for i, other in enumerate(self.names) if other != name]
+        if not others:
+            return None
+        best = max(others, key=lambda i: accuracy[i])
+        return self.compare(name, self.names[best])
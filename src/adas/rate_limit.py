@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate_per_minute`.
+
+    The balance may go negative when a reservation is reconciled with a larger
+    actual amount; later acquisitions then wait for the debt to be repaid.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self._last) * self.rate, self.capacity)
+        self._last = now
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """Take (or give back, if negative) `amount` tokens without waiting."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens - amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits of one model deployment.
+
+    Attributes:
+    - rpm (TokenBucket or None): Request bucket.
+    - tpm (TokenBucket or None): Token bucket, charged with the estimated prompt
+      tokens plus `max_tokens` and reconciled with the actual usage.
+    """
+
+    def __init__(self, rpm=None, tpm=None) -> None:
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, est_tokens):
+        if self.rpm is not None:
+            self.rpm.acquire(1)
+        if self.tpm is not None:
+            self.tpm.acquire(est_tokens)
+
+    def reconcile(self, est_tokens, actual_tokens):
+        if self.tpm is not None:
+            self.tpm.adjust(actual_tokens - est_tokens)
+
+
+# model -> RateLimiter, shared by all threads of the process
+_RATE_LIMITERS = {}
+_RATE_LIMITS = {}
+_lock = threading.Lock()
+
+
+def configure_rate_limits(config):
+    """
+    Set the per-model limits.
+
+    Args:
+    - config (dict or str): {model: {"rpm": int, "tpm": int}}, a JSON string or the
+      path of a JSON file. The "*" entry applies to all other models.
+    """
+    if isinstance(config, str):
+        if os.path.exists(config):
+            with open(config, "r") as f:
+                config = json.load(f)
+        else:
+            config = json.loads(config)
+    with _lock:
+        _RATE_LIMITS.clear()
+        _RATE_LIMITS.update(config or {})
+        _RATE_LIMITERS.clear()
+
+
+def get_rate_limiter(model):
+    """Return the RateLimiter of `model`, or None if it is not rate limited."""
+    limiter = _RATE_LIMITERS.get(model)
+    if limiter is not None:
+        return limiter
+    limits = _RATE_LIMITS.get(model, _RATE_LIMITS.get("*"))
+    if not limits:
+        return None
+    with _lock:
+        if model not in _RATE_LIMITERS:
+            _RATE_LIMITERS[model] = RateLimiter(limits.get("rpm"), limits.get("tpm"))
+        return _RATE_LIMITERS[model]
@@ -1,42 +1,89 @@
 import argparse
+import contextvars
 import copy
+import hashlib
 import json
+import math
 import os
 import random
-from collections import namedtuple
+import re
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
 
 import backoff
-
-# client = openai.OpenAI()
 import dotenv
+import lazy
 import numpy as np
-import openai
-import pandas
+from arguments import add_search_args
+from batch_eval import BatchCollector, LocalBatchBackend, OpenAIBatchBackend
+from budget import (
+    BudgetExceeded,
+    current_budget,
+    question_budget,
+    record_event,
+    usage_tier,
+)
+from concurrency import AIMDLimiter
+from cost_estimator import estimate_llm_cost, over_budget
+from fingerprint import find_duplicate
+from json_repair import MalformedJSONError, json_schema_format, parse_json
+from lazy import LazyContent, in_lazy_scope, lazy_scope, resolve
 from load_data import load_samples
 from med_prompt import get_init_archive, get_prompt, get_reflexion_prompt
+from outcomes import OutcomeMatrix, question_ids
+from rate_limit import configure_rate_limits, get_rate_limiter
 from tqdm import tqdm
+from tracing import Tracer, current_span, span
+from utils import (
+    bootstrap_confidence_interval,
+    count_tokens,
+    format_multichoice_question,
+    majority_confidence,
+    random_id,
+    shorten_middle,
+)
+from work_queue import TaskError, open_work_queue
 
 dotenv.load_dotenv(override=True)
 
-# NOTE(xk): use azure openai
-client = openai.AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_ENDPOINT"),
-    api_key=os.getenv("AZURE_API_KEY"),
-    api_version=os.getenv("AZURE_API_VERSION"),
-)
+# NOTE: `openai` is slow to import, so the client is built on first use.
+client = None
+_client_lock = threading.Lock()
 
-# You want to use the local fastapi server
-# client = openai.OpenAI(
-#     base_url="http://localhost:8000/v1",  # note the /v1 suffix
-#     default_headers={"X-Proxy-Key": os.getenv("LOCAL_FAST_API_KEY")},
-# )
 
-if os.getenv("DEBUG_API", None) is not None:
+def get_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                import openai
+
+                # client = openai.OpenAI()
+                # NOTE(xk): use azure openai
+                client = openai.AzureOpenAI(
+                    azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+                    api_key=os.getenv("AZURE_API_KEY"),
+                    api_version=os.getenv("AZURE_API_VERSION"),
+                )
+
+                # You want to use the local fastapi server
+                # client = openai.OpenAI(
+                #     base_url="http://localhost:8000/v1",  # note the /v1 suffix
+                #     default_headers={"X-Proxy-Key": os.getenv("LOCAL_FAST_API_KEY")},
+                # )
+    return client
+
+
+def debug_api():
     models = [os.getenv("AZURE_META_AGENT_MODEL"), os.getenv("AZURE_AGENT_MODEL")]
     for model in models:
         print(f"Model: {model}")
-        test_api_response = client.chat.completions.create(
+        test_api_response = get_client().chat.completions.create(
             model=model,
             messages=[
                 # {"role": "system", "content": "You are a helpful assistant."},
@@ -53,10 +100,37 @@ if os.getenv("DEBUG_API", None) is not None:
         print(f"Prompt tokens: {prompt_tokens}, Completion tokens: {completion_tokens}")
         breakpoint()
 
-from utils import bootstrap_confidence_interval, format_multichoice_question, random_id
+
+def is_rate_limit_error(e):
+    # compare by name so that `openai` does not need to be imported here
+    return type(e).__name__ == "RateLimitError"
+
 
 Info = namedtuple("Info", ["name", "author", "content", "iteration_idx"])
 
+
+class LazyInfo(Info):
+    """
+    Output Info of an agent call running in the background (--lazy_agents).
+    Agents take it as input unresolved; reading it (`content`, unpacking,
+    indexing) waits for the reply and gives the plain value, so forward() code
+    sees real strings as without lazy calls.
+    """
+
+    __slots__ = ()
+
+    @property
+    def content(self):
+        content = tuple.__getitem__(self, 2)
+        return content.data if isinstance(content, LazyContent) else content
+
+    def __iter__(self):
+        return tuple.__iter__(resolve(self))
+
+    def __getitem__(self, index):
+        return tuple.__getitem__(resolve(self), index)
+
+
 FORMAT_INST = (
     lambda request_keys: f"""Reply EXACTLY with the following JSON format.\n{str(request_keys)}\nDO NOT MISS ANY REQUEST FIELDS and ensure that your response is a well-formed JSON object!\n"""
 )
@@ -65,47 +139,441 @@ SYSTEM_MSG = ""
 
 PRINT_LLM_DEBUG = False
 SEARCHING_MODE = True
+# adaptive limit on in-flight agent requests, see `get_agent_limiter`
+AGENT_LIMITER = None
+# constrain agent replies with strict JSON schemas (--json_schema)
+JSON_SCHEMA_MODE = False
+SCHEMA_UNSUPPORTED_MODELS = set()
+MISSING_FIELDS_MAX_TOKENS = 1024
+AGENT_MAX_TOKENS = 4096
+# pre-flight check of agent prompts against the context window (--context_policy)
+CONTEXT_POLICY = ["fail_fast"]
+CONTEXT_WINDOW = None
+# by model name, a deployment gets the window of the longest name it contains
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-35-turbo": 16385,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+    "o3-mini": 200000,
+    "o4-mini": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+# chat message framing, not counted by count_prompt_tokens
+CONTEXT_MARGIN = 64
+THINKING_KEEP_TOKENS = 256
+# calibration of the option probabilities of score_options (--scoring_temperature)
+SCORING_TEMPERATURE = 1.0
+# the "(A) ..." option lines of the task, as formatted by load_samples
+OPTION_PATTERN = re.compile(r"^\(([A-Z])\) ", re.MULTILINE)
+CONTEXT_TOO_LONG_MESSAGE = (
+    "The context is too long. Please try to design the agent to have shorter context."
+)
+# run agent calls in the background and return lazy outputs (--lazy_agents)
+LAZY_AGENTS = False
+# set while the test set is evaluated through the Batch API (--batch_eval)
+BATCH_COLLECTOR = None
+BATCH_MODEL = None
 
 
-@backoff.on_exception(backoff.expo, openai.RateLimitError)
-def get_json_response_from_gpt(msg, model, system_message, temperature=0.5):
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
+def get_agent_limiter(args):
+    global AGENT_LIMITER
+    if AGENT_LIMITER is None and args.adaptive_concurrency:
+        os.makedirs(args.save_dir, exist_ok=True)
+        AGENT_LIMITER = AIMDLimiter(
+            initial=args.max_workers,
+            min_limit=args.min_concurrency,
+            max_limit=args.max_concurrency,
+            latency_target=args.latency_target,
+            log_path=os.path.join(args.save_dir, f"{args.expr_name}_concurrency.jsonl"),
+        )
+    return AGENT_LIMITER
+
+
+@lru_cache(maxsize=1024)
+def get_system_prompt(role, output_fields: tuple) -> str:
+    """The system prompt only depends on the role and the output fields."""
+    output_fields_and_description = {
+        key: (
+            f"Your {key}."
+            if not "answer" in key
+            else f"Your {key}. Return ONLY the alphabet choice, i.e. A or B or C or D."
+        )
+        for key in output_fields
+    }
+    return ROLE_DESC(role) + "\n\n" + FORMAT_INST(output_fields_and_description)
+
+
+class InfoRenderCache:
+    """
+    Rendered prompt blocks of Info objects, memoized by identity.
+
+    Agents such as Reflexion, QD or debate pass the same Info objects again and
+    again in growing input lists; each one is only formatted (and tokenized) once.
+    An entry keeps a reference to its Info so that its id cannot be reused.
+    """
+
+    def __init__(self, maxsize=65536) -> None:
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.render_time = 0.0
+        self.n_prompts = 0
+
+    @staticmethod
+    def format_block(input_info, is_self) -> str:
+        field_name, author, content, iteration_idx = input_info
+        if is_self:
+            author += " (yourself)"
+        if field_name == "task":
+            return f"# Your Task:\n{content}\n\n"
+        elif iteration_idx != -1:
+            return f"### {field_name} #{iteration_idx + 1} by {author}:\n{content}\n\n"
+        else:
+            return f"### {field_name} by {author}:\n{content}\n\n"
+
+    def _entry(self, input_info, is_self):
+        key = (id(input_info), is_self)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is input_info:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = [input_info, self.format_block(input_info, is_self), None]
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def render(self, input_info, is_self) -> str:
+        return self._entry(input_info, is_self)[1]
+
+    def n_tokens(self, input_info, is_self) -> int:
+        entry = self._entry(input_info, is_self)
+        if entry[2] is None:
+            entry[2] = count_tokens(entry[1])
+        return entry[2]
+
+    def record(self, render_time):
+        with self._lock:
+            self.n_prompts += 1
+            self.render_time += render_time
+
+    def stats(self) -> dict:
+        return {
+            "n_prompts": self.n_prompts,
+            "render_time": self.render_time,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+        }
+
+
+INFO_RENDER_CACHE = InfoRenderCache()
+
+
+def chat_completion(
+    model, messages, limiter=None, batchable=False, priority=None, **kwargs
+):
+    """
+    Send one chat completion request through the client-side limits: the
+    per-model RPM/TPM buckets and, if given, the adaptive concurrency `limiter`.
+    In batch evaluation, `batchable` requests wait for the next batch instead.
+
+    The proxy (scripts/proxy.py) admits requests by `priority`: "meta" (the
+    meta agent) > "agent" (forward() during search) > "batch" (test-set
+    evaluation), the default depending on SEARCHING_MODE. A request `timeout`
+    is sent as its deadline, so that the proxy sheds it rather than admitting
+    it too late. Azure ignores both headers.
+    """
+    if batchable and BATCH_COLLECTOR is not None:
+        kwargs.pop("timeout", None)
+        return BATCH_COLLECTOR.request(
+            {"model": BATCH_MODEL or model, "messages": messages, **kwargs}
+        )
+    start_time = time.perf_counter()
+    rate_limiter = get_rate_limiter(model)
+    est_tokens = 0
+    if rate_limiter is not None:
+        est_tokens = sum(
+            count_tokens(message["content"]) for message in messages
+        ) + kwargs.get("max_tokens", 0)
+        rate_limiter.acquire(est_tokens)
+    try:
+        with limiter.slot() if limiter is not None else nullcontext():
+            trace_span = current_span()
+            if trace_span is not None:
+                # time spent in the client-side rate and concurrency limits
+                trace_span.set(wait_seconds=time.perf_counter() - start_time)
+            response = get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                extra_headers=proxy_headers(priority, kwargs.get("timeout")),
+                **kwargs,
+            )
+    except Exception:
+        if rate_limiter is not None:
+            # a refused request does not consume tokens
+            rate_limiter.reconcile(est_tokens, 0)
+        raise
+    if rate_limiter is not None and response.usage is not None:
+        rate_limiter.reconcile(
+            est_tokens, response.usage.prompt_tokens + response.usage.completion_tokens
+        )
+    return response
+
+
+def proxy_headers(priority=None, timeout=None):
+    if priority is None:
+        priority = "agent" if SEARCHING_MODE else "batch"
+    headers = {"X-Proxy-Priority": priority}
+    if timeout is not None:
+        headers["X-Proxy-Deadline"] = f"{timeout:.1f}"
+    return headers
+
+
+def request_json(
+    messages, model, temperature, max_tokens=AGENT_MAX_TOKENS, output_fields=None
+):
+    """
+    Request a JSON object, charged to the budget of the running question.
+
+    With JSON_SCHEMA_MODE, the reply is constrained to `output_fields` by a strict
+    JSON schema, unless the deployment of `model` rejected it before.
+    """
+    # never wait for a reply longer than the question has left
+    budget = current_budget()
+    request_kwargs = {}
+    if budget is not None and budget.max_seconds is not None:
+        request_kwargs["timeout"] = budget.remaining_seconds()
+    response_format = {"type": "json_object"}
+    if JSON_SCHEMA_MODE and output_fields and model not in SCHEMA_UNSUPPORTED_MODELS:
+        response_format = json_schema_format(output_fields)
+    agent_span = current_span()
+    if agent_span is not None:
+        agent_span.incr("requests")
+    start_time = time.perf_counter()
+    try:
+        with span("chat_completion", model=model) as request_span:
+            response = chat_completion(
+                model=model,
+                messages=messages,
+                limiter=AGENT_LIMITER,
+                batchable=True,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stop=None,
+                response_format=response_format,
+                **request_kwargs,
+            )
+            if request_span is not None and response.usage is not None:
+                request_span.set(
+                    prompt_tokens=response.usage.prompt_tokens,
+                    completion_tokens=response.usage.completion_tokens,
+                )
+    except Exception as e:
+        if response_format["type"] == "json_schema" and "response_format" in str(e):
+            print(f"{model} does not support JSON schemas, fall back to JSON mode")
+            SCHEMA_UNSUPPORTED_MODELS.add(model)
+            return request_json(messages, model, temperature, max_tokens)
+        raise
+    if budget is not None and response.usage is not None:
+        budget.charge(
+            response.usage.prompt_tokens,
+            response.usage.completion_tokens,
+            time.perf_counter() - start_time,
+        )
+    if agent_span is not None and response.usage is not None:
+        agent_span.incr("prompt_tokens", response.usage.prompt_tokens)
+        agent_span.incr("completion_tokens", response.usage.completion_tokens)
+    content = response.choices[0].message.content
+    try:
+        json_dict, repaired = parse_json(content)
+    except MalformedJSONError:
+        record_event("malformed_json")
+        raise
+    if repaired:
+        record_event("repaired_json")
+    # cost = response.usage.completion_tokens / 1000000 * 15 + response.usage.prompt_tokens / 1000000 * 5
+    return json_dict
+
+
+@backoff.on_exception(
+    backoff.expo, Exception, giveup=lambda e: not is_rate_limit_error(e)
+)
+def get_json_response_from_gpt(
+    msg, model, system_message, temperature=0.5, output_fields=None
+):
+    return request_json(
+        [
             {"role": "system", "content": system_message},
             {"role": "user", "content": msg},
         ],
-        temperature=temperature,
-        max_tokens=4096,
-        stop=None,
-        response_format={"type": "json_object"},
+        model,
+        temperature,
+        output_fields=output_fields,
     )
-    content = response.choices[0].message.content
-    json_dict = json.loads(content)
-    # cost = response.usage.completion_tokens / 1000000 * 15 + response.usage.prompt_tokens / 1000000 * 5
-    assert not json_dict is None
-    return json_dict
 
 
-@backoff.on_exception(backoff.expo, openai.RateLimitError)
+@backoff.on_exception(
+    backoff.expo, Exception, giveup=lambda e: not is_rate_limit_error(e)
+)
+def get_missing_fields_from_gpt(
+    msg, model, system_message, previous, missing_fields, temperature=0.5
+):
+    """
+    Follow-up request for the fields missing from a previous reply (`previous`,
+    its raw text), with the reply kept in the context so nothing is redone.
+    """
+    return request_json(
+        [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": msg},
+            {"role": "assistant", "content": previous},
+            {
+                "role": "user",
+                "content": "Your reply is not a complete JSON object. Reply with a JSON object that has only the missing fields: "
+                + ", ".join(f'"{field}"' for field in missing_fields)
+                + ". Keep them consistent with your reply above.",
+            },
+        ],
+        model,
+        temperature,
+        max_tokens=MISSING_FIELDS_MAX_TOKENS,
+        output_fields=missing_fields,
+    )
+
+
+@backoff.on_exception(
+    backoff.expo, Exception, giveup=lambda e: not is_rate_limit_error(e)
+)
 def get_json_response_from_gpt_reflect(msg_list, model, temperature=0.8):
-    response = client.chat.completions.create(
+    response = chat_completion(
         model=model,
         messages=msg_list,
+        priority="meta",
         temperature=temperature,
         max_tokens=4096,
         stop=None,
         response_format={"type": "json_object"},
     )
     content = response.choices[0].message.content
-    json_dict = json.loads(content)
-    assert not json_dict is None
+    json_dict, _ = parse_json(content)
     return json_dict
 
 
+@backoff.on_exception(
+    backoff.expo, Exception, giveup=lambda e: not is_rate_limit_error(e)
+)
+def score_options(messages, model, options="ABCD", top_logprobs=10, temperature=None):
+    """
+    Ask for the answer option as a single token, charged to the budget of the
+    running question.
+
+    Returns:
+    - dict: Probability of each of `options`, from the top logprobs of the
+      token, renormalized over the options and scaled by `temperature`
+      (SCORING_TEMPERATURE by default); empty if neither the logprobs nor the
+      reply name an option.
+    """
+    if temperature is None:
+        temperature = SCORING_TEMPERATURE
+    budget = current_budget()
+    request_kwargs = {}
+    if budget is not None and budget.max_seconds is not None:
+        request_kwargs["timeout"] = budget.remaining_seconds()
+    start_time = time.perf_counter()
+    with span("score_options", model=model):
+        response = chat_completion(
+            model=model,
+            messages=messages,
+            limiter=AGENT_LIMITER,
+            batchable=True,
+            temperature=0,
+            max_tokens=1,
+            logprobs=True,
+            top_logprobs=top_logprobs,
+            **request_kwargs,
+        )
+    if budget is not None and response.usage is not None:
+        budget.charge(
+            response.usage.prompt_tokens,
+            response.usage.completion_tokens,
+            time.perf_counter() - start_time,
+        )
+    choice = response.choices[0]
+    probs = dict.fromkeys(options, 0.0)
+    if getattr(choice, "logprobs", None) is not None and choice.logprobs.content:
+        for top in choice.logprobs.content[0].top_logprobs:
+            option = top.token.strip().lstrip("(").upper()
+            if option in probs:
+                probs[option] += math.exp(top.logprob)
+    probs = {option: prob ** (1 / temperature) for option, prob in probs.items()}
+    total = sum(probs.values())
+    if total == 0:
+        # no logprobs (e.g. not supported by the deployment): trust the reply
+        option = (choice.message.content or "").strip().lstrip("(")[:1].upper()
+        if option not in probs:
+            # not an answer: no guess, so that the failure stays visible
+            return {}
+        probs[option] = total = 1.0
+    return {option: prob / total for option, prob in probs.items()}
+
+
+class ContextTooLong(Exception):
+    """The prompt does not fit the context window, even after CONTEXT_POLICY."""
+
+
+def task_options(input_infos):
+    """Letters of the options of the task Info, "ABCD" if it lists none."""
+    for info in input_infos:
+        if isinstance(info, Info) and info.name == "task":
+            letters = OPTION_PATTERN.findall(str(info.content))
+            if letters:
+                return "".join(dict.fromkeys(letters))
+    return "ABCD"
+
+
+def context_window(model):
+    if CONTEXT_WINDOW is not None:
+        return CONTEXT_WINDOW
+    names = [name for name in MODEL_CONTEXT_WINDOWS if name in (model or "").lower()]
+    if not names:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(names, key=len)]
+
+
+@lru_cache(maxsize=4096)
+def count_text_tokens(text):
+    """count_tokens of system prompts and instructions, repeated by every call."""
+    return count_tokens(text)
+
+
+@lru_cache(maxsize=4096)
+def compress_thinking(info):
+    """
+    `info` with its content cut to its first and last THINKING_KEEP_TOKENS
+    tokens; the same object for equal Infos, so its rendering stays cached.
+    """
+    return info._replace(content=shorten_middle(info.content, THINKING_KEEP_TOKENS))
+
+
 class LLMAgentBase:
     """
     Attributes:
+    - answer_scoring (bool): Answer with one single-token request scored by
+      its logprobs (see `score`) instead of a JSON reply; only the "answer"
+      field is filled, the other output fields are empty.
     """
 
     def __init__(
@@ -115,7 +583,10 @@ class LLMAgentBase:
         role="helpful assistant",
         model=None,
         temperature=0.5,
+        answer_scoring=False,
     ) -> None:
+        if answer_scoring and "answer" not in output_fields:
+            raise ValueError("answer_scoring needs an 'answer' output field")
         self.output_fields = output_fields
         self.agent_name = agent_name
 
@@ -124,87 +595,554 @@ class LLMAgentBase:
             model = os.getenv("AZURE_AGENT_MODEL")
         self.model = model
         self.temperature = temperature
+        self.answer_scoring = answer_scoring
 
         # give each instance a unique id
         self.id = random_id()
 
     def generate_prompt(self, input_infos, instruction) -> str:
+        start_time = time.perf_counter()
         # construct system prompt
-        output_fields_and_description = {
-            key: (
-                f"Your {key}."
-                if not "answer" in key
-                else f"Your {key}. Return ONLY the alphabet choice, i.e. A or B or C or D."
+        system_prompt = get_system_prompt(self.role, tuple(self.output_fields))
+
+        # construct input infos text
+        me = self.__repr__()
+        blocks = [
+            INFO_RENDER_CACHE.render(input_info, input_info.author == me)
+            for input_info in input_infos
+            if isinstance(input_info, Info)
+        ]
+        blocks.append(instruction)
+        prompt = "".join(blocks)
+
+        INFO_RENDER_CACHE.record(time.perf_counter() - start_time)
+        return system_prompt, prompt
+
+    def count_prompt_tokens(self, input_infos, instruction) -> int:
+        """Number of tokens of the prompt, from the per-block token counts."""
+        me = self.__repr__()
+        return (
+            count_text_tokens(get_system_prompt(self.role, tuple(self.output_fields)))
+            + sum(
+                INFO_RENDER_CACHE.n_tokens(input_info, input_info.author == me)
+                for input_info in input_infos
+                if isinstance(input_info, Info)
             )
-            for key in self.output_fields
-        }
-        system_prompt = (
-            ROLE_DESC(self.role) + "\n\n" + FORMAT_INST(output_fields_and_description)
+            + count_text_tokens(instruction)
         )
 
-        # construct input infos text
-        input_infos_text = ""
-        for input_info in input_infos:
-            if isinstance(input_info, Info):
-                (field_name, author, content, iteration_idx) = input_info
-            else:
-                continue
-            if author == self.__repr__():
-                author += " (yourself)"
-            if field_name == "task":
-                input_infos_text += f"# Your Task:\n{content}\n\n"
-            elif iteration_idx != -1:
-                input_infos_text += (
-                    f"### {field_name} #{iteration_idx + 1} by {author}:\n{content}\n\n"
+    def fit_context(self, input_infos, instruction):
+        """
+        Pre-flight check of the prompt size with the local tokenizer: if the
+        prompt and the reply do not fit the context window of the model, apply
+        the CONTEXT_POLICY steps in order until they do.
+
+        Raises:
+        - ContextTooLong: If the prompt still does not fit.
+        """
+        if CONTEXT_WINDOW is None and CONTEXT_POLICY == ["fail_fast"]:
+            # nothing to enforce, the API rejects prompts that are too long
+            return input_infos
+        limit = context_window(self.model) - AGENT_MAX_TOKENS - CONTEXT_MARGIN
+        n_tokens = self.count_prompt_tokens(input_infos, instruction)
+        if n_tokens <= limit:
+            return input_infos
+        record_event("context_overflows")
+        me = self.__repr__()
+        input_infos = list(input_infos)
+        for policy in CONTEXT_POLICY:
+            if policy == "fail_fast":
+                break
+            if policy == "compress_thinking":
+                # longest first
+                candidates = sorted(
+                    (
+                        i
+                        for i, info in enumerate(input_infos)
+                        if isinstance(info, Info)
+                        and "thinking" in info.name
+                        and isinstance(info.content, str)
+                    ),
+                    key=lambda i: -len(input_infos[i].content),
                 )
             else:
-                input_infos_text += f"### {field_name} by {author}:\n{content}\n\n"
+                # oldest iteration first, never the task (iteration -1)
+                candidates = sorted(
+                    (
+                        i
+                        for i, info in enumerate(input_infos)
+                        if isinstance(info, Info) and info.iteration_idx >= 0
+                    ),
+                    key=lambda i: (input_infos[i].iteration_idx, i),
+                )
+            for i in candidates:
+                info = input_infos[i]
+                if info is None:
+                    continue
+                n_tokens -= INFO_RENDER_CACHE.n_tokens(info, info.author == me)
+                if policy == "compress_thinking":
+                    input_infos[i] = compress_thinking(info)
+                    n_tokens += INFO_RENDER_CACHE.n_tokens(
+                        input_infos[i], info.author == me
+                    )
+                else:
+                    input_infos[i] = None
+                if n_tokens <= limit:
+                    record_event(f"context_{policy}")
+                    return [info for info in input_infos if info is not None]
+        raise ContextTooLong(
+            f"{n_tokens} prompt tokens, {limit} available for {self.model} after {CONTEXT_POLICY}"
+        )
 
-        prompt = input_infos_text + instruction
-        return system_prompt, prompt
+    def score(self, input_infos: list, instruction) -> dict:
+        """
+        Ask for the answer as a single option letter with its top logprobs,
+        instead of a JSON reply of up to AGENT_MAX_TOKENS tokens.
+
+        Returns:
+        - dict: Calibrated probability of each option of the task, e.g.
+          {"A": 0.7, "B": 0.2, "C": 0.06, "D": 0.04}; empty if the request
+          failed or named no option.
+        """
+        input_infos, instruction = resolve(input_infos), resolve(instruction)
+        try:
+            input_infos = self.fit_context(input_infos, instruction)
+        except ContextTooLong as e:
+            if SEARCHING_MODE:
+                raise AssertionError(CONTEXT_TOO_LONG_MESSAGE)
+            print(f"Prompt not sent: {e}")
+            return {}
+        _, prompt = self.generate_prompt(input_infos, instruction)
+        budget = current_budget()
+        if budget is not None:
+            budget.start_call()
+        try:
+            probs = score_options(
+                [
+                    {"role": "system", "content": ROLE_DESC(self.role)},
+                    {"role": "user", "content": prompt + OPTION_INSTRUCTION},
+                ],
+                self.model,
+                options=task_options(input_infos),
+            )
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error in option scoring: {e}")
+            if budget is not None:
+                budget.check_time()
+            return {}
+        if not probs:
+            record_event("unscored_answers")
+            return probs
+        record_event("scored_answers")
+        trace_span = current_span()
+        if trace_span is not None:
+            answer = max(probs, key=probs.get)
+            trace_span.set(answer=answer, answer_probability=probs[answer])
+        return probs
 
     def query(self, input_infos: list, instruction, iteration_idx=-1) -> dict:
+        # wait for the lazy outputs of the calls this one depends on
+        input_infos, instruction = resolve(input_infos), resolve(instruction)
+        if self.answer_scoring:
+            probs = self.score(input_infos, instruction)
+            answer = max(probs, key=probs.get) if probs else ""
+            return [
+                Info(
+                    key,
+                    self.__repr__(),
+                    answer if key == "answer" else "",
+                    iteration_idx,
+                )
+                for key in self.output_fields
+            ]
+        try:
+            input_infos = self.fit_context(input_infos, instruction)
+        except ContextTooLong as e:
+            # no API call for a prompt that would be rejected
+            if SEARCHING_MODE:
+                raise AssertionError(CONTEXT_TOO_LONG_MESSAGE)
+            print(f"Prompt not sent: {e}")
+            return [
+                Info(key, self.__repr__(), "", iteration_idx)
+                for key in self.output_fields
+            ]
         system_prompt, prompt = self.generate_prompt(input_infos, instruction)
+        budget = current_budget()
+        if budget is not None:
+            budget.start_call()
+        response_json = {}
+        previous = None
         try:
-            response_json = {}
             response_json = get_json_response_from_gpt(
-                prompt, self.model, system_prompt, self.temperature
+                prompt,
+                self.model,
+                system_prompt,
+                self.temperature,
+                output_fields=self.output_fields,
             )
-            assert len(response_json) == len(
-                self.output_fields
-            ), "not returning enough fields"
+            previous = json.dumps(response_json)
+        except MalformedJSONError as e:
+            previous = e.content
+            print(f"Malformed JSON from LLM: {e}")
         except Exception as e:
             # print(e)
             if "maximum context length" in str(e) and SEARCHING_MODE:
-                raise AssertionError(
-                    "The context is too long. Please try to design the agent to have shorter context."
-                )
+                raise AssertionError(CONTEXT_TOO_LONG_MESSAGE)
             else:
                 print(f"Other error in LLM: {e}")
+            if budget is not None:
+                budget.check_time()
+
+        missing_fields = [key for key in self.output_fields if key not in response_json]
+        if missing_fields and previous is not None:
+            response_json.update(
+                self.ask_missing_fields(system_prompt, prompt, previous, missing_fields)
+            )
 
+        if len(response_json) != len(self.output_fields):
             # try to fill in the missing field
+            n_filled = 0
             for key in self.output_fields:
                 if not key in response_json and len(response_json) < len(
                     self.output_fields
                 ):
                     response_json[key] = ""
+                    n_filled += 1
             for key in copy.deepcopy(list(response_json.keys())):
                 if (
                     len(response_json) > len(self.output_fields)
                     and not key in self.output_fields
                 ):
                     del response_json[key]
+            if n_filled:
+                record_event("wasted_calls")
+                record_event("filled_fields", n_filled)
         output_infos = []
         for key, value in response_json.items():
             info = Info(key, self.__repr__(), value, iteration_idx)
             output_infos.append(info)
         return output_infos
 
+    def ask_missing_fields(self, system_prompt, prompt, previous, missing_fields):
+        """Re-ask only for `missing_fields`; returns the recovered ones."""
+        budget = current_budget()
+        if budget is not None:
+            budget.start_call()
+        record_event("reasks")
+        trace_span = current_span()
+        if trace_span is not None:
+            trace_span.set(reask_fields=",".join(missing_fields))
+        try:
+            response_json = get_missing_fields_from_gpt(
+                prompt,
+                self.model,
+                system_prompt,
+                previous,
+                missing_fields,
+                self.temperature,
+            )
+        except Exception as e:
+            print(f"Error in LLM re-ask: {e}")
+            if budget is not None:
+                budget.check_time()
+            return {}
+        recovered = {
+            key: value for key, value in response_json.items() if key in missing_fields
+        }
+        if len(recovered) == len(missing_fields):
+            record_event("reasks_recovered")
+        return recovered
+
     def __repr__(self):
         return f"{self.agent_name} {self.id}"
 
+    def traced_query(self, input_infos: list, instruction, iteration_idx=-1):
+        with span(
+            self.agent_name,
+            agent_id=self.id,
+            model=self.model,
+            iteration_idx=iteration_idx,
+        ):
+            return self.query(input_infos, instruction, iteration_idx=iteration_idx)
+
+    def lazy_query(self, input_infos: list, instruction, iteration_idx=-1):
+        """
+        Start the query in the background and return its output Infos at once,
+        with LazyContent that waits for the reply when it is used.
+        """
+
+        # forward() may append to the list after the call (e.g. Quality-Diversity)
+        input_infos = list(input_infos)
+
+        def query_fields():
+            output_infos = self.traced_query(input_infos, instruction, iteration_idx)
+            return {info.name: info.content for info in output_infos}
+
+        future = lazy.submit(query_fields)
+        return [
+            LazyInfo(key, self.__repr__(), LazyContent(future, key), iteration_idx)
+            for key in self.output_fields
+        ]
+
+    def __call__(self, input_infos: list, instruction, iteration_idx=-1):
+        if LAZY_AGENTS and in_lazy_scope():
+            return self.lazy_query(input_infos, instruction, iteration_idx)
+        return self.traced_query(input_infos, instruction, iteration_idx)
+
+
+def sample_until_consensus(
+    agent,
+    input_infos,
+    instruction,
+    answer_field="answer",
+    max_samples=10,
+    wave_size=3,
+    threshold=0.9,
+):
+    """
+    Self-consistency with early stopping: query `agent` in concurrent waves of
+    `wave_size` samples and stop once the majority answer is settled, i.e. the
+    posterior probability that it beats the runner-up (`majority_confidence`)
+    reaches `threshold`. At 0.9, three unanimous samples are enough.
+
+    Returns:
+    - tuple: (Info, list) The majority `answer_field` Info, and the output
+      Infos of every sample drawn.
+    """
+    input_infos = list(input_infos)
+
+    def sample(input_infos, instruction):
+        with lazy.eager():
+            return resolve(agent(input_infos, instruction))
+
+    outputs = []
+    votes = Counter()
+    confidence = 0.0
+    with span("sample_until_consensus", max_samples=max_samples) as consensus_span:
+        with ThreadPoolExecutor(max_workers=wave_size) as executor:
+            while len(outputs) < max_samples and confidence < threshold:
+                n = min(wave_size, max_samples - len(outputs))
+                # copied contexts: charged to the question budget, traced below
+                # this span; the samples already overlap, so no lazy calls
+                wave = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        lambda: sample(input_infos, instruction),
+                    )
+                    for _ in range(n)
+                ]
+                for future in wave:
+                    output_infos = future.result()
+                    outputs.append(output_infos)
+                    for info in output_infos:
+                        if info.name == answer_field and str(info.content).strip():
+                            votes[str(info.content).strip()] += 1
+                ranked = [count for _, count in votes.most_common(2)] + [0, 0]
+                if ranked[0]:
+                    confidence = majority_confidence(ranked[0], ranked[1])
+
+        answers = [
+            info
+            for output_infos in outputs
+            for info in output_infos
+            if info.name == answer_field
+        ]
+        majority = votes.most_common(1)[0][0] if votes else None
+        answer = next(
+            (info for info in answers if str(info.content).strip() == majority),
+            answers[0] if answers else Info(answer_field, repr(agent), "", -1),
+        )
+        record_event("consensus_samples", len(outputs))
+        record_event("consensus_saved", max_samples - len(outputs))
+        if consensus_span is not None:
+            consensus_span.set(
+                samples=len(outputs), answer=majority or "", confidence=confidence
+            )
+    return answer, outputs
+
+
+CONFIDENCE_INSTRUCTION = "\n\nAlso give, in 'confidence', the probability that your answer is correct, as a number from 0 to 100."
+OPTION_INSTRUCTION = "\n\nReply ONLY with the letter of the correct option."
+
+
+def parse_confidence(value):
+    """A self-reported confidence ("85", "0.85", "85%") in [0, 1]; 0 if unreadable."""
+    match = re.search(r"\d+(?:\.\d+)?", str(value))
+    if match is None:
+        return 0.0
+    confidence = float(match.group())
+    return min(confidence / 100 if confidence > 1 else confidence, 1.0)
+
+
+class CascadeAgent:
+    """
+    Answers with the cheapest model first and escalates to the next, stronger
+    model only when the confidence in the answer is below `threshold`. Called
+    like LLMAgentBase and returns the same output Infos, whichever tier
+    answered; the usage of each tier is accounted separately.
+
+    Attributes:
+    - models (list): Models from the cheapest to the strongest, by default
+      AZURE_AGENT_MODEL then AZURE_STRONG_AGENT_MODEL.
+    - signal (str): "confidence" (self-reported), "agreement"
+      (`majority_confidence` of `n_samples` samples) or "logprobs" (probability
+      of the answer option; the tiers below the last one answer in
+      answer-scoring mode, with only the answer field filled).
+    - threshold (float): Confidence in [0, 1] needed to keep an answer.
+    """
+
+    SIGNALS = ("confidence", "agreement", "logprobs")
+
+    def __init__(
+        self,
+        output_fields: list,
+        agent_name: str,
+        role="helpful assistant",
+        models=None,
+        temperature=0.5,
+        signal="confidence",
+        threshold=0.8,
+        n_samples=3,
+        answer_field="answer",
+    ) -> None:
+        if signal not in self.SIGNALS:
+            raise ValueError(f"signal must be one of {self.SIGNALS}, got {signal!r}")
+        if signal != "confidence" and answer_field not in output_fields:
+            raise ValueError(f"the {signal!r} signal needs an {answer_field!r} field")
+        if models is None:
+            models = [
+                os.getenv("AZURE_AGENT_MODEL"),
+                os.getenv("AZURE_STRONG_AGENT_MODEL"),
+            ]
+        self.models = [model for model in models if model] or [None]
+        self.output_fields = output_fields
+        self.agent_name = agent_name
+        self.role = role
+        self.temperature = temperature
+        self.signal = signal
+        self.threshold = threshold
+        self.n_samples = n_samples
+        self.answer_field = answer_field
+
+        self.id = random_id()
+
+    def __repr__(self):
+        return f"{self.agent_name} {self.id}"
+
+    def tier_agent(self, model, output_fields):
+        agent = LLMAgentBase(
+            output_fields, self.agent_name, self.role, model, self.temperature
+        )
+        # every tier answers as this agent
+        agent.id = self.id
+        return agent
+
+    def answer_with_confidence(self, model, input_infos, instruction, iteration_idx):
+        """Return the output Infos of `model` and the confidence signal."""
+        if self.signal == "confidence":
+            agent = self.tier_agent(model, self.output_fields + ["confidence"])
+            output_infos = agent.traced_query(
+                input_infos, instruction + CONFIDENCE_INSTRUCTION, iteration_idx
+            )
+            confidence = parse_confidence(
+                next(
+                    (
+                        info.content
+                        for info in output_infos
+                        if info.name == "confidence"
+                    ),
+                    None,
+                )
+            )
+            output_infos = [
+                info for info in output_infos if info.name in self.output_fields
+            ]
+            return output_infos, confidence
+
+        agent = self.tier_agent(model, self.output_fields)
+        if self.signal == "agreement":
+            answer, samples = sample_until_consensus(
+                agent,
+                input_infos,
+                instruction,
+                self.answer_field,
+                max_samples=self.n_samples,
+                wave_size=self.n_samples,
+                threshold=self.threshold,
+            )
+            votes = Counter(
+                str(info.content).strip()
+                for output_infos in samples
+                for info in output_infos
+                if info.name == self.answer_field and str(info.content).strip()
+            )
+            ranked = [count for _, count in votes.most_common(2)] + [0, 0]
+            confidence = majority_confidence(*ranked[:2]) if ranked[0] else 0.0
+            output_infos = (
+                next(output_infos for output_infos in samples if answer in output_infos)
+                if samples
+                else [answer]
+            )
+            return output_infos, confidence
+
+        with span(self.agent_name, agent_id=self.id, model=model):
+            probs = agent.score(input_infos, instruction)
+        answer = max(probs, key=probs.get) if probs else ""
+        output_infos = [
+            Info(
+                key,
+                self.__repr__(),
+                answer if key == self.answer_field else "",
+                iteration_idx,
+            )
+            for key in self.output_fields
+        ]
+        return output_infos, probs.get(answer, 0.0)
+
+    def query(self, input_infos: list, instruction, iteration_idx=-1):
+        input_infos, instruction = resolve(input_infos), resolve(instruction)
+        with span(
+            self.agent_name, agent_id=self.id, cascade=self.signal
+        ) as cascade_span:
+            for tier, model in enumerate(self.models):
+                with usage_tier(f"{tier}:{model}"):
+                    if tier == len(self.models) - 1:
+                        output_infos = self.tier_agent(
+                            model, self.output_fields
+                        ).traced_query(input_infos, instruction, iteration_idx)
+                        confidence = None
+                    else:
+                        output_infos, confidence = self.answer_with_confidence(
+                            model, input_infos, instruction, iteration_idx
+                        )
+                if confidence is None or confidence >= self.threshold:
+                    break
+                record_event("cascade_escalations")
+            record_event(f"cascade_answers_tier{tier}")
+            if cascade_span is not None:
+                cascade_span.set(
+                    tier=tier,
+                    model=model,
+                    confidence=-1.0 if confidence is None else confidence,
+                )
+        return output_infos
+
     def __call__(self, input_infos: list, instruction, iteration_idx=-1):
-        return self.query(input_infos, instruction, iteration_idx=iteration_idx)
+        if LAZY_AGENTS and in_lazy_scope():
+            input_infos = list(input_infos)
+            future = lazy.submit(
+                lambda: {
+                    info.name: info.content
+                    for info in self.query(input_infos, instruction, iteration_idx)
+                }
+            )
+            return [
+                LazyInfo(key, self.__repr__(), LazyContent(future, key), iteration_idx)
+                for key in self.output_fields
+            ]
+        return self.query(input_infos, instruction, iteration_idx)
 
 
 class AgentSystem:
@@ -227,14 +1165,22 @@ def search(args):
         archive = get_init_archive()
         start = 0
 
+    # per-question outcomes of every evaluated candidate, for paired comparisons
+    outcomes_path = os.path.join(args.save_dir, f"{args.expr_name}_outcomes.npz")
+    outcomes = OutcomeMatrix.load(outcomes_path)
+    if args.screen_size:
+        search_ids = question_ids(load_samples(args, "search")[0])
+
     for solution in archive:
         if "fitness" in solution:
             continue
 
         solution["generation"] = "initial"
+        solution["cost_estimate"] = estimate_llm_cost(solution["code"])
         print(f"============Initial Archive: {solution['name']}=================")
         try:
-            acc_list = evaluate_forward_fn(args, solution["code"])
+            diagnostics = {}
+            acc_list = evaluate_forward_fn(args, solution["code"], diagnostics)
         except Exception as e:
             print("During evaluating initial archive:")
             print(e)
@@ -243,73 +1189,193 @@ def search(args):
         fitness_str = bootstrap_confidence_interval(acc_list)
         solution["fitness"] = fitness_str
         solution["accuracy"] = np.mean(acc_list)
+        solution["budget_overruns"] = len(diagnostics["budget_overruns"])
+        solution["eval_usage"] = diagnostics["usage"]
+        outcomes.add(outcome_key(solution), diagnostics["question_ids"], acc_list)
+        outcomes.save(outcomes_path)
+        update_question_index(
+            args, outcome_key(solution), diagnostics["question_ids"], acc_list
+        )
 
         # save results
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         with open(file_path, "w") as json_file:
             json.dump(archive, json_file, indent=4)
 
+    # with --pipeline, the next proposal is generated while the current
+    # candidate is evaluated: (future, archive length it was based on)
+    executor = ThreadPoolExecutor(max_workers=1) if args.pipeline else None
+    speculative = None
+
     for n in range(start, args.n_generation):
         print(f"============Generation {n + 1}=================")
-        system_prompt, prompt = get_prompt(archive)
-        msg_list = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
+        start_time = time.time()
+        proposal = None
+        if speculative is not None:
+            future, snapshot_len = speculative
+            speculative = None
+            try:
+                proposal = future.result()
+            except Exception as e:
+                print("During LLM generate speculative solution:")
+                print(e)
+            if proposal is not None and material_change(
+                archive, snapshot_len, args.pipeline_top_k
+            ):
+                print(
+                    "The archive changed materially, discard the speculative proposal."
+                )
+                proposal = None
         try:
-            next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
-
-            Reflexion_prompt_1, Reflexion_prompt_2 = get_reflexion_prompt(
-                archive[-1] if n > 0 else None
-            )
-            # Reflexion 1
-            msg_list.append({"role": "assistant", "content": str(next_solution)})
-            msg_list.append({"role": "user", "content": Reflexion_prompt_1})
-            next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
-            # Reflexion 2
-            msg_list.append({"role": "assistant", "content": str(next_solution)})
-            msg_list.append({"role": "user", "content": Reflexion_prompt_2})
-            next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
+            if proposal is None:
+                proposal = propose_solution(args, archive, n)
         except Exception as e:
             print("During LLM generate new solution:")
             print(e)
             n -= 1
             continue
+        next_solution, msg_list = proposal
+        print(f"Proposal ready after {time.time() - start_time:.1f}s")
+
+        if executor is not None and n + 1 < args.n_generation:
+            speculative = (
+                executor.submit(propose_solution, args, list(archive), n + 1),
+                len(archive),
+            )
 
         acc_list = []
+        diagnostics = {}
+        duplicate = None
+        screening = None
         for _ in range(args.debug_max):
+            # skip architectures that only differ in comments, names or wording
+            duplicate, similarity = find_duplicate(
+                next_solution.get("code", ""), archive
+            )
+            if duplicate is not None and similarity == 1.0:
+                break
+            if duplicate is not None and similarity >= args.near_duplicate_threshold:
+                print(
+                    f"Near-duplicate of {duplicate['name']} (similarity: {similarity:.3f}), skip evaluation."
+                )
+                next_solution = request_revision(
+                    args,
+                    msg_list,
+                    next_solution,
+                    f"Your implementation is nearly identical (similarity: {similarity:.2f}) to the architecture \"{duplicate['name']}\" in the archive, whose fitness is {duplicate['fitness']}. Evaluating it again would not give new insights. Change the actual control flow or the way the LLM agents interact, not just the instructions, names or constants. Put your new reflection thinking in 'reflection' and the revised 'thought', 'name' and 'code'.",
+                )
+                duplicate = None
+                continue
+            duplicate = None
+
+            # reject designs that are statically too expensive before paying for them
+            cost = estimate_llm_cost(next_solution.get("code", ""))
+            reason = over_budget(cost, args.max_llm_calls, args.max_est_tokens)
+            if reason is not None:
+                print(f"Over budget: {reason}, skip evaluation.")
+                next_solution = request_revision(
+                    args,
+                    msg_list,
+                    next_solution,
+                    f"Your implementation needs {reason}. It is too expensive to evaluate. Revise the code to implement the same thought with fewer LLM calls, e.g. fewer agents, fewer rounds or shorter inputs. Repeat your previous thought in 'thought', and put your thinking for the cheaper revision in 'debug_thought'",
+                )
+                continue
+
             try:
-                acc_list = evaluate_forward_fn(args, next_solution["code"])
+                if args.screen_size:
+                    screening = screen_candidate(
+                        args, next_solution["code"], outcomes, search_ids
+                    )
+                    if screening is not None and not screening["passed"]:
+                        acc_list = screening.pop("acc_list")
+                        diagnostics = screening.pop("diagnostics")
+                        break
+                if screening is None:
+                    diagnostics = {}
+                    acc_list = evaluate_forward_fn(
+                        args, next_solution["code"], diagnostics
+                    )
+                else:
+                    # keep the subset results, evaluate the other questions only
+                    screened = set(screening["diagnostics"]["question_ids"])
+                    rest = [qid for qid in search_ids if qid not in screened]
+                    full_acc_list = screening["acc_list"]
+                    full_diagnostics = screening["diagnostics"]
+                    if rest:
+                        rest_diagnostics = {}
+                        full_acc_list = full_acc_list + evaluate_forward_fn(
+                            args, next_solution["code"], rest_diagnostics, rest
+                        )
+                        full_diagnostics = merge_diagnostics(
+                            full_diagnostics, rest_diagnostics
+                        )
+                    acc_list, diagnostics = full_acc_list, full_diagnostics
+                    screening = None
+                overruns = diagnostics["budget_overruns"]
+                if overruns and (
+                    np.mean(acc_list) < 0.01
+                    or len(overruns) > args.max_overrun_ratio * len(acc_list)
+                ):
+                    raise Exception(
+                        f"{len(overruns)} of {len(acc_list)} questions were aborted and scored 0 because they exceeded the per-question budget, e.g. {overruns[0][1]}. Make the agent use fewer LLM calls, fewer tokens or less time per question."
+                    )
                 if np.mean(acc_list) < 0.01 and SEARCHING_MODE:
                     raise Exception("All 0 accuracy")
                 break
             except Exception as e:
                 print("During evaluation:")
                 print(e)
-                msg_list.append({"role": "assistant", "content": str(next_solution)})
-                msg_list.append(
-                    {
-                        "role": "user",
-                        "content": f"Error during evaluation:\n{e}\nCarefully consider where you went wrong in your latest implementation. Using insights from previous attempts, try to debug the current code to implement the same thought. Repeat your previous thought in 'thought', and put your thinking for debugging in 'debug_thought'",
-                    }
+                # the revised code has not been evaluated yet
+                acc_list = []
+                screening = None
+                next_solution = request_revision(
+                    args,
+                    msg_list,
+                    next_solution,
+                    f"Error during evaluation:\n{e}\nCarefully consider where you went wrong in your latest implementation. Using insights from previous attempts, try to debug the current code to implement the same thought. Repeat your previous thought in 'thought', and put your thinking for debugging in 'debug_thought'",
                 )
-                try:
-                    next_solution = get_json_response_from_gpt_reflect(
-                        msg_list, args.model
-                    )
-                except Exception as e:
-                    print("During LLM generate new solution:")
-                    print(e)
-                    continue
                 continue
-        if not acc_list:
+
+        if duplicate is not None:
+            print(f"Exact duplicate of {duplicate['name']}, reuse its fitness.")
+            next_solution["fitness"] = duplicate["fitness"]
+            next_solution["accuracy"] = duplicate["accuracy"]
+            next_solution["duplicate_of"] = duplicate["name"]
+        elif not acc_list:
             n -= 1
             continue
-
-        fitness_str = bootstrap_confidence_interval(acc_list)
-        next_solution["fitness"] = fitness_str
-        next_solution["accuracy"] = np.mean(acc_list)
+        elif screening is not None:
+            print(
+                f"Screened out: {screening['accuracy'] * 100:.1f}% on {len(acc_list)} discriminative questions, archive median {screening['reference'] * 100:.1f}%"
+            )
+            next_solution["fitness"] = (
+                f"{bootstrap_confidence_interval(acc_list)} on the {len(acc_list)} most discriminative questions only,"
+                f" where the median of the archive is {screening['reference'] * 100:.1f}%; not evaluated further"
+            )
+            next_solution["accuracy"] = None
+            next_solution["screening"] = {
+                key: screening[key] for key in ["accuracy", "reference", "passed"]
+            }
+            next_solution["budget_overruns"] = len(diagnostics["budget_overruns"])
+            next_solution["eval_usage"] = diagnostics["usage"]
+        else:
+            fitness_str = bootstrap_confidence_interval(acc_list)
+            next_solution["fitness"] = fitness_str
+            next_solution["accuracy"] = np.mean(acc_list)
+            next_solution["budget_overruns"] = len(diagnostics["budget_overruns"])
+            next_solution["eval_usage"] = diagnostics["usage"]
         next_solution["generation"] = n + 1
+        # screening rows cover the subset only: in the run's matrix they would
+        # lower the median the next candidates are screened against, in the
+        # index they would bias the item statistics
+        if duplicate is None and screening is None:
+            key = outcome_key(next_solution)
+            outcomes.add(key, diagnostics["question_ids"], acc_list)
+            outcomes.save(outcomes_path)
+            update_question_index(args, key, diagnostics["question_ids"], acc_list)
+            next_solution["paired_vs_best"] = outcomes.compare_to_best(key)
+            print(f"Paired comparison: {next_solution['paired_vs_best']}")
+        next_solution["cost_estimate"] = estimate_llm_cost(next_solution["code"])
 
         if "debug_thought" in next_solution:
             del next_solution["debug_thought"]
@@ -321,6 +1387,159 @@ def search(args):
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         with open(file_path, "w") as json_file:
             json.dump(archive, json_file, indent=4)
+        print(f"Generation {n + 1} took {time.time() - start_time:.1f}s")
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def propose_solution(args, archive, n):
+    """
+    Ask the meta agent for a new solution given `archive`, refined by two
+    Reflexion rounds.
+
+    Returns:
+    - tuple: (solution dict, msg_list of the conversation)
+    """
+    system_prompt, prompt = get_prompt(archive)
+    msg_list = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+    next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
+
+    Reflexion_prompt_1, Reflexion_prompt_2 = get_reflexion_prompt(
+        archive[-1] if n > 0 else None
+    )
+    # Reflexion 1
+    msg_list.append({"role": "assistant", "content": str(next_solution)})
+    msg_list.append({"role": "user", "content": Reflexion_prompt_1})
+    next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
+    # Reflexion 2
+    msg_list.append({"role": "assistant", "content": str(next_solution)})
+    msg_list.append({"role": "user", "content": Reflexion_prompt_2})
+    next_solution = get_json_response_from_gpt_reflect(msg_list, args.model)
+    return next_solution, msg_list
+
+
+def material_change(archive, snapshot_len, top_k):
+    """
+    Whether the solutions added since the archive had `snapshot_len` entries
+    would change a proposal: a new solution among the `top_k` most accurate.
+    Duplicates and failed candidates never are.
+    """
+    ranked = sorted(
+        (sol for sol in archive if sol.get("accuracy") is not None),
+        key=lambda sol: sol["accuracy"],
+        reverse=True,
+    )
+    top = {id(sol) for sol in ranked[:top_k]}
+    return any(
+        id(sol) in top and "duplicate_of" not in sol for sol in archive[snapshot_len:]
+    )
+
+
+def outcome_key(solution):
+    """Row of a solution in the OutcomeMatrix."""
+    return f"{solution['generation']}:{solution['name']}"
+
+
+def question_index_path(args):
+    return os.path.join(args.save_dir, f"{args.dataset_name}_question_index.npz")
+
+
+def update_question_index(args, key, question_ids, acc_list):
+    """
+    Add the outcomes of a candidate to the question index of the dataset, an
+    OutcomeMatrix shared by all the runs on it (reloaded, so that concurrent
+    runs keep each other's rows).
+    """
+    path = question_index_path(args)
+    index = OutcomeMatrix.load(path)
+    index.add(f"{args.expr_name}/{key}", question_ids, acc_list)
+    index.save(path)
+
+
+def screen_candidate(args, code, outcomes, search_ids):
+    """
+    Evaluate `code` on the `args.screen_size` most discriminative validation
+    questions of the question index only, and compare it with the candidates of
+    the archive on them. `outcomes` holds fully evaluated candidates only.
+
+    Returns:
+    - dict or None: None while the index has no discriminative questions or
+      fewer than 3 archive candidates were evaluated on them. Otherwise
+      "acc_list", "diagnostics", "accuracy", "reference" (median accuracy of
+      the archive candidates on the subset) and "passed".
+    """
+    subset = OutcomeMatrix.load(question_index_path(args)).screening_subset(
+        args.screen_size, search_ids
+    )
+    if not subset:
+        return None
+    reference = outcomes.subset_accuracy(subset)
+    reference = reference[~np.isnan(reference)]
+    if len(reference) < 3:
+        return None
+
+    print(f"Screening on {len(subset)} questions")
+    diagnostics = {}
+    acc_list = evaluate_forward_fn(args, code, diagnostics, question_filter=subset)
+    accuracy = float(np.mean(acc_list))
+    return {
+        "acc_list": acc_list,
+        "diagnostics": diagnostics,
+        "accuracy": accuracy,
+        "reference": float(np.median(reference)),
+        "passed": bool(accuracy >= np.median(reference)),
+    }
+
+
+def merge_diagnostics(first, second):
+    """
+    Diagnostics of evaluate_forward_fn on two disjoint question sets, as if the
+    questions of `second` had been evaluated after those of `first`.
+    """
+    n_first = len(first["question_ids"])
+    usage = {
+        key: first["usage"][key] + second["usage"][key]
+        for key in ["llm_calls", "prompt_tokens", "completion_tokens", "wall_time"]
+    }
+    events = Counter(first["usage"]["events"])
+    events.update(second["usage"]["events"])
+    tiers = {}
+    for diagnostics in (first, second):
+        for tier, tier_usage in diagnostics["usage"]["tiers"].items():
+            tiers.setdefault(tier, Counter()).update(tier_usage)
+    usage["events"] = dict(events)
+    usage["tiers"] = {tier: dict(tier_usage) for tier, tier_usage in tiers.items()}
+    return {
+        "budget_overruns": first["budget_overruns"]
+        + [
+            (q_idx + n_first, exceeded) for q_idx, exceeded in second["budget_overruns"]
+        ],
+        "usage": usage,
+        "prompt_rendering": {
+            key: value + second["prompt_rendering"][key]
+            for key, value in first["prompt_rendering"].items()
+        },
+        "question_ids": first["question_ids"] + second["question_ids"],
+    }
+
+
+def request_revision(args, msg_list, solution, feedback):
+    """
+    Send `feedback` on `solution` back to the meta agent and return its revision.
+    The previous solution is returned if the meta agent fails to answer.
+    """
+    msg_list.append({"role": "assistant", "content": str(solution)})
+    msg_list.append({"role": "user", "content": feedback})
+    try:
+        return get_json_response_from_gpt_reflect(msg_list, args.model)
+    except Exception as e:
+        print("During LLM generate new solution:")
+        print(e)
+        return solution
 
 
 def evaluate(args):
@@ -339,6 +1558,9 @@ def evaluate(args):
         with open(eval_file_path, "r") as json_file:
             eval_archive = json.load(json_file)
 
+    outcomes_path = os.path.join(args.save_dir, f"{args.expr_name}_test_outcomes.npz")
+    outcomes = OutcomeMatrix.load(outcomes_path)
+
     current_idx = 0
     while current_idx < len(archive):
         with open(file_path, "r") as json_file:
@@ -349,14 +1571,25 @@ def evaluate(args):
         sol = archive[current_idx]
         print(f"current_gen: {sol['generation']}, current_idx: {current_idx}")
         current_idx += 1
-        try:
-            acc_list = evaluate_forward_fn(args, sol["code"])
-        except Exception as e:
-            print(e)
-            continue
-        fitness_str = bootstrap_confidence_interval(acc_list)
-        sol["test_fitness"] = fitness_str
-        sol["accuracy"] = np.mean(acc_list)
+        if "screening" in sol:
+            # rejected on the screening subset, no test evaluation; kept so
+            # that the evaluated archive stays aligned with the archive
+            print(f"Skip {sol['name']}, screened out during the search.")
+        else:
+            try:
+                diagnostics = {}
+                acc_list = evaluate_forward_fn(args, sol["code"], diagnostics)
+            except Exception as e:
+                print(e)
+                continue
+            fitness_str = bootstrap_confidence_interval(acc_list)
+            sol["test_fitness"] = fitness_str
+            sol["accuracy"] = np.mean(acc_list)
+            outcomes.add(outcome_key(sol), diagnostics["question_ids"], acc_list)
+            outcomes.save(outcomes_path)
+            update_question_index(
+                args, outcome_key(sol), diagnostics["question_ids"], acc_list
+            )
         eval_archive.append(sol)
 
         # save results
@@ -365,7 +1598,38 @@ def evaluate(args):
             json.dump(eval_archive, json_file, indent=4)
 
 
-def evaluate_forward_fn(args, forward_str):
+# args that decide which questions are evaluated and how, sent to queue workers
+EVAL_CONFIG_KEYS = [
+    "dataset_path",
+    "dataset_name",
+    "data_dir",
+    "valid_size",
+    "test_size",
+    "shuffle_seed",
+    "n_repeat",
+    "max_calls_per_question",
+    "max_tokens_per_question",
+    "max_seconds_per_question",
+    "json_schema",
+    "context_policy",
+    "context_window",
+    "scoring_temperature",
+]
+# map [A-Z] to [0-25]
+LETTER_TO_INDEX = {f"{chr(i + 65)}": i for i in range(26)}
+
+WORK_QUEUE = None
+
+
+def get_work_queue(args):
+    global WORK_QUEUE
+    if WORK_QUEUE is None or WORK_QUEUE.path != args.queue_db:
+        WORK_QUEUE = open_work_queue(args.queue_db, lease_seconds=args.lease_seconds)
+    return WORK_QUEUE
+
+
+def load_forward(forward_str):
+    """Define forward() from its code and set it on AgentSystem."""
     # dynamically define forward()
     # modified from https://github.com/luchris429/DiscoPOP/blob/main/scripts/launch_evo.py
     namespace = {}
@@ -378,86 +1642,386 @@ def evaluate_forward_fn(args, forward_str):
         raise AssertionError(f"{func} is not callable")
     setattr(AgentSystem, "forward", func)
 
-    # map [A-Z] to [0-25]
-    LETTER_TO_INDEX = {f"{chr(i + 65)}": i for i in range(26)}
+
+def filter_questions(questions, answers, question_filter=None):
+    """
+    The questions, answers and question ids whose id is in `question_filter`
+    (all if None), in their original order.
+    """
+    ids = question_ids(questions)
+    if question_filter is None:
+        return questions, answers, ids
+    keep = set(question_filter)
+    idxs = [i for i, qid in enumerate(ids) if qid in keep]
+    return (
+        [questions[i] for i in idxs],
+        [answers[i] for i in idxs],
+        [ids[i] for i in idxs],
+    )
+
+
+def score_response(res, answer, q_idx):
+    """Return 1 if the output of forward() is the correct option, else 0."""
+    try:
+        if isinstance(res, str) and res in LETTER_TO_INDEX:
+            predicted_idx = res
+        elif isinstance(res, list):
+            try_res = res[1]
+            predicted_idx = try_res.content
+        elif res.content in LETTER_TO_INDEX:
+            predicted_idx = res.content
+        else:
+            print(f"error in q {q_idx}, no matching")
+            return 0
+    except Exception as e:
+        print(f"error in q {q_idx}: {e}")
+        return 0
+
+    if os.getenv("DEBUG", None) is not None:
+        breakpoint()
+
+    return 1 if predicted_idx == answer else 0
+
+
+def evaluate_question(args, agentSystem, question, answer, q_idx, tracer=None):
+    """
+    Run forward() on one question under its own QuestionBudget and score it,
+    in a root span of `tracer` if given.
+
+    Returns:
+    - dict: "correct" (0 or 1), "exceeded" (the budget overrun or None) and
+      "usage" (the budget summary). Overrun questions score 0.
+    """
+    taskInfo = Info("task", "User", question, -1)
+    with (
+        tracer.span("question", q_idx=q_idx) if tracer is not None else nullcontext()
+    ) as root_span:
+        with question_budget(
+            args.max_calls_per_question,
+            args.max_tokens_per_question,
+            args.max_seconds_per_question,
+        ) as budget:
+            try:
+                with lazy_scope() if LAZY_AGENTS else nullcontext():
+                    res = resolve(agentSystem.forward(taskInfo))
+            except BudgetExceeded:
+                res = None
+        correct = (
+            0 if budget.exceeded is not None else score_response(res, answer, q_idx)
+        )
+        if root_span is not None:
+            root_span.set(
+                correct=correct,
+                llm_calls=budget.calls,
+                prompt_tokens=budget.prompt_tokens,
+                completion_tokens=budget.completion_tokens,
+                exceeded=budget.exceeded or "",
+            )
+    return {"correct": correct, "exceeded": budget.exceeded, "usage": budget.summary()}
+
+
+def get_batch_backend(args):
+    if args.batch_eval == "local":
+        return LocalBatchBackend(
+            lambda **body: get_client().chat.completions.create(**body),
+            max_workers=args.max_workers,
+        )
+    return OpenAIBatchBackend(
+        get_client(),
+        endpoint=args.batch_endpoint,
+        poll_interval=args.batch_poll_interval,
+    )
+
+
+def run_questions(args, questions, answers, q_idxs=None, run_name=None):
+    """
+    Evaluate the current forward() on the questions in parallel. With
+    `--trace_dir`, the spans of every question are exported as `run_name`.
+
+    With `--batch_eval`, the test set runs through the Batch API: all questions
+    run at once and their LLM requests are sent in waves of batch files.
+
+    Yields:
+    - dict: The result of evaluate_question, in the order of `questions`.
+    """
+    if q_idxs is None:
+        q_idxs = range(len(questions))
+    max_workers = min(len(questions), args.max_workers) if args.multiprocessing else 1
+    limiter = get_agent_limiter(args)
+    if limiter is not None and args.multiprocessing:
+        # threads are cheap, the limiter decides how many requests are in flight
+        max_workers = min(len(questions), args.max_concurrency)
+
+    global BATCH_COLLECTOR
+    collector = None
+    if args.batch_eval is not None and not SEARCHING_MODE:
+        collector = BatchCollector(
+            get_batch_backend(args),
+            len(questions),
+            args.batch_dir or os.path.join(args.save_dir, "batches"),
+            run_name or "eval",
+            url=args.batch_endpoint,
+            idle_seconds=args.batch_idle_seconds,
+        )
+        BATCH_COLLECTOR = collector
+        # a question waits for whole batches, only the call / token limits apply
+        args = argparse.Namespace(**{**vars(args), "max_seconds_per_question": None})
+        max_workers = len(questions)
+
+    def run_one(task):
+        try:
+            return evaluate_question(args, agentSystem, *task, tracer=tracer)
+        finally:
+            if collector is not None:
+                collector.unit_done()
+
+    tracer = Tracer() if args.trace_dir is not None and run_name else None
+    agentSystem = AgentSystem()
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor, tqdm(
+            total=len(questions)
+        ) as pbar:
+            for result in executor.map(run_one, zip(questions, answers, q_idxs)):
+                if limiter is not None:
+                    pbar.set_postfix(limiter.stats(), refresh=False)
+                pbar.update()
+                yield result
+    finally:
+        if collector is not None:
+            collector.close()
+            BATCH_COLLECTOR = None
+            print(f"Sent {collector.n_requests} requests in {collector.waves} batches")
+        # here, so that it also runs when the caller stops iterating after
+        # the last result (e.g. zip) or on an error
+        if tracer is not None:
+            trace_path = tracer.export(args.trace_dir, run_name)
+            slowest = ", ".join(
+                f"q{root_span.attributes['q_idx']} {root_span.duration:.1f}s"
+                for root_span in tracer.slowest()
+            )
+            print(f"Trace saved to {trace_path}, slowest questions: {slowest}")
+
+
+def run_questions_on_queue(args, forward_str, mode, n_questions, question_filter=None):
+    """
+    Submit one task per question to the work queue and wait for the workers
+    (`adas worker --queue_db ...`) to return all results.
+
+    Raises:
+    - TaskError: If forward() raised on a worker, with its error.
+    """
+    queue = get_work_queue(args)
+    config = {key: getattr(args, key) for key in EVAL_CONFIG_KEYS}
+    config["mode"] = mode
+    config["question_ids"] = question_filter
+    config["agent_model"] = os.getenv("AZURE_AGENT_MODEL")
+    cid = queue.submit(forward_str, config, n_questions)
+    print(f"Submitted candidate {cid} to {args.queue_db}")
+
+    with tqdm(total=n_questions) as pbar:
+        while True:
+            n_done, _ = queue.progress(cid)
+            pbar.update(n_done - pbar.n)
+            if n_done >= n_questions:
+                break
+            time.sleep(args.poll_interval)
+    error = queue.error(cid)
+    if error is not None:
+        raise TaskError(error)
+    return queue.results(cid)
+
+
+def evaluate_forward_fn(args, forward_str, diagnostics=None, question_filter=None):
+    """
+    Evaluate `forward_str` on the samples of the current mode (only those whose
+    id is in `question_filter`, if given), in this process or, with
+    `--queue_db`, on the workers of the work queue.
+
+    Each question runs under its own QuestionBudget. If `diagnostics` (dict) is
+    given, it is filled with the budget overruns, the total LLM usage and the
+    ids of the questions (in the order of the returned acc_list).
+    """
+    load_forward(forward_str)
+
     if SEARCHING_MODE:
         mode = "search"
     else:
         mode = "evaluation"
-    questions, answers = load_samples(args, mode)
+    questions, answers, ids = filter_questions(
+        *load_samples(args, mode), question_filter
+    )
 
     print(f"problem length: {len(questions)}")
-    max_workers = min(len(questions), args.max_workers) if args.multiprocessing else 1
-
-    task_queue = []
-    for q in questions:
-        taskInfo = Info("task", "User", q, -1)
-        task_queue.append(taskInfo)
-
-    agentSystem = AgentSystem()
 
-    acc_list = []
     if os.getenv("DEBUG", None) is not None:
-        response = agentSystem.forward(task_queue[0])
+        agentSystem = AgentSystem()
+        response = agentSystem.forward(Info("task", "User", questions[0], -1))
         breakpoint()
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(
-            tqdm(executor.map(agentSystem.forward, task_queue), total=len(task_queue))
-        )
+    render_stats = INFO_RENDER_CACHE.stats()
 
-    for q_idx, res in enumerate(results):
-        try:
-            if isinstance(res, str) and res in LETTER_TO_INDEX:
-                predicted_idx = res
-            elif isinstance(res, list):
-                try_res = res[1]
-                predicted_idx = try_res.content
-            elif res.content in LETTER_TO_INDEX:
-                predicted_idx = res.content
-            else:
-                print(f"error in q {q_idx}, no matching")
-                acc_list.append(0)
-                continue
-        except Exception as e:
-            acc_list.append(0)
-            print(f"error in q {q_idx}: {e}")
-            continue
+    if args.queue_db is not None:
+        results = run_questions_on_queue(
+            args, forward_str, mode, len(questions), question_filter
+        )
+    else:
+        code_hash = hashlib.sha1(forward_str.encode("utf-8")).hexdigest()[:8]
+        run_name = f"{os.path.basename(args.expr_name or 'eval')}_{mode}_{code_hash}"
+        results = list(run_questions(args, questions, answers, run_name=run_name))
 
-        if os.getenv("DEBUG", None) is not None:
-            breakpoint()
+    acc_list = [result["correct"] for result in results]
+    budget_overruns = [
+        (q_idx, result["exceeded"])
+        for q_idx, result in enumerate(results)
+        if result["exceeded"] is not None
+    ]
+    usage = {
+        key: sum(result["usage"].get(key, 0) for result in results)
+        for key in ["llm_calls", "prompt_tokens", "completion_tokens", "wall_time"]
+    }
+    events = Counter()
+    tiers = {}
+    for result in results:
+        events.update(result["usage"].get("events", {}))
+        for tier, tier_usage in result["usage"].get("tiers", {}).items():
+            tiers.setdefault(tier, Counter()).update(tier_usage)
+    usage["events"] = dict(events)
+    usage["tiers"] = {tier: dict(tier_usage) for tier, tier_usage in tiers.items()}
+    render_stats = {
+        key: value - render_stats[key]
+        for key, value in INFO_RENDER_CACHE.stats().items()
+    }
+    if render_stats["n_prompts"]:
+        print(
+            f"prompt rendering: {render_stats['render_time'] * 1e3:.1f} ms for {render_stats['n_prompts']} prompts"
+        )
+    if events:
+        print(f"LLM replies: {dict(events)}")
+    for tier, tier_usage in sorted(tiers.items()):
+        print(
+            f"cascade tier {tier}: {tier_usage['calls']} calls, {tier_usage['prompt_tokens']} + {tier_usage['completion_tokens']} tokens, {tier_usage['seconds']:.1f}s"
+        )
+    if budget_overruns:
+        print(f"{len(budget_overruns)} questions exceeded the budget")
+    if diagnostics is not None:
+        diagnostics["budget_overruns"] = budget_overruns
+        diagnostics["usage"] = usage
+        diagnostics["prompt_rendering"] = render_stats
+        diagnostics["question_ids"] = ids
 
-        if predicted_idx == answers[q_idx]:
-            acc_list.append(1)
-        else:
-            acc_list.append(0)
     print(
         f"acc: {bootstrap_confidence_interval(acc_list)}\nmean acc: {np.mean(acc_list)}"
     )
     return acc_list
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    # parser.add_argument('--dataset', type=str, default="MedQA")
-    parser.add_argument(
-        "--dataset_path", type=str, default="xk-huang/medagents-benchmark"
-    )
-    parser.add_argument("--dataset_name", type=str, default="MedQA")
-    parser.add_argument("--valid_size", type=int, default=128)
-    parser.add_argument("--test_size", type=int, default=800)
-    parser.add_argument("--shuffle_seed", type=int, default=0)
-    parser.add_argument("--n_repeat", type=int, default=1)
-    parser.add_argument("--multiprocessing", action="store_true", default=True)
-    parser.add_argument("--max_workers", type=int, default=48)
-    parser.add_argument("--debug", action="store_true", default=True)
-    parser.add_argument("--save_dir", type=str, default="outputs/")
-    parser.add_argument("--expr_name", type=str, default=None)
-    parser.add_argument("--n_generation", type=int, default=30)
-    parser.add_argument("--debug_max", type=int, default=3)
-    parser.add_argument("--model", type=str, default=None)
-
-    args = parser.parse_args()
+def run_worker(args):
+    """
+    Pull (candidate, question) tasks from the work queue at `args.queue_db`, run
+    forward() and push the per-question results back, until the queue has been
+    empty for `args.worker_idle_timeout` seconds (forever if None).
+    """
+    global SEARCHING_MODE, JSON_SCHEMA_MODE, CONTEXT_POLICY, CONTEXT_WINDOW
+    global SCORING_TEMPERATURE
+
+    configure_api(args)
+    queue = get_work_queue(args)
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Worker {worker} serving {args.queue_db}")
+
+    # renew the leases while the tasks run, so that only dead workers lose them
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(args.lease_seconds / 3):
+            queue.renew(worker)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    samples = {}
+    idle_since = time.time()
+    try:
+        while True:
+            tasks = queue.lease(worker, args.max_workers)
+            if not tasks:
+                if (
+                    args.worker_idle_timeout is not None
+                    and time.time() - idle_since > args.worker_idle_timeout
+                ):
+                    break
+                time.sleep(args.poll_interval)
+                continue
+
+            cid = tasks[0][0]
+            q_idxs = [q_idx for _, q_idx in tasks]
+            code, config = queue.get_candidate(cid)
+            if config["agent_model"] != os.getenv("AZURE_AGENT_MODEL"):
+                print(
+                    f"Warning: candidate {cid} was submitted for agent model "
+                    f"{config['agent_model']}, this worker uses {os.getenv('AZURE_AGENT_MODEL')}"
+                )
+            worker_args = argparse.Namespace(**{**vars(args), **config})
+            SEARCHING_MODE = config["mode"] == "search"
+            JSON_SCHEMA_MODE = config["json_schema"]
+            CONTEXT_POLICY = config["context_policy"]
+            CONTEXT_WINDOW = config["context_window"]
+            SCORING_TEMPERATURE = config["scoring_temperature"]
+            key = json.dumps(config, sort_keys=True)
+            if key not in samples:
+                samples[key] = filter_questions(
+                    *load_samples(worker_args, config["mode"]),
+                    config.get("question_ids"),
+                )[:2]
+            questions, answers = samples[key]
+
+            print(f"Candidate {cid}: {len(q_idxs)} questions")
+            try:
+                load_forward(code)
+                # the generator first, so that zip runs it to its end
+                for result, q_idx in zip(
+                    run_questions(
+                        worker_args,
+                        [questions[q_idx] for q_idx in q_idxs],
+                        [answers[q_idx] for q_idx in q_idxs],
+                        q_idxs,
+                        run_name=f"{cid}_{worker}_{int(time.time())}",
+                    ),
+                    q_idxs,
+                ):
+                    queue.complete(cid, q_idx, result)
+            except Exception as e:
+                # the design is broken, not the worker: hand the error to the
+                # coordinator, which sends it back to the meta agent
+                print(f"Candidate {cid} failed: {e}")
+                queue.fail(cid, str(e))
+            idle_since = time.time()
+    finally:
+        stop.set()
+
+
+def configure_api(args):
+    global JSON_SCHEMA_MODE, LAZY_AGENTS, BATCH_MODEL, CONTEXT_POLICY, CONTEXT_WINDOW
+    global SCORING_TEMPERATURE
+
+    JSON_SCHEMA_MODE = args.json_schema
+    SCORING_TEMPERATURE = args.scoring_temperature
+    CONTEXT_POLICY = args.context_policy
+    CONTEXT_WINDOW = args.context_window
+    BATCH_MODEL = args.batch_model or os.getenv("AZURE_BATCH_AGENT_MODEL")
+    LAZY_AGENTS = args.lazy_agents
+    if LAZY_AGENTS:
+        lazy.configure(args.max_concurrency)
+    # e.g. '{"gpt-4o": {"rpm": 400, "tpm": 200000}, "*": {"rpm": 1000}}'
+    rate_limits = args.rate_limits or os.getenv("ADAS_RATE_LIMITS")
+    if rate_limits:
+        configure_rate_limits(rate_limits)
+
+    if os.getenv("DEBUG_API", None) is not None:
+        debug_api()
+
+
+def main(args, run_search=True, run_evaluate=True):
+    global SEARCHING_MODE
 
     if args.expr_name is None:
         args.expr_name = f"{args.dataset_name}_{os.getenv('AZURE_AGENT_MODEL')}_results"
@@ -468,12 +2032,22 @@ if __name__ == "__main__":
     print(f"Meta agent model: {os.getenv('AZURE_META_AGENT_MODEL')}")
     print(f"Experiment name: {args.expr_name}")
 
-    # search
-    SEARCHING_MODE = True
-    print("=============Searching=================")
-    search(args)
+    configure_api(args)
+
+    if run_search:
+        # search
+        SEARCHING_MODE = True
+        print("=============Searching=================")
+        search(args)
+
+    if run_evaluate:
+        # evaluate
+        SEARCHING_MODE = False
+        print("=============Evaluating=================")
+        evaluate(args)
 
-    # evaluate
-    SEARCHING_MODE = False
-    print("=============Evaluating=================")
-    evaluate(args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_search_args(parser)
+    main(parser.parse_args())
@@ -0,0 +1,209 @@
+"""
+Spans of the LLM calls made by forward(), for per-question timelines.
+
+`Tracer.span` opens a root span (one per question); `span` opens a child of the
+current span and is a no-op outside of a trace, so instrumented code costs
+nothing when tracing is off. Finished spans are exported as a Chrome trace
+(chrome://tracing, https://ui.perfetto.dev) and as OTLP JSON.
+
+The current span is a context variable: threads started by forward() itself do
+not inherit it unless they run in a copied context (`contextvars.copy_context`).
+"""
+
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    Attributes:
+    - name (str): Span name, e.g. the agent name.
+    - trace_id (str): 32 hex digits, shared by all spans of one question.
+    - span_id (str): 16 hex digits.
+    - parent_id (str or None): span_id of the parent span.
+    - start_ns, end_ns (int): Unix time in nanoseconds.
+    - attributes (dict): str, int, float or bool values.
+    - error (str or None): The exception that ended the span, if any.
+    """
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.thread_id = threading.get_ident()
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + n
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Tracer:
+    """Collects the finished spans of one evaluation."""
+
+    def __init__(self) -> None:
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _run(self, span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def span(self, name, **attributes):
+        """Open a root span, the start of a new trace."""
+        return self._run(Span(self, name, secrets.token_hex(16), None, attributes))
+
+    def export_chrome_trace(self, path):
+        """
+        Write the spans as Chrome trace events: one process per root span
+        (question), one row per thread.
+        """
+        pids = {}
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start_ns):
+            if span.trace_id not in pids:
+                pids[span.trace_id] = len(pids)
+            args = dict(span.attributes)
+            if span.error is not None:
+                args["error"] = span.error
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "root" if span.parent_id is None else "llm",
+                    "ph": "X",
+                    "ts": span.start_ns / 1e3,
+                    "dur": (span.end_ns - span.start_ns) / 1e3,
+                    "pid": pids[span.trace_id],
+                    "tid": span.thread_id,
+                    "args": args,
+                }
+            )
+        for span in self.spans:
+            if span.parent_id is None:
+                label = ", ".join(f"{k}={v}" for k, v in span.attributes.items())
+                events.append(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": pids[span.trace_id],
+                        "args": {"name": f"{span.name} ({label})"},
+                    }
+                )
+        _dump({"traceEvents": events, "displayTimeUnit": "ms"}, path)
+
+    def export_otlp(self, path, service_name="adas"):
+        """Write the spans as an OTLP/JSON `ExportTraceServiceRequest`."""
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)}
+                    for key, value in span.attributes.items()
+                ],
+                # STATUS_CODE_OK / STATUS_CODE_ERROR
+                "status": (
+                    {"code": 1}
+                    if span.error is None
+                    else {"code": 2, "message": span.error}
+                ),
+            }
+            if span.parent_id is not None:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        resource = {
+            "attributes": [
+                {"key": "service.name", "value": {"stringValue": service_name}}
+            ]
+        }
+        _dump(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": resource,
+                        "scopeSpans": [{"scope": {"name": "adas"}, "spans": spans}],
+                    }
+                ]
+            },
+            path,
+        )
+
+    def export(self, trace_dir, name):
+        """Write `<name>.trace.json` (Chrome) and `<name>.otlp.json` to `trace_dir`."""
+        os.makedirs(trace_dir, exist_ok=True)
+        chrome_path = os.path.join(trace_dir, f"{name}.trace.json")
+        self.export_chrome_trace(chrome_path)
+        self.export_otlp(os.path.join(trace_dir, f"{name}.otlp.json"))
+        return chrome_path
+
+    def slowest(self, k=3):
+        """The `k` slowest root spans."""
+        roots = [span for span in self.spans if span.parent_id is None]
+        return sorted(roots, key=lambda span: span.duration, reverse=True)[:k]
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # int64 is a string in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _dump(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f)
+
+
+def current_span():
+    """Return the current span, or None outside of a trace."""
+    return _current_span.get()
+
+
+def span(name, **attributes):
+    """Open a child of the current span; a no-op outside of a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        return nullcontext()
+    return parent.tracer._run(
+        Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+    )
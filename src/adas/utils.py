@@ -1,9 +1,15 @@
+import math
 import random
 import string
 from collections import namedtuple
 
 import numpy as np
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 Example = namedtuple(
     "Example", ["question", "choice1", "choice2", "choice3", "choice4", "correct_index"]
 )
@@ -24,6 +30,56 @@ def format_multichoice_question(row):
     return QUERY_TEMPLATE_MULTICHOICE.format(**row)
 
 
+_ENCODINGS = {}
+
+
+def count_tokens(text, encoding_name="o200k_base"):
+    """
+    Count the tokens of `text` with tiktoken (the gpt-4o encoding by default).
+    Falls back to ~4 characters per token if tiktoken is not installed or its
+    encoding cannot be loaded (it is downloaded on first use).
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _get_encoding(encoding_name):
+    """The tiktoken encoding, None if it is not available."""
+    if tiktoken is None:
+        return None
+    if encoding_name not in _ENCODINGS:
+        try:
+            _ENCODINGS[encoding_name] = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(
+                f"Cannot load the {encoding_name} encoding ({e}), count ~4 characters per token"
+            )
+            _ENCODINGS[encoding_name] = None
+    return _ENCODINGS[encoding_name]
+
+
+def shorten_middle(text, keep_tokens, encoding_name="o200k_base"):
+    """
+    Keep the first and last `keep_tokens` tokens of `text` and replace the middle
+    by a marker, e.g. for long reasoning that does not fit a prompt.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        keep_chars = keep_tokens * 4
+        if len(text) <= 2 * keep_chars:
+            return text
+        n_omitted = (len(text) - 2 * keep_chars + 3) // 4
+        return f"{text[:keep_chars]}\n[... {n_omitted} tokens omitted ...]\n{text[-keep_chars:]}"
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= 2 * keep_tokens:
+        return text
+    head = encoding.decode(tokens[:keep_tokens])
+    tail = encoding.decode(tokens[-keep_tokens:])
+    return f"{head}\n[... {len(tokens) - 2 * keep_tokens} tokens omitted ...]\n{tail}"
+
+
 def random_id(length=4):
     characters = (
         string.ascii_letters + string.digits
@@ -32,6 +88,20 @@ def random_id(length=4):
     return random_id
 
 
+def majority_confidence(top_votes, runner_up_votes):
+    """
+    Posterior probability that the most voted answer is more likely than the
+    runner-up, with a uniform prior: P(p > 1/2) for p ~ Beta(top + 1, runner_up + 1).
+
+    Returns:
+    - float: e.g. 0.9375 for 3 votes to 0, 0.89 for 4 votes to 1.
+    """
+    a, b = top_votes + 1, runner_up_votes + 1
+    # P(Beta(a, b) > 1/2) = P(Binomial(a + b - 1, 1/2) < a) for integer a, b
+    n = a + b - 1
+    return sum(math.comb(n, j) for j in range(a)) / 2**n
+
+
 def bootstrap_confidence_interval(
     data, num_bootstrap_samples=100000, confidence_level=0.95
 ):
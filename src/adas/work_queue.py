@@ -0,0 +1,431 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS candidates (
+    candidate_id TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    config TEXT NOT NULL,
+    n_questions INTEGER NOT NULL,
+    submitted REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    candidate_id TEXT NOT NULL,
+    q_idx INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    PRIMARY KEY (candidate_id, q_idx)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_until);
+"""
+
+
+class TaskError(Exception):
+    """forward() of a candidate raised on a worker."""
+
+
+def candidate_id(code, config):
+    """Hash of the forward() code and the evaluation config (data split, budgets)."""
+    payload = code + "\n" + json.dumps(config, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class WorkQueue:
+    """
+    SQLite-backed queue of (candidate, question) evaluation tasks, shared by one
+    coordinator and any number of worker processes on the same host. The
+    database runs in WAL mode, which needs shared memory between the processes:
+    do not put it on a network filesystem (NFS, SMB...); use RedisWorkQueue to
+    spread the workers over several hosts.
+
+    A worker leases tasks for `lease_seconds` and renews the lease while it runs
+    them. Tasks whose lease expired (dead or stuck worker) are leased again, up to
+    `max_attempts` times; after that they are completed as failed. If forward()
+    raises, the worker fails the whole candidate with the error (`fail`).
+
+    Attributes:
+    - path (str): Path of the SQLite database.
+    - lease_seconds (float): Lease duration of a task.
+    - max_attempts (int): Maximum number of leases of one task.
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def submit(self, code, config, n_questions):
+        """
+        Enqueue one task per question of a candidate. Submitting the same code
+        and config again reuses the existing tasks (and their results), except
+        those failed by an error, which run again.
+
+        Returns:
+        - str: The candidate id.
+        """
+        cid = candidate_id(code, config)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO candidates VALUES (?, ?, ?, ?, ?)",
+                (cid, code, json.dumps(config), n_questions, time.time()),
+            )
+            conn.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, "
+                "attempts = 0, result = NULL WHERE candidate_id = ? "
+                "AND json_extract(result, '$.error') IS NOT NULL",
+                (cid,),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (candidate_id, q_idx) VALUES (?, ?)",
+                [(cid, q_idx) for q_idx in range(n_questions)],
+            )
+        return cid
+
+    def get_candidate(self, cid):
+        """Return (code, config) of candidate `cid`."""
+        with self._lock:
+            code, config = self._conn.execute(
+                "SELECT code, config FROM candidates WHERE candidate_id = ?", (cid,)
+            ).fetchone()
+        return code, json.loads(config)
+
+    def lease(self, worker, max_tasks):
+        """
+        Lease up to `max_tasks` pending (or expired) tasks of the oldest
+        candidate with work left.
+
+        Returns:
+        - list of (str, int): (candidate_id, q_idx) of the leased tasks.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # give up on tasks that were lost by too many workers
+            failed = json.dumps(
+                {
+                    "correct": 0,
+                    "exceeded": f"task lost by {self.max_attempts} workers",
+                    "usage": {},
+                }
+            )
+            conn.execute(
+                "UPDATE tasks SET status = 'done', result = ? "
+                "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (failed, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT tasks.candidate_id FROM tasks JOIN candidates USING (candidate_id) "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) "
+                "ORDER BY submitted LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return []
+            cid = row[0]
+            q_idxs = [
+                q_idx
+                for (q_idx,) in conn.execute(
+                    "SELECT q_idx FROM tasks WHERE candidate_id = ? "
+                    "AND (status = 'pending' OR (status = 'leased' AND lease_until < ?)) "
+                    "ORDER BY q_idx LIMIT ?",
+                    (cid, now, max_tasks),
+                )
+            ]
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE candidate_id = ? AND q_idx = ?",
+                [(worker, now + self.lease_seconds, cid, q_idx) for q_idx in q_idxs],
+            )
+        return [(cid, q_idx) for q_idx in q_idxs]
+
+    def renew(self, worker):
+        """Extend the leases of all tasks held by `worker`."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, worker),
+            )
+
+    def complete(self, cid, q_idx, result):
+        """Store the result of a task; the first result of a reassigned task wins."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', result = ? "
+                "WHERE candidate_id = ? AND q_idx = ? AND status != 'done'",
+                (json.dumps(result), cid, q_idx),
+            )
+
+    def fail(self, cid, error):
+        """Complete every unfinished task of candidate `cid` with `error`."""
+        result = json.dumps(
+            {"correct": 0, "exceeded": None, "usage": {}, "error": error}
+        )
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', result = ? "
+                "WHERE candidate_id = ? AND status != 'done'",
+                (result, cid),
+            )
+
+    def error(self, cid):
+        """The error that failed candidate `cid`, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT json_extract(result, '$.error') FROM tasks WHERE candidate_id = ? "
+                "AND json_extract(result, '$.error') IS NOT NULL LIMIT 1",
+                (cid,),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def progress(self, cid):
+        """Return (n_done, n_total) of candidate `cid`."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT SUM(status = 'done'), COUNT(*) FROM tasks WHERE candidate_id = ?",
+                (cid,),
+            ).fetchone()
+
+    def results(self, cid):
+        """Per-question results of candidate `cid`, ordered by q_idx (None if not done)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM tasks WHERE candidate_id = ? ORDER BY q_idx", (cid,)
+            ).fetchall()
+        return [
+            json.loads(result) if result is not None else None for (result,) in rows
+        ]
+
+
+# Every task of a candidate is in exactly one of: the `pending` sorted set (by
+# q_idx), the `leased` sorted set (by lease expiry) or the `results` hash. The
+# scripts compute key names from the prefix, so they need one Redis server, not
+# a cluster. Times come from the server clock, the hosts' clocks may differ.
+SUBMIT_LUA = """
+local p, cid = ARGV[1], ARGV[2]
+local candidate = p .. 'candidate:' .. cid
+local pending, leased = p .. 'pending:' .. cid, p .. 'leased:' .. cid
+local results, failed = p .. 'results:' .. cid, p .. 'failed:' .. cid
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('HSETNX', candidate, 'code', ARGV[3])
+redis.call('HSETNX', candidate, 'config', ARGV[4])
+redis.call('HSETNX', candidate, 'n_questions', ARGV[5])
+redis.call('HSETNX', candidate, 'submitted', tostring(now))
+-- tasks failed by an error run again
+for _, q_idx in ipairs(redis.call('SMEMBERS', failed)) do
+    redis.call('HDEL', results, q_idx)
+    redis.call('HDEL', p .. 'attempts:' .. cid, q_idx)
+end
+redis.call('DEL', failed)
+redis.call('HDEL', candidate, 'error')
+for q_idx = 0, tonumber(ARGV[5]) - 1 do
+    if redis.call('HEXISTS', results, q_idx) == 0
+        and not redis.call('ZSCORE', leased, q_idx) then
+        redis.call('ZADD', pending, q_idx, q_idx)
+    end
+end
+if redis.call('ZCARD', pending) + redis.call('ZCARD', leased) > 0 then
+    local submitted = redis.call('HGET', candidate, 'submitted')
+    redis.call('ZADD', p .. 'active', 'NX', submitted, cid)
+end
+"""
+
+LEASE_LUA = """
+local p, worker = ARGV[1], ARGV[2]
+local max_tasks, lease_seconds = tonumber(ARGV[3]), tonumber(ARGV[4])
+local max_attempts, lost = tonumber(ARGV[5]), ARGV[6]
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+for _, cid in ipairs(redis.call('ZRANGE', p .. 'active', 0, -1)) do
+    local pending, leased = p .. 'pending:' .. cid, p .. 'leased:' .. cid
+    local attempts = p .. 'attempts:' .. cid
+    -- tasks of dead or stuck workers: lease them again, or give up on them
+    for _, q_idx in ipairs(redis.call('ZRANGEBYSCORE', leased, '-inf', '(' .. now)) do
+        redis.call('ZREM', leased, q_idx)
+        if tonumber(redis.call('HGET', attempts, q_idx) or 0) >= max_attempts then
+            redis.call('HSETNX', p .. 'results:' .. cid, q_idx, lost)
+        else
+            redis.call('ZADD', pending, q_idx, q_idx)
+        end
+    end
+    local q_idxs = redis.call('ZRANGE', pending, 0, max_tasks - 1)
+    if #q_idxs > 0 then
+        local held = p .. 'worker:' .. worker
+        for _, q_idx in ipairs(q_idxs) do
+            redis.call('ZREM', pending, q_idx)
+            redis.call('ZADD', leased, now + lease_seconds, q_idx)
+            redis.call('HINCRBY', attempts, q_idx, 1)
+            redis.call('SADD', held, cid .. ':' .. q_idx)
+        end
+        redis.call('EXPIRE', held, math.ceil(lease_seconds * 2))
+        table.insert(q_idxs, 1, cid)
+        return q_idxs
+    end
+    if redis.call('ZCARD', leased) == 0 then
+        redis.call('ZREM', p .. 'active', cid)
+    end
+end
+return {}
+"""
+
+RENEW_LUA = """
+local p, worker, lease_seconds = ARGV[1], ARGV[2], tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local held = p .. 'worker:' .. worker
+for _, task in ipairs(redis.call('SMEMBERS', held)) do
+    local cid, q_idx = string.match(task, '^(.*):(%d+)$')
+    local leased = p .. 'leased:' .. cid
+    if redis.call('ZSCORE', leased, q_idx) then
+        redis.call('ZADD', leased, 'XX', now + lease_seconds, q_idx)
+    else
+        redis.call('SREM', held, task)
+    end
+end
+redis.call('EXPIRE', held, math.ceil(lease_seconds * 2))
+"""
+
+COMPLETE_LUA = """
+local p, cid, q_idx = ARGV[1], ARGV[2], ARGV[3]
+if redis.call('HSETNX', p .. 'results:' .. cid, q_idx, ARGV[4]) == 1 then
+    redis.call('ZREM', p .. 'leased:' .. cid, q_idx)
+    redis.call('ZREM', p .. 'pending:' .. cid, q_idx)
+end
+"""
+
+FAIL_LUA = """
+local p, cid = ARGV[1], ARGV[2]
+local candidate, results = p .. 'candidate:' .. cid, p .. 'results:' .. cid
+for q_idx = 0, tonumber(redis.call('HGET', candidate, 'n_questions')) - 1 do
+    if redis.call('HSETNX', results, q_idx, ARGV[4]) == 1 then
+        redis.call('SADD', p .. 'failed:' .. cid, q_idx)
+    end
+end
+redis.call('DEL', p .. 'pending:' .. cid, p .. 'leased:' .. cid)
+redis.call('HSET', candidate, 'error', ARGV[3])
+redis.call('ZREM', p .. 'active', cid)
+"""
+
+
+class RedisWorkQueue:
+    """
+    WorkQueue in Redis, for workers on several hosts: same interface, leases
+    and failure handling. Each operation is one Lua script, so it is atomic
+    across all coordinators and workers.
+
+    Attributes:
+    - path (str): URL of the Redis server.
+    - prefix (str): Prefix of the queue's keys.
+    """
+
+    def __init__(
+        self, path, lease_seconds=600, max_attempts=3, prefix="adas:queue:", client=None
+    ) -> None:
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(path, decode_responses=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self.client = client
+        self._submit = client.register_script(SUBMIT_LUA)
+        self._lease = client.register_script(LEASE_LUA)
+        self._renew = client.register_script(RENEW_LUA)
+        self._complete = client.register_script(COMPLETE_LUA)
+        self._fail = client.register_script(FAIL_LUA)
+
+    def submit(self, code, config, n_questions):
+        cid = candidate_id(code, config)
+        self._submit(args=[self.prefix, cid, code, json.dumps(config), n_questions])
+        return cid
+
+    def get_candidate(self, cid):
+        code, config = self.client.hmget(
+            f"{self.prefix}candidate:{cid}", ["code", "config"]
+        )
+        return code, json.loads(config)
+
+    def lease(self, worker, max_tasks):
+        lost = json.dumps(
+            {
+                "correct": 0,
+                "exceeded": f"task lost by {self.max_attempts} workers",
+                "usage": {},
+            }
+        )
+        leased = self._lease(
+            args=[
+                self.prefix,
+                worker,
+                max_tasks,
+                self.lease_seconds,
+                self.max_attempts,
+                lost,
+            ]
+        )
+        if not leased:
+            return []
+        cid = leased[0]
+        return [(cid, int(q_idx)) for q_idx in leased[1:]]
+
+    def renew(self, worker):
+        self._renew(args=[self.prefix, worker, self.lease_seconds])
+
+    def complete(self, cid, q_idx, result):
+        self._complete(args=[self.prefix, cid, q_idx, json.dumps(result)])
+
+    def fail(self, cid, error):
+        result = json.dumps(
+            {"correct": 0, "exceeded": None, "usage": {}, "error": error}
+        )
+        self._fail(args=[self.prefix, cid, error, result])
+
+    def error(self, cid):
+        return self.client.hget(f"{self.prefix}candidate:{cid}", "error")
+
+    def progress(self, cid):
+        n_done = self.client.hlen(f"{self.prefix}results:{cid}")
+        n_total = self.client.hget(f"{self.prefix}candidate:{cid}", "n_questions")
+        return n_done, int(n_total or 0)
+
+    def results(self, cid):
+        _, n_total = self.progress(cid)
+        if not n_total:
+            return []
+        results = self.client.hmget(f"{self.prefix}results:{cid}", list(range(n_total)))
+        return [
+            json.loads(result) if result is not None else None for result in results
+        ]
+
+
+def open_work_queue(path, lease_seconds=600):
+    """WorkQueue from a `--queue_db` value: a redis:// URL or a SQLite path."""
+    if path.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(path, lease_seconds=lease_seconds)
+    return WorkQueue(path, lease_seconds=lease_seconds)